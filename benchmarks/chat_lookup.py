@@ -0,0 +1,81 @@
+"""
+قياس البحث عن الدردشة النشطة للمستخدم وحجم حالة الدردشة
+
+يقارن المسح الخطي القديم (قاموس لكل دردشة والبحث في كلها عند كل رسالة)
+بفهرس telegram_id -> ride_id في InMemoryChatRegistry، مع 10 آلاف دردشة
+نشطة وخليط من المستخدمين الموجودين وغير الموجودين.
+
+التشغيل من جذر المستودع:
+    python benchmarks/chat_lookup.py
+    CHATS=50000 python benchmarks/chat_lookup.py
+"""
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123:bench")
+
+from middleware.chat_registry import ChatSession, InMemoryChatRegistry
+
+PASSENGER_BASE = 10 ** 6
+DRIVER_BASE = 2 * 10 ** 6
+
+def old_state(ride_id: int) -> dict:
+    return {
+        "ride_id": ride_id, "passenger_id": PASSENGER_BASE + ride_id, "driver_id": DRIVER_BASE + ride_id,
+        "passenger_user_id": ride_id, "driver_user_id": ride_id, "started_at": None, "message_count": 0
+    }
+
+def old_get_active_chat(chats: dict, user_id: int):
+    """البحث القديم: مسح كل الدردشات"""
+    for chat in chats.values():
+        if user_id in (chat.get("passenger_id"), chat.get("driver_id")):
+            return chat
+    return None
+
+def state_size(factory, count: int) -> float:
+    tracemalloc.start()
+    states = [factory(i) for i in range(count)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del states
+    return size / count
+
+def main():
+    count = int(os.environ.get("CHATS", "10000"))
+    registry = InMemoryChatRegistry()
+    old_chats = {}
+    for ride_id in range(count):
+        registry.add(ChatSession(ride_id, PASSENGER_BASE + ride_id, DRIVER_BASE + ride_id, ride_id, ride_id))
+        old_chats[ride_id] = old_state(ride_id)
+
+    # 2000 مستخدم في دردشة و500 بحث عن مستخدم بلا دردشة
+    random.seed(1)
+    user_ids = [random.choice((PASSENGER_BASE, DRIVER_BASE)) + random.randrange(count) for _ in range(2000)]
+    user_ids += [5] * 500
+
+    started = time.perf_counter()
+    for user_id in user_ids:
+        old_get_active_chat(old_chats, user_id)
+    old_lookup = (time.perf_counter() - started) / len(user_ids)
+
+    repeats = 100
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for user_id in user_ids:
+            registry.get_by_user(user_id)
+    new_lookup = (time.perf_counter() - started) / len(user_ids) / repeats
+
+    old_size = state_size(old_state, count)
+    new_size = state_size(lambda i: ChatSession(i, i, i, i, i), count)
+
+    print(f"chats: {count}")
+    print(f"lookup: scan {old_lookup * 1e3:.2f} ms -> index {new_lookup * 1e9:.0f} ns")
+    print(f"per-chat state: dict {old_size:.0f} B -> slots {new_size:.0f} B")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+قياس معالجة التحديثات بالتوازي في KeyedUpdateProcessor
+
+1000 تحديث من 200 مستخدم، وكل معالج يقرأ المستخدم عبر جلسة المعالجات
+المشتركة ثم ينتظر 20 مللي ثانية (محاكاة طلب لتيليجرام). يطبع عدد التحديثات
+في الثانية لكل قيمة من max_concurrent_updates، وهل بقي ترتيب تحديثات كل
+مستخدم.
+
+التشغيل من جذر المستودع (قاعدة SQLite مؤقتة):
+    python benchmarks/concurrent_updates.py
+    C=1,16 N=2000 python benchmarks/concurrent_updates.py
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123:bench")
+os.environ["DB_TYPE"] = "sqlite"
+os.environ["DB_NAME"] = os.path.join(tempfile.mkdtemp(prefix="bench-"), "bench")
+os.environ.setdefault("MAX_CONCURRENT_UPDATES", "64")
+
+from telegram import Update, User as TelegramUser
+from telegram.ext import Application, MessageHandler, filters
+
+from database.database import db_manager
+from database.models import User, UserRole
+from database.queries import get_user_by_telegram_id
+from middleware.update_processor import KeyedUpdateProcessor
+
+USERS = 200
+API_DELAY = 0.02
+
+def make_update(update_id: int, bot) -> Update:
+    user_id = 1000 + update_id % USERS
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+            "text": "x"
+        }
+    }, bot)
+
+async def run(max_concurrent: int, count: int):
+    session = db_manager.get_session_direct()
+    seen = {}
+
+    async def handler(update, context):
+        user_id = update.effective_user.id
+        # القراءة عبر وكيل جلسة المعالجات المشتركة
+        get_user_by_telegram_id(session, user_id)
+        await asyncio.sleep(API_DELAY)
+        seen.setdefault(user_id, []).append(update.update_id)
+
+    application = (
+        Application.builder()
+        .token("1:bench")
+        .concurrent_updates(KeyedUpdateProcessor(max_concurrent, 1024))
+        .updater(None)
+        .build()
+    )
+    application.add_handler(MessageHandler(filters.TEXT, handler))
+
+    # بوت بلا شبكة
+    async def noop():
+        pass
+
+    bot = application.bot
+    bot._unfreeze()
+    bot.initialize = noop
+    bot.shutdown = noop
+    bot._bot_user = TelegramUser(1, "bench", True, username="bench")
+    bot._initialized = True
+
+    async with application:
+        await application.start()
+        started = time.perf_counter()
+        for update_id in range(count):
+            await application.update_queue.put(make_update(update_id, bot))
+        while sum(map(len, seen.values())) < count:
+            await asyncio.sleep(0.005)
+        elapsed = time.perf_counter() - started
+        await application.stop()
+
+    ordered = all(ids == sorted(ids) for ids in seen.values())
+    print(
+        f"max_concurrent={max_concurrent:3d}: {count / elapsed:6.0f} upd/s  "
+        f"per-user order kept={ordered}"
+    )
+
+def main():
+    logging.disable(logging.WARNING)
+    db_manager.init_database()
+    with db_manager.get_session() as session:
+        session.add_all([
+            User(telegram_id=1000 + i, first_name="u", role=UserRole.PASSENGER)
+            for i in range(USERS)
+        ])
+
+    count = int(os.environ.get("N", "1000"))
+    for max_concurrent in map(int, os.environ.get("C", "1,4,16,64").split(",")):
+        asyncio.run(run(max_concurrent, count))
+
+if __name__ == "__main__":
+    main()
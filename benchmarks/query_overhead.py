@@ -0,0 +1,170 @@
+"""
+قياس عبء بايثون لكل استدعاء في الاستعلامات الساخنة
+
+يقارن صيغ session.query(...) القديمة (كما كانت في المعالجات وDebtManager)
+بالجمل المبنية مسبقاً في database/queries.py للاستعلامات الأربعة:
+المستخدم بمعرف التيليجرام، والرحلة المنتظرة، والسائقين المتاحين، وملف السائق.
+
+القاعدة في الذاكرة وصغيرة حتى يكون الفرق هو عمل بايثون (بناء الاستعلام
+ومفتاح ذاكرة الترجمة وتحميل الكائنات) وليس القرص. لكل استعلام يُقاس:
+- البناء فقط: إنشاء الاستعلام دون تنفيذه
+- التنفيذ: البناء والتنفيذ وجلب النتيجة
+
+التشغيل من جذر المستودع:
+    python benchmarks/query_overhead.py
+    CALLS=20000 python benchmarks/query_overhead.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123:bench")
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database.loading import load_profile
+from database.models import Base, DriverProfile, Ride, RideStatus, User, UserRole, UserStatus
+from database.queries import (
+    get_available_drivers, get_driver_profile, get_pending_ride, get_user_by_telegram_id, statement
+)
+
+USERS = 100
+REPEATS = 3
+
+def seed(session):
+    """مستخدمون نصفهم سائقون متاحون، ورحلة منتظرة لكل راكب"""
+    for i in range(USERS):
+        driver = i % 2 == 0
+        user = User(
+            telegram_id=1000 + i, first_name=f"u{i}",
+            role=UserRole.DRIVER if driver else UserRole.PASSENGER,
+            status=UserStatus.ACTIVE, latitude=24.7, longitude=46.7
+        )
+        session.add(user)
+        session.flush()
+        if driver:
+            session.add(DriverProfile(user_id=user.id, is_online=True, is_available=True))
+        else:
+            session.add(Ride(
+                ride_code=f"R{i}", passenger_id=user.id, status=RideStatus.PENDING,
+                pickup_latitude=24.7, pickup_longitude=46.7,
+                destination_latitude=24.8, destination_longitude=46.8
+            ))
+    session.commit()
+
+# الصيغ القديمة (قبل database/queries.py)، بقيم Enum حتى تكون الجملة نفسها
+
+def old_user_by_telegram_id(session, telegram_id):
+    return session.query(User).options(
+        *load_profile("user_driver")
+    ).filter_by(
+        telegram_id=telegram_id
+    ).populate_existing().first()
+
+def old_pending_ride(session, ride_id):
+    return session.query(Ride).options(
+        *load_profile("ride_passenger")
+    ).filter_by(
+        id=ride_id,
+        status=RideStatus.PENDING
+    ).first()
+
+def old_available_drivers(session):
+    return session.query(User, DriverProfile).join(
+        DriverProfile, User.id == DriverProfile.user_id
+    ).filter(
+        User.role == UserRole.DRIVER,
+        User.status == UserStatus.ACTIVE,
+        DriverProfile.is_online == True,
+        DriverProfile.is_available == True,
+        User.latitude.isnot(None),
+        User.longitude.isnot(None)
+    ).all()
+
+def old_driver_profile(session, user_id):
+    return session.query(DriverProfile).options(
+        *load_profile("driver_user")
+    ).filter_by(
+        user_id=user_id
+    ).first()
+
+def old_build(name):
+    """بناء الاستعلام القديم فقط (دون تنفيذ) كما يحدث في كل استدعاء"""
+    def build(session, arg):
+        if name == "user_by_telegram_id":
+            return session.query(User).options(*load_profile("user_driver")).filter_by(telegram_id=arg).populate_existing()
+        if name == "pending_ride_by_id":
+            return session.query(Ride).options(*load_profile("ride_passenger")).filter_by(id=arg, status=RideStatus.PENDING)
+        if name == "available_drivers":
+            return session.query(User, DriverProfile).join(
+                DriverProfile, User.id == DriverProfile.user_id
+            ).filter(
+                User.role == UserRole.DRIVER, User.status == UserStatus.ACTIVE,
+                DriverProfile.is_online == True, DriverProfile.is_available == True,
+                User.latitude.isnot(None), User.longitude.isnot(None)
+            )
+        return session.query(DriverProfile).options(*load_profile("driver_user")).filter_by(user_id=arg)
+    return build
+
+def per_call(fn, session, args, calls: int) -> float:
+    """أفضل زمن لكل استدعاء بالميكروثانية من عدة تكرارات"""
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for i in range(calls):
+            fn(session, args[i % len(args)])
+        best = min(best, time.perf_counter() - start)
+        session.expunge_all()
+    return best / calls * 1e6
+
+def main():
+    calls = int(os.environ.get("CALLS", "5000"))
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, autoflush=False)()
+    seed(session)
+
+    telegram_ids = [user.telegram_id for user in session.query(User).all()]
+    ride_ids = [ride_id for (ride_id,) in session.query(Ride.id).all()]
+    driver_ids = [user_id for (user_id,) in session.query(DriverProfile.user_id).all()]
+    session.expunge_all()
+
+    cases = [
+        ("user_by_telegram_id", telegram_ids,
+         old_user_by_telegram_id, lambda s, arg: get_user_by_telegram_id(s, arg, refresh=True)),
+        ("pending_ride_by_id", ride_ids, old_pending_ride, get_pending_ride),
+        ("available_drivers", [None],
+         lambda s, _: old_available_drivers(s), lambda s, _: get_available_drivers(s)),
+        ("driver_profile_by_user_id", driver_ids, old_driver_profile, get_driver_profile),
+    ]
+
+    # التحقق من أن الصيغتين تعيدان نفس النتيجة قبل القياس
+    for name, args, old, new in cases:
+        old_result, new_result = old(session, args[0]), new(session, args[0])
+        if name == "available_drivers":
+            assert len(old_result) == len(new_result) == USERS // 2, name
+        else:
+            assert old_result is not None and old_result is new_result, name
+    session.expunge_all()
+
+    print(f"{calls} استدعاء، أفضل {REPEATS} تكرارات، ميكروثانية لكل استدعاء\n")
+    print(f"{'الاستعلام':<28}{'بناء قديم':>12}{'بناء جديد':>12}{'تنفيذ قديم':>13}{'تنفيذ جديد':>13}{'التحسن':>9}")
+    for name, args, old, new in cases:
+        build_old = per_call(old_build(name), session, args, calls)
+        build_new = per_call(lambda s, _arg, name=name: statement(name), session, args, calls)
+        run_old = per_call(old, session, args, calls)
+        run_new = per_call(new, session, args, calls)
+        print(
+            f"{name:<28}{build_old:>12.1f}{build_new:>12.2f}"
+            f"{run_old:>13.1f}{run_new:>13.1f}{run_old / run_new:>8.2f}x"
+        )
+
+    session.close()
+    engine.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+قياس توسع وضع العمال المتعددين (SHARD_WORKERS) على أنوية المعالج
+
+يرسل المدخل تحديثات لـ 500 مستخدم إلى 1 و2 و4 عمال، وكل عامل يشغل
+معالجاً يحاكي عمل المطابقة (أقرب 5 سائقين من 3000 بمعادلة هافرساين)،
+ثم يقيس إعادة تشغيل عامل متعطل وانتقال مستخدمي عامل مُستبعد فقط.
+
+التشغيل من جذر المستودع:
+    python benchmarks/shard_scaling.py
+    W=1,2 N=4000 python benchmarks/shard_scaling.py
+"""
+
+import asyncio
+import logging
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123:bench")
+
+from telegram import User
+from telegram.ext import Application, MessageHandler, filters
+
+from utils.sharding import ShardedIngress, rendezvous_worker
+
+DRIVERS = [(24.7 + i * 1e-4, 46.6 + i * 1e-4) for i in range(3000)]
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371 * 2 * math.asin(math.sqrt(h))
+
+def bench_worker(shard):
+    """عامل بمعالج مطابقة فقط (بوت بلا شبكة)"""
+    async def main():
+        async def match(update, context):
+            sorted(DRIVERS, key=lambda driver: haversine(24.7, 46.6, *driver))[:5]
+
+        application = Application.builder().token("1:bench").updater(None).concurrent_updates(8).build()
+        application.add_handler(MessageHandler(filters.TEXT, match))
+
+        async def noop():
+            pass
+
+        bot = application.bot
+        bot._unfreeze()
+        bot.initialize = noop
+        bot.shutdown = noop
+        bot._bot_user = User(1, "bench", True, username="bench")
+        bot._initialized = True
+
+        async with application:
+            await application.start()
+            await shard.serve(application, asyncio.Event())
+            while application.update_queue.qsize():
+                await asyncio.sleep(0.05)
+            await application.stop()
+
+    asyncio.run(main())
+
+def make_update(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+            "text": "x"
+        }
+    }
+
+async def wait_ready(ingress: ShardedIngress):
+    while any(shard.heartbeat.value == 0 for shard in ingress._shards.values()):
+        await asyncio.sleep(0.05)
+
+async def throughput(workers: int, updates: int):
+    ingress = ShardedIngress(bench_worker, workers, 100000, 0.5, 5, 60, 3)
+    ingress.start()
+    await wait_ready(ingress)
+
+    started = time.perf_counter()
+    for update_id in range(updates):
+        await ingress.dispatch(make_update(update_id, 1000 + update_id % 500))
+    await ingress.stop(120)
+    elapsed = time.perf_counter() - started
+
+    per_worker = [shard.received.value for shard in ingress._shards.values()]
+    print(f"workers={workers}: {updates / elapsed:6.0f} updates/s  per-worker={per_worker}")
+
+async def failover():
+    ingress = ShardedIngress(bench_worker, 3, 1000, 0.2, 2, 60, 1)
+    ingress.start()
+    await wait_ready(ingress)
+    users = range(1000, 4000)
+    before = {user: rendezvous_worker(user, ingress.active) for user in users}
+
+    # تعطل أول: يُعاد تشغيل العامل بنفس الرقم فلا يتغير توزيع المستخدمين
+    ingress._shards[1].process.kill()
+    await asyncio.sleep(1.5)
+    print(
+        f"after crash: active={ingress.active} restarts={ingress._shards[1].restarts} "
+        f"alive={ingress._shards[1].process.is_alive()}"
+    )
+
+    # تعطل بعد حد إعادة التشغيل: يُستبعد وينتقل مستخدموه فقط
+    while ingress._shards[1].heartbeat.value == 0:
+        await asyncio.sleep(0.05)
+    ingress._shards[1].process.kill()
+    await asyncio.sleep(1.5)
+    after = {user: rendezvous_worker(user, ingress.active) for user in users}
+    moved = [user for user in users if before[user] != after[user]]
+    owned = sum(1 for user in users if before[user] == 1)
+    print(
+        f"after retirement: active={ingress.active} moved={len(moved)} of {owned} "
+        f"(all from worker 1: {all(before[user] == 1 for user in moved)})"
+    )
+    await ingress.stop(30)
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    updates = int(os.environ.get("N", "2000"))
+    print(f"cpus: {os.cpu_count()}")
+    for workers in map(int, os.environ.get("W", "1,2,4").split(",")):
+        asyncio.run(throughput(workers, updates))
+    asyncio.run(failover())
+
+if __name__ == "__main__":
+    main()
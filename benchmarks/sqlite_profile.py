@@ -0,0 +1,178 @@
+"""
+مقارنة إعدادات SQLite القديمة بملف الإنتاج (WAL + pragmas + كاتب واحد)
+
+القديم: نفس مجمع PostgreSQL (pool_size=20, max_overflow=30) وforeign_keys
+فقط، والكتابة في جلسة عادية. الجديد: DatabaseManager.init_database
+وwrite_session (قفل الكاتب داخل العملية وBEGIN IMMEDIATE).
+
+كل عملية كتابة تقرأ المستخدم ثم تكتب في نفس المعاملة كما تفعل المعالجات:
+- تحديث موقع: UPDATE لإحداثيات المستخدم
+- طلب رحلة: INSERT لرحلة جديدة
+
+يقيس:
+1. التتابعي (عملية بوت واحدة): تحديثات الموقع وطلبات الرحلات في الثانية
+2. التزامن: 4 خيوط كتابة و4 خيوط قراءة معاً، مع عدد أخطاء "database is locked"
+
+التشغيل من جذر المستودع (قواعد مؤقتة):
+    python benchmarks/sqlite_profile.py
+    DURATION=10 READERS=8 python benchmarks/sqlite_profile.py
+"""
+
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123:bench")
+os.environ["DB_TYPE"] = "sqlite"
+os.environ["DB_REPLICA_URL"] = ""
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from config import config
+from database.database import DatabaseManager
+from database.models import Base, Ride, RideStatus, User, UserRole
+
+USERS = 200
+
+def old_profile(path: str):
+    """إعدادات SQLite قبل ملف الإنتاج"""
+    engine = create_engine(
+        f"sqlite:///{path}.db", pool_size=20, max_overflow=30, pool_pre_ping=True, pool_recycle=3600
+    )
+
+    @event.listens_for(engine, "connect")
+    def set_foreign_keys(connection, record):
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine, autoflush=False)
+
+    @contextmanager
+    def write_session():
+        session = session_factory()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    return session_factory, write_session
+
+def tuned_profile(path: str):
+    """ملف الإنتاج الحالي"""
+    config.database.DB_NAME = path
+    manager = DatabaseManager()
+    manager.init_database()
+    return manager.session_factory, manager.write_session
+
+def location_update(session):
+    user = session.query(User).filter_by(telegram_id=random.randrange(USERS)).first()
+    session.query(User).filter_by(id=user.id).update({
+        User.latitude: random.random(),
+        User.longitude: random.random(),
+        User.location_updated_at: datetime.utcnow()
+    }, synchronize_session=False)
+
+def ride_request(session):
+    user = session.query(User).filter_by(telegram_id=random.randrange(USERS)).first()
+    session.add(Ride(
+        passenger_id=user.id, pickup_latitude=1, pickup_longitude=1,
+        destination_latitude=2, destination_longitude=2, status=RideStatus.PENDING,
+        ride_code=f"R-{threading.get_ident()}-{time.time_ns()}"
+    ))
+
+WRITES = {"location": location_update, "ride": ride_request}
+
+def sequential(write_session, duration: float) -> dict:
+    rates = {}
+    for kind, work in WRITES.items():
+        count = 0
+        stop = time.monotonic() + duration
+        while time.monotonic() < stop:
+            with write_session() as session:
+                work(session)
+            count += 1
+        rates[kind] = count / duration
+    return rates
+
+def concurrent(session_factory, write_session, duration: float, readers: int) -> dict:
+    counts = {"location": 0, "ride": 0, "reads": 0, "locked": 0}
+    latencies = []
+    lock = threading.Lock()
+    stop = time.monotonic() + duration
+
+    def writer(kind):
+        while time.monotonic() < stop:
+            try:
+                with write_session() as session:
+                    WRITES[kind](session)
+                with lock:
+                    counts[kind] += 1
+            except OperationalError:
+                with lock:
+                    counts["locked"] += 1
+
+    def reader():
+        while time.monotonic() < stop:
+            started = time.perf_counter()
+            session = session_factory()
+            try:
+                session.query(Ride).filter(Ride.status == RideStatus.PENDING).count()
+                session.query(User).filter_by(telegram_id=random.randrange(USERS)).first()
+                with lock:
+                    counts["reads"] += 1
+                    latencies.append(time.perf_counter() - started)
+            except OperationalError:
+                with lock:
+                    counts["locked"] += 1
+            finally:
+                session.close()
+
+    threads = [threading.Thread(target=writer, args=(kind,)) for kind in WRITES for _ in range(2)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    result = {kind: counts[kind] / duration for kind in ("location", "ride", "reads")}
+    result["read_p99_ms"] = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0
+    result["locked"] = counts["locked"]
+    return result
+
+def main():
+    duration = float(os.environ.get("DURATION", "3"))
+    readers = int(os.environ.get("READERS", "4"))
+    directory = tempfile.mkdtemp(prefix="bench-")
+
+    for name, profile in (("old", old_profile), ("tuned", tuned_profile)):
+        session_factory, write_session = profile(os.path.join(directory, name))
+        with write_session() as session:
+            session.add_all([
+                User(telegram_id=i, first_name="u", role=UserRole.PASSENGER) for i in range(USERS)
+            ])
+
+        rates = sequential(write_session, duration)
+        print(f"{name:5s} sequential: location {rates['location']:5.0f}/s  ride {rates['ride']:5.0f}/s")
+        result = concurrent(session_factory, write_session, duration, readers)
+        print(
+            f"{name:5s} concurrent: location {result['location']:5.0f}/s  ride {result['ride']:5.0f}/s  "
+            f"reads {result['reads']:5.0f}/s (p99 {result['read_p99_ms']:.0f} ms)  locked errors {result['locked']}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+قياس حفظ user_data في UserDataPersistence مقارنة بـ PicklePersistence
+
+كل مستخدم يحمل ride_request كاملاً (كما يحفظه طلب الرحلة). يقيس:
+- الكتابة الأولى لكل المستخدمين
+- دورة حفظ واحدة لـ PTB: 2000 مستخدم أرسلوا تحديثات و200 منهم تغيرت بياناتهم
+- التحميل البارد عند بدء التشغيل
+- PicklePersistence لنفس البيانات: تفريغ كامل واحد، وتقدير الدورة نفسها
+  مع on_flush=False (تفريغ الملف كله لكل مستخدم متغير)
+
+التشغيل من جذر المستودع (الملفات في مجلد مؤقت):
+    python benchmarks/user_data_persistence.py
+    USERS=20000 python benchmarks/user_data_persistence.py
+"""
+
+import asyncio
+import copy
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123:bench")
+
+from telegram.ext import PicklePersistence
+
+from middleware.persistence import SQLiteUserDataStore, UserDataPersistence, encode
+from utils.location import Location
+
+TOUCHED = 2000
+CHANGED = 200
+
+def ride_request(user_id: int) -> dict:
+    return {"ride_request": {
+        "passenger_id": user_id,
+        "pickup_location": Location(24.7 + user_id * 1e-6, 46.6),
+        "destination_location": Location(24.8, 46.7),
+        "fare_details": {
+            "distance_km": 12.3, "base_fare": 5.0, "distance_fare": 24.6, "total_fare": 29.6,
+            "commission_amount": 5.9, "driver_earning": 23.7
+        },
+        "nearby_drivers": [
+            {"driver_id": d, "telegram_id": 10 ** 9 + d, "name": "driver", "distance_km": 1.2,
+             "vehicle_type": "sedan", "rating": 4.8}
+            for d in range(5)
+        ],
+        "estimated_time": {"total_time_minutes": 25, "travel_time_minutes": 20}
+    }}
+
+def change(data: dict, user_ids):
+    for user_id in user_ids:
+        data[user_id]["ride_request"]["fare_details"]["total_fare"] += 1
+
+async def bench_store(directory: str, data: dict, touched: list):
+    path = os.path.join(directory, "user_data.db")
+    count = len(data)
+
+    persistence = UserDataPersistence(SQLiteUserDataStore(path), update_interval=5, ttl=86400)
+    await persistence.get_user_data()
+    started = time.perf_counter()
+    await asyncio.gather(*(persistence.update_user_data(user_id, user_data) for user_id, user_data in data.items()))
+    # مهمة الكتابة الواحدة للدورة (flush تغلق المخزن، فتُستدعى في النهاية فقط)
+    await persistence._write_task
+    print(f"store: initial write of {count} users {time.perf_counter() - started:.2f} s")
+
+    change(data, touched[:CHANGED])
+    started = time.perf_counter()
+    await asyncio.gather(*(persistence.update_user_data(user_id, data[user_id]) for user_id in touched))
+    await persistence._write_task
+    print(
+        f"store: cycle with {TOUCHED} touched / {CHANGED} changed {(time.perf_counter() - started) * 1000:.0f} ms "
+        f"(written {persistence.written - count}, skipped {persistence.skipped})"
+    )
+    await persistence.flush()
+
+    reloaded = UserDataPersistence(SQLiteUserDataStore(path), update_interval=5, ttl=86400)
+    started = time.perf_counter()
+    loaded = await reloaded.get_user_data()
+    print(f"store: cold load of {len(loaded)} users {time.perf_counter() - started:.2f} s")
+    assert loaded[touched[0]] == data[touched[0]]
+    await reloaded.flush()
+
+async def bench_pickle(directory: str, data: dict, touched: list):
+    persistence = PicklePersistence(os.path.join(directory, "user_data.pkl"), on_flush=False, update_interval=5)
+    await persistence.get_user_data()
+    started = time.perf_counter()
+    persistence.user_data.update(copy.deepcopy(data))
+    persistence._dump_singlefile()
+    print(f"pickle: one full dump {time.perf_counter() - started:.2f} s")
+
+    # مع on_flush=False يُفرغ الملف كله لكل مستخدم متغير: قياس 3 وتقدير الدورة
+    change(data, touched[:CHANGED])
+    sample = 3
+    started = time.perf_counter()
+    for user_id in touched[:sample]:
+        await persistence.update_user_data(user_id, copy.deepcopy(data[user_id]))
+    elapsed = time.perf_counter() - started
+    print(f"pickle: {sample} changed users {elapsed:.2f} s -> ~{elapsed / sample * CHANGED:.0f} s per cycle")
+
+def main():
+    count = int(os.environ.get("USERS", "100000"))
+    data = {user_id: ride_request(user_id) for user_id in range(count)}
+    random.seed(1)
+    touched = random.sample(range(count), TOUCHED)
+    print(f"users: {count}, payload {len(encode(data[1]))} bytes encoded")
+
+    with tempfile.TemporaryDirectory(prefix="bench-") as directory:
+        asyncio.run(bench_store(directory, data, touched))
+        asyncio.run(bench_pickle(directory, data, touched))
+
+if __name__ == "__main__":
+    main()
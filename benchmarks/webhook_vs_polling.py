@@ -0,0 +1,174 @@
+"""
+مقارنة استقبال التحديثات بالاستطلاع (getUpdates) وبالـ Webhook
+
+خادم تيليجرام وهمي محلي (aiohttp) في نفس العملية ومعالج لا يفعل شيئاً،
+فيُقاس الاستقبال وحده: عدد التحديثات في الثانية وزمن الوصول من إنشاء
+التحديث إلى المعالج (p50 وp95).
+
+التشغيل من جذر المستودع:
+    python benchmarks/webhook_vs_polling.py                  # تراكم 5000 تحديث
+    python benchmarks/webhook_vs_polling.py --rate 200       # حمل ثابت 200 تحديث/ث
+    python benchmarks/webhook_vs_polling.py --mode webhook -n 2000
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123:bench")
+
+from aiohttp import ClientSession, TCPConnector, web
+from telegram.ext import Application, MessageHandler, filters
+
+from utils.webhook import WebhookServer, application_dispatcher
+
+TOKEN = "123:bench"
+TELEGRAM_PORT = 18081
+WEBHOOK_PORT = 18082
+SECRET = "bench-secret"
+# مثل max_connections الافتراضي في setWebhook
+WEBHOOK_CONNECTIONS = 40
+
+def make_update(update_id: int) -> dict:
+    user_id = 1000 + update_id % 500
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+            # زمن الإنشاء لقياس زمن الوصول
+            "text": repr(time.perf_counter())
+        }
+    }
+
+class FakeTelegram:
+    """getMe وgetUpdates (حتى 100 تحديث مع long polling)، وباقي الطرق ترجع True"""
+
+    def __init__(self):
+        self.pending = []
+        self.available = asyncio.Event()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench"}
+        elif method == "getUpdates":
+            data = await request.json() if request.content_type == "application/json" else await request.post()
+            offset = int(data.get("offset") or 0)
+            self.pending = [update for update in self.pending if update["update_id"] >= offset]
+            if not self.pending:
+                self.available.clear()
+                try:
+                    await asyncio.wait_for(self.available.wait(), float(data.get("timeout") or 0) or 0.01)
+                except asyncio.TimeoutError:
+                    pass
+            result = self.pending[:100]
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+async def serve(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+async def produce(push, count: int, rate: float):
+    started = time.perf_counter()
+    for update_id in range(1, count + 1):
+        if rate:
+            delay = started + update_id / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await push(update_id)
+
+async def run(mode: str, count: int, rate: float):
+    done = asyncio.Event()
+    latencies = []
+
+    async def handler(update, context):
+        latencies.append(time.perf_counter() - float(update.message.text))
+        if len(latencies) >= count:
+            done.set()
+
+    telegram = FakeTelegram()
+    telegram_app = web.Application()
+    telegram_app.router.add_route("*", "/bot{token}/{method}", telegram.handle)
+    telegram_runner = await serve(telegram_app, TELEGRAM_PORT)
+
+    builder = Application.builder().token(TOKEN).base_url(f"http://127.0.0.1:{TELEGRAM_PORT}/bot")
+    if mode == "webhook":
+        builder = builder.updater(None)
+    application = builder.build()
+    application.add_handler(MessageHandler(filters.TEXT, handler))
+
+    async with application:
+        await application.start()
+        if mode == "polling":
+            await application.updater.start_polling(poll_interval=0, timeout=10)
+
+            async def push(update_id):
+                telegram.pending.append(make_update(update_id))
+                telegram.available.set()
+
+            started = time.perf_counter()
+            await produce(push, count, rate)
+            await done.wait()
+            elapsed = time.perf_counter() - started
+            await application.updater.stop()
+        else:
+            server = WebhookServer(
+                application_dispatcher(application), "127.0.0.1", WEBHOOK_PORT, "telegram", SECRET
+            )
+            await server.start()
+            async with ClientSession(connector=TCPConnector(limit=WEBHOOK_CONNECTIONS)) as client:
+                requests = []
+
+                async def post(update_id):
+                    async with client.post(
+                        f"http://127.0.0.1:{WEBHOOK_PORT}/telegram",
+                        json=make_update(update_id),
+                        headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}
+                    ) as response:
+                        assert response.status == 200
+
+                async def push(update_id):
+                    requests.append(asyncio.create_task(post(update_id)))
+
+                started = time.perf_counter()
+                await produce(push, count, rate)
+                await asyncio.gather(*requests)
+                await done.wait()
+                elapsed = time.perf_counter() - started
+            await server.stop()
+        await application.stop()
+    await telegram_runner.cleanup()
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000
+    print(
+        f"{mode:8s} n={count} rate={rate or 'max'}: {count / elapsed:7.0f} upd/s  "
+        f"latency p50 {p50:6.1f} ms  p95 {p95:6.1f} ms"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mode", choices=("polling", "webhook", "both"), default="both")
+    parser.add_argument("-n", "--count", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=0, help="تحديثات في الثانية (0 = تراكم دفعة واحدة)")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    modes = ("polling", "webhook") if args.mode == "both" else (args.mode,)
+    for mode in modes:
+        asyncio.run(run(mode, args.count, args.rate))
+
+if __name__ == "__main__":
+    main()
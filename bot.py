@@ -5,12 +5,18 @@
 
 import logging
 import asyncio
-from telegram import Update
+import secrets
+import signal
+from datetime import timedelta
+from typing import TYPE_CHECKING
+
+# أول استيراد من المشروع حتى يشمل القياس زمن استيراد المكتبات
+from utils.startup import startup_profiler
+
+from telegram import Bot, Update
 from telegram.ext import (
     Application, 
     CommandHandler, 
-    MessageHandler, 
-    filters, 
     CallbackQueryHandler, 
     ContextTypes  # أضف هذا السطر ضروري جداً
 )
@@ -18,14 +24,34 @@ from telegram.error import TelegramError
 
 
 from config import config
+from database.cache import user_cache
 from database.database import db_manager
+from database.instrumentation import sql_profiler
+from database.queries import get_system_value, set_system_value, save_pending_updates, pop_pending_updates
+from database.write_behind import chat_message_writer
 
 # استيراد المعالجات
 from handlers.user import UserHandlers
 from handlers.driver import DriverHandlers
 from handlers.ride import RideHandlers
 from handlers.admin import AdminHandlers
+from middleware.callback_router import callback_router
 from middleware.chat_manager import ChatManager
+from middleware.conversation import ConversationRouter, ConversationState, MessageKind, conversation_store
+from middleware.persistence import create_persistence
+from middleware.update_processor import KeyedUpdateProcessor
+from utils.archive import RideArchiver
+from utils.broadcast import broadcast_engine
+from utils.metrics import metrics
+from utils.outbound import outbound_scheduler, Priority
+from utils.outbox import outbox_drainer
+from utils.sharding import ShardConnection, ShardedIngress
+from utils.shutdown import ShutdownCoordinator
+from utils.stats import stats_service
+
+# utils.webhook (ومعه aiohttp) يُستورد عند الحاجة فقط: وضع التطوير والعمال لا يحتاجانه
+if TYPE_CHECKING:
+    from utils.webhook import WebhookServer
 
 # إعداد التسجيل
 logging.basicConfig(
@@ -33,17 +59,41 @@ logging.basicConfig(
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
+startup_profiler.mark("imports")
+
+ALLOWED_UPDATES = [
+    "message",
+    "callback_query",
+    "inline_query",
+    "chosen_inline_result",
+    "channel_post",
+    "edited_message",
+    "edited_channel_post"
+]
+
+# مفتاح رقم آخر تحديث معالج في system_state
+LAST_UPDATE_KEY = "last_update_id"
+# أرقام التحديثات قد تبدأ من جديد بعد أسبوع دون تحديثات (حسب توثيق تيليجرام)
+LAST_UPDATE_MAX_AGE = timedelta(days=7)
 
 class DeliveryBot:
     """الفئة الرئيسية للبوت"""
     
-    def __init__(self):
+    def __init__(self, shard: ShardConnection = None):
+        # في وضع العمليات المتعددة: اتصال هذا العامل بالمدخل
+        self.shard = shard
+        # المهام العامة (الأرشفة، استعادة الدردشات، إشعارات الأدمن) في عملية واحدة فقط
+        self.primary = shard is None or shard.index == 0
         self.application = None
         self.user_handlers = None
         self.driver_handlers = None
         self.ride_handlers = None
         self.admin_handlers = None
         self.chat_manager = None
+        self.persistence = None
+        self.update_processor = None
+        self.shutdown = None
+        self._background_tasks = []
     
     def init_app(self):
         """تهيئة تطبيق البوت"""
@@ -53,9 +103,33 @@ class DeliveryBot:
             
             # تهيئة قاعدة البيانات
             db_manager.init_database()
+            startup_profiler.mark("database")
+            
+            if self.shard:
+                # حد تيليجرام الإجمالي للبوت كله، يُقسم على العمال
+                outbound_scheduler.global_rate = config.outbound.GLOBAL_RATE / self.shard.workers
             
             # إنشاء تطبيق البوت
-            self.application = Application.builder().token(config.bot.BOT_TOKEN).build()
+            # (كل الأوضاع تُشغل يدوياً، فلا post_init ولا post_stop)
+            self.update_processor = KeyedUpdateProcessor(
+                max_concurrent_updates=config.bot.MAX_CONCURRENT_UPDATES,
+                max_pending_updates=config.bot.MAX_PENDING_UPDATES,
+                contiguous_ids=self.shard is None
+            )
+            builder = (
+                Application.builder()
+                .token(config.bot.BOT_TOKEN)
+                .rate_limiter(outbound_scheduler)
+                .concurrent_updates(self.update_processor)
+            )
+            # كل عامل يحمّل بيانات مستخدميه فقط (نفس توزيع المدخل وعضويته الحالية)
+            self.persistence = create_persistence(owns=self.shard.owns if self.shard else None)
+            if self.persistence:
+                builder = builder.persistence(self.persistence)
+            if config.bot.is_production or self.shard:
+                # التحديثات تصل عبر خادم الـ Webhook (أو من المدخل) وليس عبر Updater
+                builder = builder.updater(None)
+            self.application = builder.build()
             
             # إنشاء المعالجات
             self.user_handlers = UserHandlers()
@@ -67,6 +141,19 @@ class DeliveryBot:
             # تسجيل المعالجات
             self._register_handlers()
             
+            # ما يُفرغ عند الإيقاف بعد إنهاء التحديثات، بهذا الترتيب
+            # (قاعدة البيانات آخراً لأن ما قبلها يكتب فيها)
+            self.shutdown = ShutdownCoordinator(timeout=config.bot.SHUTDOWN_TIMEOUT)
+            self.shutdown.register("broadcast", broadcast_engine.stop)
+            self.shutdown.register("chat_message_writer", chat_message_writer.stop)
+            self.shutdown.register("outbox", outbox_drainer.stop)
+            self.shutdown.register("chat_registry", self.chat_manager.registry.close)
+            self.shutdown.register("pending_updates", self._save_unprocessed_updates)
+            self.shutdown.register("last_update_id", self._save_last_update_id)
+            self.shutdown.register("metrics", metrics.checkpoint)
+            self.shutdown.register("database", db_manager.close_session)
+            startup_profiler.mark("application")
+            
             logger.info("تم تهيئة البوت بنجاح")
             return True
             
@@ -80,36 +167,67 @@ class DeliveryBot:
         # معالجات المستخدمين
         user_handlers = self.user_handlers.get_handlers()
         for handler in user_handlers:
-            self.application.add_handler(handler)
+            self._add_handler(handler)
         
         # معالجات السائقين
         driver_handlers = self.driver_handlers.get_handlers()
         for handler in driver_handlers:
-            self.application.add_handler(handler)
+            self._add_handler(handler)
         
         # معالجات الرحلات
         ride_handlers = self.ride_handlers.get_handlers()
         for handler in ride_handlers:
-            self.application.add_handler(handler)
+            self._add_handler(handler)
         
         # معالجات الأدمن
         admin_handlers = self.admin_handlers.get_handlers()
         for handler in admin_handlers:
-            self.application.add_handler(handler)
+            self._add_handler(handler)
         
         # معالجات الدردشة
         chat_handlers = self.chat_manager.get_handlers()
         for handler in chat_handlers:
-            self.application.add_handler(handler)
+            self._add_handler(handler)
+        
+        # أزرار الـ Callback: معالج واحد يوجه حسب رمز الفعل (يقيس كل فعل بنفسه)
+        for handlers in (self.user_handlers, self.driver_handlers, self.ride_handlers, self.admin_handlers):
+            callback_router.register_all(handlers.get_callback_routes())
+        self.application.add_handler(callback_router.get_handler())
+        
+        # الرسائل غير الأوامر (نص، موقع، وسائط): معالج واحد يوجه حسب حالة المستخدم
+        conversation_router = ConversationRouter(
+            conversation_store,
+            routes={
+                (ConversationState.AWAITING_LOCATION, MessageKind.LOCATION): self.user_handlers.handle_location,
+                (ConversationState.AWAITING_DESTINATION, MessageKind.LOCATION): self.ride_handlers.handle_destination,
+                (ConversationState.AWAITING_DESTINATION, MessageKind.TEXT): self.ride_handlers.handle_destination,
+                (ConversationState.IDLE, MessageKind.LOCATION): self.user_handlers.handle_location,
+                (ConversationState.IDLE, MessageKind.TEXT): self.handle_unknown_message
+            },
+            chat_lookup=self.chat_manager.get_active_chat,
+            chat_relay=self.chat_manager.handle_message,
+            fallback_replies={
+                ConversationState.AWAITING_LOCATION: (
+                    "📍 رجاءً أرسل موقعك الحالي باستخدام زر \"إرسال موقعي الحالي\"."
+                ),
+                ConversationState.AWAITING_DESTINATION: (
+                    "📍 رجاءً أرسل موقع الوجهة أو اكتب عنوانها، أو استخدم /cancel للإلغاء."
+                ),
+                ConversationState.IDLE: (
+                    "لا يمكنني التعامل مع هذا النوع من الرسائل.\n"
+                    "استخدم /help لعرض الأوامر المتاحة."
+                )
+            }
+        )
+        self.application.add_handler(conversation_router.get_handler())
         
         # معالجة الأخطاء
         self.application.add_error_handler(self.error_handler)
-        
-        # معالجة الرسائل العامة
-        self.application.add_handler(MessageHandler(
-            filters.TEXT & ~filters.COMMAND,
-            self.handle_unknown_message
-        ))
+    
+    def _add_handler(self, handler, group: int = 0):
+        """تسجيل معالج مع قياس استعلامات SQL الخاصة به"""
+        handler.callback = sql_profiler.wrap(handler.callback)
+        self.application.add_handler(handler, group)
     
     async def error_handler(self, update: object, context: ContextTypes.DEFAULT_TYPE):
         """معالجة الأخطاء العامة"""
@@ -142,57 +260,328 @@ class DeliveryBot:
     
     async def on_startup(self, application: Application):
         """الإجراءات عند بدء التشغيل"""
+        # تهيئة PTB (getMe وتحميل user_data)
+        startup_profiler.mark("initialize")
         logger.info("بدء تشغيل البوت...")
         
-        # إرسال إشعار للأدمن
-        for admin_id in config.bot.ADMIN_IDS:
+        # تجاهل التحديثات التي عولجت قبل آخر إيقاف إن أُعيد تسليمها
+        try:
+            self.update_processor.skip_through = await asyncio.to_thread(self._load_last_update_id)
+        except Exception as e:
+            logger.error(f"خطأ في تحميل رقم آخر تحديث: {e}")
+        # ما لم يُعالج قبل آخر إيقاف يدخل الطابور قبل فتح الاستقبال
+        await self._requeue_unprocessed_updates(application)
+        
+        # المهام الخلفية
+        await chat_message_writer.start()
+        await outbox_drainer.start(application.bot)
+        # الرسائل الجماعية غير المكتملة تُستأنف في عملية واحدة فقط
+        await broadcast_engine.start(application.bot, resume=self.primary)
+        if self.persistence:
+            # كل عامل يحذف بيانات مستخدميه الخاملين
+            self._background_tasks.append(asyncio.create_task(self._evict_loop(application)))
+        # لقطة إحصائيات لوحة الأدمن (الأدمن قد يُوجَّه لأي عامل)
+        self._background_tasks.append(asyncio.create_task(stats_service.run()))
+        # المقاييس الحية: كل عملية تحفظ زياداتها، والمؤشرات تُضبط من المصدر مرة واحدة
+        if self.primary:
+            await metrics.reconcile()
+        else:
+            await metrics.load()
+        self._background_tasks.append(asyncio.create_task(metrics.run()))
+        if self.primary:
+            # استعادة الدردشات الجارية في الخلفية حتى لا يتأخر بدء التشغيل
+            self._background_tasks.append(asyncio.create_task(self._rehydrate_chats()))
+            if config.archive.ARCHIVE_ENABLED:
+                self._background_tasks.append(asyncio.create_task(self._archive_loop()))
+            
+            # إشعار الأدمن في الخلفية: لا ينتظره استقبال التحديثات
+            self._background_tasks.append(asyncio.create_task(
+                self._notify_admins(application, "🟢 تم بدء تشغيل بوت التوصيل بنجاح!")
+            ))
+        startup_profiler.mark("startup_hooks")
+    
+    @staticmethod
+    async def _notify_admins(application: Application, text: str):
+        """إرسال إشعار لكل الأدمن معاً"""
+        async def notify(admin_id: int):
             try:
                 await application.bot.send_message(
                     chat_id=admin_id,
-                    text="🟢 تم بدء تشغيل بوت التوصيل بنجاح!"
+                    text=text,
+                    rate_limit_args={"priority": Priority.NOTICE}
                 )
             except Exception as e:
                 logger.error(f"فشل في إرسال إشعار للأدمن {admin_id}: {e}")
+        
+        await asyncio.gather(*(notify(admin_id) for admin_id in config.bot.ADMIN_IDS))
+    
+    async def _rehydrate_chats(self):
+        """مزامنة سجل الدردشات مع الرحلات الجارية"""
+        try:
+            await asyncio.to_thread(self.chat_manager.rehydrate)
+        except Exception as e:
+            logger.error(f"خطأ في استعادة الدردشات النشطة: {e}")
     
     async def on_shutdown(self, application: Application):
         """الإجراءات عند إيقاف التشغيل"""
         logger.info("إيقاف تشغيل البوت...")
         
-        # إغلاق جلسات قاعدة البيانات
-        db_manager.close_session()
+        # إيقاف المهام الخلفية
+        for task in self._background_tasks:
+            task.cancel()
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        self._background_tasks.clear()
+        
+        # تفريغ المخازن وإغلاق قاعدة البيانات
+        await self.shutdown.flush()
+        
+        if self.primary:
+            await self._notify_admins(application, "🔴 تم إيقاف بوت التوصيل.")
+    
+    async def _shutdown(self, application: Application):
+        """
+        الإيقاف المنظم بعد توقف الاستقبال
+        
+        إنهاء التحديثات المستلمة (حتى SHUTDOWN_TIMEOUT)، ثم إيقاف التطبيق،
+        ثم تفريغ المخازن وحفظ رقم آخر تحديث.
+        """
+        await self.shutdown.drain(application, self.update_processor)
+        await application.stop()
+        await self.on_shutdown(application)
+    
+    @property
+    def _last_update_key(self) -> str:
+        # كل عامل يرى جزءاً من التحديثات، فلكل عامل رقمه
+        return f"{LAST_UPDATE_KEY}:{self.shard.index}" if self.shard else LAST_UPDATE_KEY
+    
+    def _load_last_update_id(self):
+        with db_manager.get_session() as session:
+            value = get_system_value(session, self._last_update_key, max_age=LAST_UPDATE_MAX_AGE)
+        return int(value) if value else None
+    
+    @property
+    def _updates_owner(self) -> str:
+        return f"shard:{self.shard.index}" if self.shard else "main"
+    
+    async def _save_unprocessed_updates(self):
+        """حفظ التحديثات الملغاة أو الباقية في الطابور (تيليجرام لن يعيد إرسالها)"""
+        updates = [update.to_dict() for update in self.update_processor.unprocessed]
+        if not updates:
+            return
+        await db_manager.write(lambda session: save_pending_updates(session, self._updates_owner, updates))
+        logger.warning(f"تم حفظ {len(updates)} تحديث لم يُعالج لإعادته عند التشغيل التالي")
+    
+    async def _requeue_unprocessed_updates(self, application: Application):
+        try:
+            updates = await db_manager.write(lambda session: pop_pending_updates(session, self._updates_owner))
+        except Exception as e:
+            logger.error(f"خطأ في تحميل التحديثات غير المعالجة: {e}")
+            return
+        for data in updates:
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        if updates:
+            logger.info(f"تمت إعادة {len(updates)} تحديث لم يُعالج قبل آخر إيقاف إلى الطابور")
+    
+    async def _save_last_update_id(self):
+        last_update_id = self.update_processor.last_update_id
+        if last_update_id is None:
+            return
+        
+        def save():
+            with db_manager.write_session() as session:
+                set_system_value(session, self._last_update_key, str(last_update_id))
         
-        # إرسال إشعار للأدمن
-        for admin_id in config.bot.ADMIN_IDS:
+        await asyncio.to_thread(save)
+        logger.info(
+            f"تم حفظ رقم آخر تحديث {last_update_id} "
+            f"(تم تجاهل {self.update_processor.duplicates} تحديث مكرر)"
+        )
+    
+    async def _archive_loop(self):
+        """أرشفة الرحلات القديمة دورياً خارج حلقة الأحداث"""
+        archiver = RideArchiver()
+        while True:
             try:
-                await application.bot.send_message(
-                    chat_id=admin_id,
-                    text="🔴 تم إيقاف بوت التوصيل."
-                )
+                await asyncio.to_thread(archiver.run)
             except Exception as e:
-                logger.error(f"فشل في إرسال إشعار للأدمن {admin_id}: {e}")
+                logger.error(f"خطأ في أرشفة الرحلات: {e}")
+            await asyncio.sleep(config.archive.ARCHIVE_INTERVAL)
+    
+    async def _evict_loop(self, application: Application):
+        """حذف user_data للمستخدمين الخاملين دورياً"""
+        while True:
+            await asyncio.sleep(config.persistence.PERSISTENCE_EVICT_INTERVAL)
+            try:
+                evicted = self.persistence.evict(application)
+                if evicted:
+                    logger.info(f"تم حذف بيانات {evicted} مستخدم خامل")
+            except Exception as e:
+                logger.error(f"خطأ في حذف بيانات المستخدمين الخاملين: {e}")
+    
+    async def _adopt_users(self, members):
+        """تحميل بيانات المستخدمين المنقولين إلى هذا العامل بعد استبعاد عامل"""
+        if self.persistence is None:
+            return
+        adopted = await self.persistence.adopt_users()
+        logger.info(f"العمال النشطون {members}: {adopted} مستخدم منقول إلى العامل {self.shard.index}")
+    
+    @staticmethod
+    def _stop_event(signals=(signal.SIGINT, signal.SIGTERM)) -> asyncio.Event:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in signals:
+            loop.add_signal_handler(sig, stop_event.set)
+        return stop_event
+    
+    @staticmethod
+    def _webhook_server(dispatch, secret_token: str, stats=None) -> "WebhookServer":
+        from utils.webhook import WebhookServer
+        
+        return WebhookServer(
+            dispatch,
+            listen=config.bot.WEBHOOK_LISTEN,
+            port=config.bot.WEBHOOK_PORT,
+            url_path=config.bot.WEBHOOK_PATH,
+            secret_token=secret_token,
+            shutdown_timeout=config.bot.WEBHOOK_SHUTDOWN_TIMEOUT,
+            stats=stats
+        )
+    
+    @staticmethod
+    async def _set_webhook(bot: Bot, secret_token: str):
+        await bot.set_webhook(
+            url=f"{config.bot.WEBHOOK_URL.rstrip('/')}/{config.bot.WEBHOOK_PATH.strip('/')}",
+            secret_token=secret_token,
+            max_connections=config.bot.WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=ALLOWED_UPDATES,
+            # ما وصل أثناء إعادة النشر يُعالج بعد التشغيل
+            drop_pending_updates=False
+        )
+    
+    async def run_polling(self):
+        """
+        التشغيل بوضع Polling (التطوير)
+        
+        run_polling في PTB يؤكد لتيليجرام كل ما جلبه Updater ثم يُسقط ما بقي
+        في الطابور، لذلك يُدار الإيقاف يدوياً كبقية الأوضاع.
+        """
+        application = self.application
+        stop_event = self._stop_event()
+        
+        async with application:
+            await application.start()
+            await self.on_startup(application)
+            await application.updater.start_polling(
+                allowed_updates=ALLOWED_UPDATES,
+                drop_pending_updates=False
+            )
+            
+            await stop_event.wait()
+            
+            await application.updater.stop()
+            await self._shutdown(application)
+    
+    async def run_webhook(self):
+        """
+        التشغيل بوضع Webhook عبر خادم aiohttp
+        
+        عند الإيقاف: يتوقف الخادم عن قبول التحديثات وينتظر الطلبات الجارية، ثم
+        يعالج التطبيق ما تبقى في الطابور قبل تنفيذ إجراءات الإيقاف.
+        """
+        from utils.webhook import application_dispatcher
+        
+        application = self.application
+        secret_token = config.bot.WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32)
+        server = self._webhook_server(
+            application_dispatcher(application),
+            secret_token,
+            stats=lambda: {"queue_size": application.update_queue.qsize()}
+        )
+        stop_event = self._stop_event()
+        
+        async with application:
+            await application.start()
+            await self.on_startup(application)
+            await server.start()
+            await self._set_webhook(application.bot, secret_token)
+            
+            await stop_event.wait()
+            
+            await server.stop()
+            await self._shutdown(application)
+    
+    async def run_sharded(self):
+        """
+        تشغيل المدخل في وضع العمليات المتعددة
+        
+        هذه العملية لا تعالج التحديثات: تستقبلها وتوزعها على العمال حسب
+        المستخدم. عند الإيقاف يتوقف الخادم أولاً، ثم ينهي كل عامل ما في طابوره.
+        """
+        sharding = config.sharding
+        ingress = ShardedIngress(
+            worker_target=_run_shard_worker,
+            workers=sharding.SHARD_WORKERS,
+            queue_size=sharding.SHARD_QUEUE_SIZE,
+            health_interval=sharding.SHARD_HEALTH_INTERVAL,
+            heartbeat_timeout=sharding.SHARD_HEARTBEAT_TIMEOUT,
+            startup_timeout=sharding.SHARD_STARTUP_TIMEOUT,
+            max_restarts=sharding.SHARD_MAX_RESTARTS
+        )
+        secret_token = config.bot.WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32)
+        server = self._webhook_server(ingress.dispatch, secret_token, stats=ingress.snapshot)
+        stop_event = self._stop_event()
+        
+        ingress.start()
+        try:
+            await server.start()
+            async with Bot(config.bot.BOT_TOKEN) as bot:
+                await self._set_webhook(bot, secret_token)
+            
+            await stop_event.wait()
+        finally:
+            await server.stop()
+            # مهلة العمال: إنهاء التحديثات ثم تفريغ المخازن
+            await ingress.stop(timeout=config.bot.SHUTDOWN_TIMEOUT + 30)
+    
+    async def run_shard_worker(self):
+        """تشغيل عامل: التحديثات تأتي من المدخل عبر طابور العامل"""
+        application = self.application
+        # Ctrl+C يصل لكل العمليات، والمدخل هو من ينسق الإيقاف
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        stop_event = self._stop_event(signals=(signal.SIGTERM,))
+        
+        async with application:
+            await application.start()
+            await self.on_startup(application)
+            
+            await self.shard.serve(application, stop_event, on_membership=self._adopt_users)
+            
+            await self._shutdown(application)
     
     def run(self):
         """تشغيل البوت"""
+        if config.bot.is_production and config.sharding.enabled and not self.shard:
+            # المدخل لا يحتاج قاعدة البيانات ولا المعالجات، العمال يهيئونها
+            try:
+                config.validate()
+                asyncio.run(self.run_sharded())
+            except KeyboardInterrupt:
+                pass
+            except Exception as e:
+                logger.error(f"فشل في تشغيل المدخل: {e}")
+            return
+        
         if not self.init_app():
             logger.error("فشل في تهيئة البوت. الخروج...")
             return
         
         try:
-            # إضافة معالجات البداية والنهاية
-            self.application.run_polling(
-                on_startup=self.on_startup,
-                on_shutdown=self.on_shutdown,
-                allowed_updates=[
-                    "message",
-                    "callback_query",
-                    "inline_query",
-                    "chosen_inline_result",
-                    "channel_post",
-                    "edited_message",
-                    "edited_channel_post"
-                ],
-                drop_pending_updates=True
-            )
+            if self.shard:
+                asyncio.run(self.run_shard_worker())
+            elif config.bot.is_production:
+                asyncio.run(self.run_webhook())
+            else:
+                asyncio.run(self.run_polling())
             
         except KeyboardInterrupt:
             logger.info("تم إيقاف البوت بواسطة المستخدم.")
@@ -202,6 +591,18 @@ class DeliveryBot:
             logger.info("إيقاف جميع العمليات...")
 
 
+def _run_shard_worker(shard: ShardConnection):
+    """نقطة دخول عملية العامل (على مستوى الوحدة ليمكن تشغيلها بـ spawn)"""
+    if config.chat.CHAT_REGISTRY_BACKEND == "memory":
+        # طرفا الدردشة قد يكونان على عاملين مختلفين، فالسجل يجب أن يكون مشتركاً
+        logger.warning("سجل الدردشات في الذاكرة لا يعمل مع عدة عمال، سيُستخدم sqlite")
+        config.chat.CHAT_REGISTRY_BACKEND = "sqlite"
+    # ذاكرة المستخدمين داخل العملية لا تصلها إبطالات العمال الآخرين
+    user_cache.ttl = min(user_cache.ttl, config.cache.SHARD_USER_CACHE_TTL)
+    user_cache.negative_ttl = min(user_cache.negative_ttl, config.cache.SHARD_USER_CACHE_TTL)
+    DeliveryBot(shard).run()
+
+
 def main():
     """الدالة الرئيسية"""
     bot = DeliveryBot()
@@ -14,6 +14,22 @@ class BotConfig:
         int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip().isdigit()
     ])
     WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "")
+    # خادم الـ Webhook المحلي (PORT يحدده مزود الاستضافة عادة)
+    WEBHOOK_LISTEN: str = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+    WEBHOOK_PORT: int = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443")))
+    WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "telegram")
+    # إن تُرك فارغاً يُولد رمز عشوائي عند كل تشغيل
+    WEBHOOK_SECRET_TOKEN: str = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+    WEBHOOK_MAX_CONNECTIONS: int = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+    WEBHOOK_SHUTDOWN_TIMEOUT: float = float(os.getenv("WEBHOOK_SHUTDOWN_TIMEOUT", "10"))
+    # المعالجة المتوازية: أقصى تحديثات قيد التنفيذ، وأقصى تحديثات منتظرة
+    # (1 يعني معالجة تسلسلية كالسابق)
+    MAX_CONCURRENT_UPDATES: int = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+    MAX_PENDING_UPDATES: int = int(os.getenv("MAX_PENDING_UPDATES", "1024"))
+    # مدة انتظار خطوة في محادثة (الموقع، الوجهة) قبل العودة للحالة الخاملة (بالثواني)
+    CONVERSATION_TIMEOUT: float = float(os.getenv("CONVERSATION_TIMEOUT", "900"))
+    # مهلة إنهاء التحديثات الجارية عند الإيقاف قبل إلغائها (بالثواني)
+    SHUTDOWN_TIMEOUT: float = float(os.getenv("SHUTDOWN_TIMEOUT", "30"))
     @property
     def is_production(self) -> bool:
         return bool(self.WEBHOOK_URL)
@@ -26,6 +42,25 @@ class DatabaseConfig:
     DB_NAME: str = os.getenv("DB_NAME", "delivery_bot")
     DB_USER: str = os.getenv("DB_USER", "")
     DB_PASSWORD: str = os.getenv("DB_PASSWORD", "")
+    # إعدادات SQLite للإنتاج
+    SQLITE_WAL: bool = os.getenv("SQLITE_WAL", "true").lower() == "true"
+    SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_BUSY_TIMEOUT_MS: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_MMAP_SIZE: int = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    SQLITE_CACHE_SIZE_KB: int = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+    SQLITE_POOL_SIZE: int = int(os.getenv("SQLITE_POOL_SIZE", "5"))
+    # نسخة قراءة فقط اختيارية لتقارير الأدمن (مثال: sqlite:///replica.db)
+    DB_REPLICA_URL: str = os.getenv("DB_REPLICA_URL", "")
+    DB_REPLICA_POOL_SIZE: int = int(os.getenv("DB_REPLICA_POOL_SIZE", "5"))
+    # طباعة كل جملة SQL (للتطوير فقط، مكلف جداً)
+    DB_ECHO: bool = os.getenv("DB_ECHO", "false").lower() == "true"
+    SLOW_QUERY_THRESHOLD_MS: float = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "100"))
+    SLOW_QUERY_LOG_FILE: str = os.getenv("SLOW_QUERY_LOG_FILE", "")
+    # وضع الاختبار: رفع استثناء عند أي تحميل كسول غير متوقع
+    DB_STRICT_LOADING: bool = os.getenv("DB_STRICT_LOADING", "false").lower() == "true"
+    # الكتابة المؤجلة لرسائل الدردشة: الفاصل الزمني وحجم الدفعة
+    WRITE_BEHIND_INTERVAL_MS: int = int(os.getenv("WRITE_BEHIND_INTERVAL_MS", "250"))
+    WRITE_BEHIND_BATCH_SIZE: int = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))
     @property
     def connection_string(self) -> str:
         if self.DB_TYPE == "postgres":
@@ -52,6 +87,91 @@ class LocationConfig:
     LOCATION_UPDATE_INTERVAL: int = int(os.getenv("LOCATION_UPDATE_INTERVAL", "30"))
     EARTH_RADIUS_KM: float = 6371.0
 
+@dataclass
+class CacheConfig:
+    USER_CACHE_TTL: float = float(os.getenv("USER_CACHE_TTL", "300"))
+    USER_CACHE_NEGATIVE_TTL: float = float(os.getenv("USER_CACHE_NEGATIVE_TTL", "30"))
+    USER_CACHE_MAX_SIZE: int = int(os.getenv("USER_CACHE_MAX_SIZE", "50000"))
+    # حد المدة مع عدة عمال: الإبطال يصل لذاكرة العامل الذي حفظ التغيير فقط،
+    # فتغييرات الأدمن على مستخدم يخدمه عامل آخر تظهر بعد هذه المدة على الأكثر
+    SHARD_USER_CACHE_TTL: float = float(os.getenv("SHARD_USER_CACHE_TTL", "5"))
+
+@dataclass
+class ArchiveConfig:
+    ARCHIVE_ENABLED: bool = os.getenv("ARCHIVE_ENABLED", "true").lower() == "true"
+    ARCHIVE_DIR: str = os.getenv("ARCHIVE_DIR", "archive")
+    ARCHIVE_AFTER_DAYS: int = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+    ARCHIVE_BATCH_SIZE: int = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+    ARCHIVE_INTERVAL: int = int(os.getenv("ARCHIVE_INTERVAL", "3600"))
+
+@dataclass
+class ChatConfig:
+    # مخزن الدردشات النشطة: memory أو sqlite أو redis
+    CHAT_REGISTRY_BACKEND: str = os.getenv("CHAT_REGISTRY_BACKEND", "memory")
+    CHAT_REGISTRY_PATH: str = os.getenv("CHAT_REGISTRY_PATH", "chat_registry.db")
+    REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+@dataclass
+class PersistenceConfig:
+    # حفظ context.user_data بين عمليات إعادة التشغيل: sqlite أو redis أو none
+    PERSISTENCE_BACKEND: str = os.getenv("PERSISTENCE_BACKEND", "sqlite")
+    PERSISTENCE_PATH: str = os.getenv("PERSISTENCE_PATH", "user_data.db")
+    # الفاصل بين دورات الحفظ (تُكتب البيانات المتغيرة فقط)
+    PERSISTENCE_INTERVAL: float = float(os.getenv("PERSISTENCE_INTERVAL", "5"))
+    # بيانات المستخدم الخامل أكثر من هذه المدة تُحذف (بالثواني)
+    PERSISTENCE_TTL: float = float(os.getenv("PERSISTENCE_TTL", "86400"))
+    PERSISTENCE_EVICT_INTERVAL: float = float(os.getenv("PERSISTENCE_EVICT_INTERVAL", "600"))
+
+@dataclass
+class OutboundConfig:
+    # حدود تيليجرام: ~30 رسالة/ثانية إجمالاً و~1 رسالة/ثانية لكل محادثة
+    GLOBAL_RATE: float = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+    PER_CHAT_RATE: float = float(os.getenv("OUTBOUND_PER_CHAT_RATE", "1"))
+    PER_CHAT_BURST: float = float(os.getenv("OUTBOUND_PER_CHAT_BURST", "3"))
+    MAX_RETRIES: int = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+
+@dataclass
+class OutboxConfig:
+    OUTBOX_BATCH_SIZE: int = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+    OUTBOX_INTERVAL: float = float(os.getenv("OUTBOX_INTERVAL", "2"))
+    OUTBOX_MAX_ATTEMPTS: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+    # التأخير بين المحاولات يتضاعف من BACKOFF_BASE حتى BACKOFF_MAX (بالثواني)
+    OUTBOX_BACKOFF_BASE: float = float(os.getenv("OUTBOX_BACKOFF_BASE", "5"))
+    OUTBOX_BACKOFF_MAX: float = float(os.getenv("OUTBOX_BACKOFF_MAX", "600"))
+    # مدة حجز الدفعة حتى لا ترسلها عملية أخرى في نفس الوقت
+    OUTBOX_LEASE: float = float(os.getenv("OUTBOX_LEASE", "60"))
+
+@dataclass
+class BroadcastConfig:
+    # معدل الرسائل الجماعية (أقل من حد تيليجرام الإجمالي حتى يبقى مجال لإشعارات الرحلات)
+    BROADCAST_RATE: float = float(os.getenv("BROADCAST_RATE", "20"))
+    # عدد المستلمين في كل صفحة، ويُحفظ التقدم بعد كل صفحة
+    BROADCAST_PAGE_SIZE: int = int(os.getenv("BROADCAST_PAGE_SIZE", "200"))
+
+@dataclass
+class StatsConfig:
+    # الفاصل بين تحديثات لقطة إحصائيات لوحة الأدمن (بالثواني)
+    STATS_REFRESH_INTERVAL: float = float(os.getenv("STATS_REFRESH_INTERVAL", "60"))
+    # الفاصل بين حفظ المقاييس الحية في جدول metrics (بالثواني)
+    METRICS_CHECKPOINT_INTERVAL: float = float(os.getenv("METRICS_CHECKPOINT_INTERVAL", "10"))
+
+@dataclass
+class ShardingConfig:
+    # عدد العمليات العاملة خلف مدخل Webhook واحد (0 أو 1 = عملية واحدة كالسابق)
+    SHARD_WORKERS: int = int(os.getenv("SHARD_WORKERS", "0"))
+    # أقصى تحديثات منتظرة لكل عامل قبل رد المدخل بـ 503
+    SHARD_QUEUE_SIZE: int = int(os.getenv("SHARD_QUEUE_SIZE", "10000"))
+    SHARD_HEALTH_INTERVAL: float = float(os.getenv("SHARD_HEALTH_INTERVAL", "2"))
+    # عامل لم يرسل نبضة خلال هذه المدة يُعتبر معلقاً ويُعاد تشغيله
+    SHARD_HEARTBEAT_TIMEOUT: float = float(os.getenv("SHARD_HEARTBEAT_TIMEOUT", "15"))
+    SHARD_STARTUP_TIMEOUT: float = float(os.getenv("SHARD_STARTUP_TIMEOUT", "60"))
+    # بعدها يُستبعد العامل وتُوزع مستخدموه على الباقين
+    SHARD_MAX_RESTARTS: int = int(os.getenv("SHARD_MAX_RESTARTS", "3"))
+
+    @property
+    def enabled(self) -> bool:
+        return self.SHARD_WORKERS > 1
+
 # --- الفئة الرئيسية (هنا التعديل الجذري) ---
 
 
@@ -65,6 +185,15 @@ class Config:
     pricing: PricingConfig = field(default_factory=PricingConfig)
     debt: DebtConfig = field(default_factory=DebtConfig)
     location: LocationConfig = field(default_factory=LocationConfig)
+    cache: CacheConfig = field(default_factory=CacheConfig)
+    archive: ArchiveConfig = field(default_factory=ArchiveConfig)
+    chat: ChatConfig = field(default_factory=ChatConfig)
+    persistence: PersistenceConfig = field(default_factory=PersistenceConfig)
+    outbound: OutboundConfig = field(default_factory=OutboundConfig)
+    outbox: OutboxConfig = field(default_factory=OutboxConfig)
+    broadcast: BroadcastConfig = field(default_factory=BroadcastConfig)
+    stats: StatsConfig = field(default_factory=StatsConfig)
+    sharding: ShardingConfig = field(default_factory=ShardingConfig)
 
     def validate(self):
         if not self.bot.BOT_TOKEN:
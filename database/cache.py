@@ -0,0 +1,218 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from itertools import chain
+from typing import Dict, Optional, Set, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from config import config
+from database.models import User, UserRole, UserStatus, DriverProfile
+from database.queries import get_user_by_telegram_id
+
+logger = logging.getLogger(__name__)
+
+# --- اللقطات (Snapshots) ---
+
+@dataclass(frozen=True, slots=True)
+class DriverSnapshot:
+    """لقطة مختصرة وثابتة لملف السائق"""
+    id: int
+    user_id: int
+    vehicle_type: Optional[str]
+    license_plate: Optional[str]
+    is_online: bool
+    is_available: bool
+    current_ride_id: Optional[int]
+    wallet_balance: float
+    total_earnings: float
+    current_debt: float
+
+    @classmethod
+    def from_model(cls, profile: DriverProfile) -> "DriverSnapshot":
+        return cls(
+            id=profile.id,
+            user_id=profile.user_id,
+            vehicle_type=profile.vehicle_type,
+            license_plate=profile.license_plate,
+            is_online=bool(profile.is_online),
+            is_available=bool(profile.is_available),
+            current_ride_id=profile.current_ride_id,
+            wallet_balance=profile.wallet_balance or 0.0,
+            total_earnings=profile.total_earnings or 0.0,
+            current_debt=profile.current_debt or 0.0
+        )
+
+@dataclass(frozen=True, slots=True)
+class UserSnapshot:
+    """لقطة مختصرة وثابتة للمستخدم (تحمل نفس أسماء حقول User)"""
+    id: int
+    telegram_id: int
+    username: Optional[str]
+    first_name: str
+    last_name: Optional[str]
+    phone: Optional[str]
+    role: UserRole
+    status: UserStatus
+    latitude: Optional[float]
+    longitude: Optional[float]
+    total_rides: int
+    rating: float
+    created_at: datetime
+    driver_profile: Optional[DriverSnapshot]
+
+    @classmethod
+    def from_model(cls, user: User) -> "UserSnapshot":
+        profile = user.driver_profile
+        return cls(
+            id=user.id,
+            telegram_id=user.telegram_id,
+            username=user.username,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            phone=user.phone,
+            role=user.role,
+            status=user.status,
+            latitude=user.latitude,
+            longitude=user.longitude,
+            total_rides=user.total_rides or 0,
+            rating=user.rating if user.rating is not None else 5.0,
+            created_at=user.created_at,
+            driver_profile=DriverSnapshot.from_model(profile) if profile else None
+        )
+
+# --- الذاكرة المؤقتة ---
+
+class UserCache:
+    """
+    ذاكرة مؤقتة داخل العملية للقطات المستخدمين مفهرسة بمعرف التيليجرام
+
+    - تحفظ المستخدمين غير المسجلين أيضاً (تخزين سلبي) لمدة أقصر.
+    - تُبطَل تلقائياً عند حفظ أي تغيير على User أو DriverProfile عبر الـ ORM،
+      ويجب إبطالها يدوياً بعد التحديثات الجماعية (query.update).
+    """
+
+    def __init__(self, ttl: float, negative_ttl: float, max_size: int):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries: Dict[int, Tuple[float, Optional[UserSnapshot]]] = {}
+        self._telegram_ids: Dict[int, int] = {}  # user.id -> telegram_id
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, session: Session, telegram_id: int) -> Optional[UserSnapshot]:
+        """الحصول على لقطة المستخدم (من الذاكرة أو من قاعدة البيانات)"""
+        entry = self._entries.get(telegram_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        generation = self._generation
+        user = get_user_by_telegram_id(session, telegram_id, refresh=True)
+
+        snapshot = UserSnapshot.from_model(user) if user else None
+
+        # لا نحفظ النتيجة إذا حدث إبطال أثناء التحميل
+        if generation == self._generation:
+            self._put(telegram_id, snapshot)
+        return snapshot
+
+    def _put(self, telegram_id: int, snapshot: Optional[UserSnapshot]):
+        ttl = self.ttl if snapshot is not None else self.negative_ttl
+        with self._lock:
+            if telegram_id not in self._entries and len(self._entries) >= self.max_size:
+                # إخراج أقدم مدخل
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+            self._entries[telegram_id] = (time.monotonic() + ttl, snapshot)
+            if snapshot is not None:
+                self._telegram_ids[snapshot.id] = telegram_id
+
+    def _drop(self, telegram_id: int):
+        entry = self._entries.pop(telegram_id, None)
+        if entry is not None and entry[1] is not None:
+            self._telegram_ids.pop(entry[1].id, None)
+
+    def invalidate(self, telegram_id: int):
+        """إبطال لقطة مستخدم بمعرف التيليجرام"""
+        with self._lock:
+            self._generation += 1
+            self._drop(telegram_id)
+
+    def invalidate_user_id(self, user_id: int):
+        """إبطال لقطة مستخدم بمعرفه في قاعدة البيانات"""
+        telegram_id = self._telegram_ids.get(user_id)
+        if telegram_id is not None:
+            self.invalidate(telegram_id)
+        else:
+            with self._lock:
+                self._generation += 1
+
+    def clear(self):
+        """مسح الذاكرة بالكامل"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._telegram_ids.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+# إنشاء الكائن العام
+user_cache = UserCache(
+    ttl=config.cache.USER_CACHE_TTL,
+    negative_ttl=config.cache.USER_CACHE_NEGATIVE_TTL,
+    max_size=config.cache.USER_CACHE_MAX_SIZE
+)
+
+# --- الإبطال التلقائي عبر أحداث الـ ORM ---
+
+_PENDING_KEY = "user_cache_invalidations"
+
+def _collect_targets(session: Session) -> Set[Tuple[str, int]]:
+    """جمع معرفات المستخدمين المتأثرين بالتغييرات الحالية دون تحميل إضافي"""
+    targets = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        state = inspect(obj).dict
+        if isinstance(obj, User):
+            if state.get("telegram_id") is not None:
+                targets.add(("telegram_id", state["telegram_id"]))
+            elif state.get("id") is not None:
+                targets.add(("user_id", state["id"]))
+        elif isinstance(obj, DriverProfile):
+            if state.get("user_id") is not None:
+                targets.add(("user_id", state["user_id"]))
+    return targets
+
+def _apply(targets: Set[Tuple[str, int]]):
+    for kind, value in targets:
+        if kind == "telegram_id":
+            user_cache.invalidate(value)
+        else:
+            user_cache.invalidate_user_id(value)
+
+@event.listens_for(Session, "before_flush")
+def _before_flush(session, flush_context, instances):
+    targets = _collect_targets(session)
+    if targets:
+        session.info.setdefault(_PENDING_KEY, set()).update(targets)
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    _apply(session.info.get(_PENDING_KEY, ()))
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    # إبطال ثانٍ بعد الحفظ حتى لا تبقى قراءة تمت قبل الحفظ في الذاكرة
+    _apply(session.info.pop(_PENDING_KEY, ()))
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
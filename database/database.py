@@ -1,14 +1,53 @@
-from sqlalchemy import create_engine, event
+from sqlalchemy import create_engine, event, select, delete, insert
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.exc import SQLAlchemyError
-from contextlib import contextmanager
+from sqlalchemy.pool import StaticPool
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Callable, Optional, TypeVar
+import asyncio
+import hashlib
 import logging
+import threading
 
 from config import config
-from database.models import Base
+from database.models import Base, SystemState
+from database.instrumentation import sql_profiler, configure_slow_query_log
+
+T = TypeVar("T")
 
 logger = logging.getLogger(__name__)
 
+# مفتاح جلسة التحديث الحالي (يُضبط لكل تحديث عند المعالجة المتزامنة)
+_update_scope: ContextVar = ContextVar("db_update_scope", default=None)
+
+# اتصالات تبقى للمهام الخلفية (الكتابة المؤجلة، صندوق الصادر، الأرشفة...)
+POOL_BACKGROUND_RESERVE = 4
+
+SCHEMA_VERSION_KEY = "schema_version"
+
+def schema_fingerprint(metadata) -> str:
+    """بصمة المخطط المعرّف في النماذج (الجداول والأعمدة والفهارس)"""
+    parts = []
+    for table in metadata.sorted_tables:
+        parts.append(table.name)
+        parts.extend(
+            f"{column.name}:{column.type!r}:{column.nullable}:{column.primary_key}"
+            for column in table.columns
+        )
+        parts.extend(sorted(
+            f"{index.name}:{','.join(column.name for column in index.columns)}:{index.unique}"
+            for index in table.indexes
+        ))
+    return hashlib.blake2b("\n".join(parts).encode(), digest_size=16).hexdigest()
+
+def _session_scope_key():
+    """جلسة لكل تحديث داخل update_scope، وإلا جلسة لكل خيط كالسابق"""
+    key = _update_scope.get()
+    if key is None:
+        return threading.get_ident()
+    return key
+
 class DatabaseManager:
     """مدير قاعدة البيانات"""
     
@@ -16,30 +55,35 @@ class DatabaseManager:
         self.engine = None
         self.session_factory = None
         self.Session = None
+        # قفل الكاتب الوحيد: SQLite يسمح بكاتب واحد فقط في كل لحظة
+        self._write_lock = threading.RLock()
+        self._write_engine = None
+        # نسخة القراءة للتقارير (اختيارية)
+        self.replica_engine = None
+        self.replica_session_factory = None
         
     def init_database(self):
         """تهيئة اتصال قاعدة البيانات"""
         try:
             # إنشاء المحرك
             connection_string = config.database.connection_string
-            echo = not config.bot.is_production
-            
-            self.engine = create_engine(
-                connection_string,
-                echo=echo,
-                pool_size=20,
-                max_overflow=30,
-                pool_pre_ping=True,
-                pool_recycle=3600
-            )
+            echo = config.database.DB_ECHO
             
             if config.database.DB_TYPE == "sqlite":
-                # تمكين المفاتيح الأجنبية لـ SQLite
-                @event.listens_for(self.engine, "connect")
-                def set_sqlite_pragma(dbapi_connection, connection_record):
-                    cursor = dbapi_connection.cursor()
-                    cursor.execute("PRAGMA foreign_keys=ON")
-                    cursor.close()
+                self.engine = self._create_sqlite_engine(connection_string, echo)
+            else:
+                self.engine = create_engine(
+                    connection_string,
+                    echo=echo,
+                    pool_size=20,
+                    max_overflow=self._pool_overflow(20, 30),
+                    pool_pre_ping=True,
+                    pool_recycle=3600
+                )
+            
+            # قياس الاستعلامات لكل تحديث
+            sql_profiler.install(self.engine)
+            configure_slow_query_log(config.database.SLOW_QUERY_LOG_FILE)
             
             # إنشاء جداول قاعدة البيانات
             self._create_tables()
@@ -50,7 +94,10 @@ class DatabaseManager:
                 autocommit=False,
                 autoflush=False
             )
-            self.Session = scoped_session(self.session_factory)
+            self.Session = scoped_session(self.session_factory, scopefunc=_session_scope_key)
+            
+            if config.database.DB_REPLICA_URL:
+                self._init_replica(config.database.DB_REPLICA_URL, echo)
             
             logger.info(f"تم تهيئة قاعدة البيانات: {config.database.DB_TYPE}")
             return True
@@ -59,19 +106,161 @@ class DatabaseManager:
             logger.error(f"فشل في تهيئة قاعدة البيانات: {e}")
             raise
     
+    @staticmethod
+    def _pool_overflow(pool_size: int, overflow: int) -> int:
+        """
+        الفائض المسموح للمجمع بحيث يكفي كل التحديثات الجارية معاً
+        
+        جلسة التحديث تحتفظ باتصالها أثناء انتظار المعالج لتيليجرام، وطلب اتصال
+        من مجمع ممتلئ يحجب حلقة الأحداث نفسها، فيتوقف البوت كله.
+        """
+        needed = config.bot.MAX_CONCURRENT_UPDATES + POOL_BACKGROUND_RESERVE
+        return max(overflow, needed - pool_size)
+    
+    def _create_sqlite_engine(self, connection_string: str, echo: bool):
+        """إنشاء محرك SQLite مضبوط للإنتاج (WAL + pragmas + تجميع مناسب)"""
+        db_config = config.database
+        in_memory = connection_string in ("sqlite://", "sqlite:///:memory:")
+        
+        engine_options = {
+            "echo": echo,
+            "connect_args": {
+                "check_same_thread": False,
+                "timeout": db_config.SQLITE_BUSY_TIMEOUT_MS / 1000
+            }
+        }
+        if in_memory:
+            # قاعدة في الذاكرة: اتصال واحد مشترك وإلا تختفي الجداول
+            engine_options["poolclass"] = StaticPool
+        else:
+            # اتصالات SQLite رخيصة والكتابة متسلسلة أصلاً، فلا داعي لمجمع كبير
+            engine_options["pool_size"] = db_config.SQLITE_POOL_SIZE
+            engine_options["max_overflow"] = self._pool_overflow(
+                db_config.SQLITE_POOL_SIZE, db_config.SQLITE_POOL_SIZE
+            )
+        
+        engine = create_engine(connection_string, **engine_options)
+        
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragma(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA foreign_keys=ON")
+            if db_config.SQLITE_WAL and not in_memory:
+                cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA synchronous={db_config.SQLITE_SYNCHRONOUS}")
+            cursor.execute(f"PRAGMA busy_timeout={int(db_config.SQLITE_BUSY_TIMEOUT_MS)}")
+            cursor.execute(f"PRAGMA mmap_size={int(db_config.SQLITE_MMAP_SIZE)}")
+            # القيمة السالبة تعني الحجم بالكيلوبايت
+            cursor.execute(f"PRAGMA cache_size=-{int(db_config.SQLITE_CACHE_SIZE_KB)}")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.close()
+        
+        @event.listens_for(engine, "begin")
+        def do_begin(conn):
+            # جلسات الكتابة تحجز القفل من البداية (BEGIN IMMEDIATE) لتجنب
+            # فشل ترقية القفل "database is locked" بعد القراءة
+            begin_mode = conn.get_execution_options().get("sqlite_begin")
+            if begin_mode:
+                conn.exec_driver_sql(begin_mode)
+        
+        self._write_engine = engine.execution_options(sqlite_begin="BEGIN IMMEDIATE")
+        return engine
+    
+    def _init_replica(self, replica_url: str, echo: bool):
+        """تهيئة محرك نسخة القراءة المخصص للتقارير"""
+        try:
+            if replica_url.startswith("sqlite"):
+                self.replica_engine = create_engine(
+                    replica_url,
+                    echo=echo,
+                    pool_size=config.database.DB_REPLICA_POOL_SIZE,
+                    connect_args={"check_same_thread": False}
+                )
+                
+                @event.listens_for(self.replica_engine, "connect")
+                def set_replica_pragma(dbapi_connection, connection_record):
+                    # منع أي كتابة عبر هذا المحرك
+                    cursor = dbapi_connection.cursor()
+                    cursor.execute("PRAGMA query_only=ON")
+                    cursor.close()
+            else:
+                self.replica_engine = create_engine(
+                    replica_url,
+                    echo=echo,
+                    pool_size=config.database.DB_REPLICA_POOL_SIZE,
+                    max_overflow=config.database.DB_REPLICA_POOL_SIZE,
+                    pool_pre_ping=True,
+                    pool_recycle=3600,
+                    execution_options={"postgresql_readonly": True}
+                )
+            
+            sql_profiler.install(self.replica_engine)
+            self.replica_session_factory = sessionmaker(
+                bind=self.replica_engine,
+                autocommit=False,
+                autoflush=False
+            )
+            logger.info("تم تهيئة نسخة القراءة للتقارير")
+            
+        except Exception as e:
+            # النسخة اختيارية: نكمل على القاعدة الرئيسية
+            logger.error(f"فشل في تهيئة نسخة القراءة، سيتم استخدام القاعدة الرئيسية: {e}")
+            self.replica_engine = None
+            self.replica_session_factory = None
+    
     def _create_tables(self):
-        """إنشاء جداول قاعدة البيانات"""
+        """
+        إنشاء جداول قاعدة البيانات
+        
+        create_all يفحص وجود كل جدول (استعلام لكل جدول، وكل استعلام رحلة عبر
+        الشبكة في PostgreSQL)، لذلك يُتخطى إن طابقت بصمة المخطط المحفوظة
+        بصمة النماذج الحالية.
+        """
         try:
-            Base.extra_data.create_all(bind=self.engine)
+            fingerprint = schema_fingerprint(Base.metadata)
+            if self._stored_schema_version() == fingerprint:
+                logger.info("مخطط قاعدة البيانات محدث، تم تخطي إنشاء الجداول")
+                return
+            
+            Base.metadata.create_all(bind=self.engine)
+            with self.engine.begin() as conn:
+                conn.execute(delete(SystemState).where(SystemState.key == SCHEMA_VERSION_KEY))
+                conn.execute(insert(SystemState).values(key=SCHEMA_VERSION_KEY, value=fingerprint))
             logger.info("تم إنشاء/تحميل جداول قاعدة البيانات")
         except Exception as e:
             logger.error(f"فشل في إنشاء الجداول: {e}")
             raise
     
+    def _stored_schema_version(self):
+        try:
+            with self.engine.connect() as conn:
+                return conn.execute(
+                    select(SystemState.value).where(SystemState.key == SCHEMA_VERSION_KEY)
+                ).scalar()
+        except SQLAlchemyError:
+            # التشغيل الأول: جدول system_state غير موجود بعد
+            return None
+    
+    @contextmanager
+    def update_scope(self):
+        """
+        جلسة مستقلة لتحديث واحد
+        
+        كل الوصول إلى جلسة المعالجات (self.session) داخل هذه الكتلة يذهب إلى
+        جلسة خاصة بالتحديث، فلا تتداخل التحديثات المعالجة بالتوازي. تُغلق
+        الجلسة عند الخروج ويُتراجع عن أي تغييرات لم تُحفظ.
+        """
+        token = _update_scope.set(object())
+        try:
+            yield
+        finally:
+            self.Session.remove()
+            _update_scope.reset(token)
+    
     @contextmanager
     def get_session(self):
         """الحصول على جلسة عمل مع إدارة السياق"""
-        session = self.Session()
+        session = self.session_factory()
         try:
             yield session
             session.commit()
@@ -82,14 +271,122 @@ class DatabaseManager:
         finally:
             session.close()
     
+    @contextmanager
+    def write_session(self):
+        """
+        جلسة كتابة قصيرة متسلسلة (طابور الكاتب الوحيد)
+        
+        في SQLite تنتظر عمليات الكتابة دورها على قفل داخل العملية بدلاً من
+        التنافس على قفل الملف، بينما يستمر القراء دون انتظار بفضل WAL.
+        لا تستخدم await داخل الكتلة حتى لا يُحجز القفل أثناء انتظار الشبكة،
+        ولا تستدعها من حلقة الأحداث (القفل تحجزه خيوط المهام الخلفية أيضاً):
+        استخدم write بدلاً منها.
+        """
+        if self._write_engine is None:
+            with self.get_session() as session:
+                yield session
+            return
+        
+        with self._write_lock:
+            session = self.session_factory(bind=self._write_engine)
+            try:
+                yield session
+                session.commit()
+            except SQLAlchemyError as e:
+                session.rollback()
+                logger.error(f"خطأ في جلسة الكتابة: {e}")
+                raise
+            finally:
+                session.close()
+    
+    async def write(self, work: Callable[..., T]) -> T:
+        """
+        تنفيذ work(session) داخل write_session في خيط منفصل
+
+        انتظار قفل الكتابة يكون في الخيط، فلا تتوقف حلقة الأحداث إن كانت
+        مهمة خلفية تكتب في نفس الوقت.
+        """
+        def run():
+            with self.write_session() as session:
+                return work(session)
+
+        return await asyncio.to_thread(run)
+
+    async def commit(self, session, work: Optional[Callable[..., Any]] = None) -> Any:
+        """
+        حفظ جلسة المعالج في خيط منفصل ضمن طابور الكاتب الوحيد
+
+        لتغييرات جُهزت على كائنات جلسة التحديث (self.session) ولا يمكن نقلها
+        إلى جلسة write جديدة. work(session) إن وُجدت تُنفذ قبل الحفظ تحت نفس
+        القفل (مثل حجز رحلة بتحديث مشروط)، وإن أعادت False يُتراجع عن الجلسة
+        ولا تُحفظ.
+
+        Returns:
+            نتيجة work إن وُجدت وإلا True، أو False إن لم تُحفظ الجلسة
+        """
+        if isinstance(session, scoped_session):
+            # الوكيل يُحل في حلقة الأحداث حيث نطاق التحديث الحالي
+            session = session()
+
+        def run():
+            lock = self._write_lock if self._write_engine is not None else nullcontext()
+            with lock:
+                try:
+                    result = work(session) if work is not None else True
+                    if result is False:
+                        session.rollback()
+                        return False
+                    session.commit()
+                    return result
+                except Exception:
+                    session.rollback()
+                    raise
+
+        return await asyncio.to_thread(run)
+
+    @contextmanager
+    def read_session(self):
+        """
+        جلسة قراءة فقط للتقارير الثقيلة
+        
+        تُوجَّه إلى نسخة القراءة إن وُجدت وكانت متاحة، وإلا إلى جلسة مستقلة
+        على القاعدة الرئيسية. لا يتم حفظ أي تغييرات عند الخروج.
+        """
+        session = self._open_read_session()
+        try:
+            yield session
+        finally:
+            session.rollback()
+            session.close()
+    
+    def _open_read_session(self):
+        """فتح جلسة على نسخة القراءة مع الرجوع للقاعدة الرئيسية عند تعذرها"""
+        if self.replica_session_factory is not None:
+            session = self.replica_session_factory()
+            try:
+                # التحقق من الاتصال قبل تسليم الجلسة
+                session.connection()
+                return session
+            except SQLAlchemyError as e:
+                logger.warning(f"نسخة القراءة غير متاحة، الرجوع للقاعدة الرئيسية: {e}")
+                session.close()
+        return self.session_factory()
+    
     def get_session_direct(self):
-        """الحصول على جلسة عمل مباشرة (للاستخدام في الـ handlers)"""
-        return self.Session()
+        """
+        الحصول على جلسة عمل مباشرة (للاستخدام في الـ handlers)
+        
+        تُعاد الجلسة المحددة النطاق نفسها (وكيل): داخل update_scope تشير إلى
+        جلسة التحديث الحالي، وخارجه إلى جلسة الخيط الحالي.
+        """
+        return self.Session
     
     def close_session(self):
         """إغلاق جلسة العمل الحالية"""
         if self.Session:
             self.Session.remove()
+        if self.replica_engine is not None:
+            self.replica_engine.dispose()
 
 # إنشاء كائن مدير قاعدة البيانات العام
 db_manager = DatabaseManager()
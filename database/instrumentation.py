@@ -0,0 +1,154 @@
+"""
+قياس استعلامات SQL لكل تحديث تيليجرام
+
+يسجل لكل تحديث عدد الجمل وزمن قاعدة البيانات الكلي وأبطأ جملة، موسوماً باسم
+المعالج. التحديثات التي يتجاوز زمنها الحد تُكتب في سجل الاستعلامات البطيئة،
+وتُجمع العدادات لكل معالج لمعرفة أكثرها استعلاماً.
+"""
+
+import functools
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import event
+
+from config import config
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("slow_query")
+
+BACKGROUND = "<background>"
+
+class UpdateQueryStats:
+    """إحصائيات الاستعلامات لتحديث واحد"""
+    __slots__ = ("handler", "statements", "total_time", "slowest_time", "slowest_statement")
+
+    def __init__(self, handler: str):
+        self.handler = handler
+        self.statements = 0
+        self.total_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+
+    def record(self, statement: str, elapsed: float):
+        self.statements += 1
+        self.total_time += elapsed
+        if elapsed > self.slowest_time:
+            self.slowest_time = elapsed
+            self.slowest_statement = statement
+
+class HandlerCounters:
+    """العدادات التراكمية لمعالج واحد"""
+    __slots__ = ("calls", "statements", "db_time", "max_statements", "slow_updates")
+
+    def __init__(self):
+        self.calls = 0
+        self.statements = 0
+        self.db_time = 0.0
+        self.max_statements = 0
+        self.slow_updates = 0
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            "calls": self.calls,
+            "statements": self.statements,
+            "avg_statements": self.statements / self.calls if self.calls else 0,
+            "max_statements": self.max_statements,
+            "db_time_ms": self.db_time * 1000,
+            "slow_updates": self.slow_updates
+        }
+
+_current_stats: ContextVar[Optional[UpdateQueryStats]] = ContextVar("sql_update_stats", default=None)
+
+class SQLProfiler:
+    """مسجل الاستعلامات عبر أحداث SQLAlchemy"""
+
+    def __init__(self, slow_threshold_ms: float):
+        self.slow_threshold = slow_threshold_ms / 1000
+        self.counters: Dict[str, HandlerCounters] = {}
+        self._lock = threading.Lock()
+
+    def install(self, engine):
+        """ربط المسجل بمحرك قاعدة البيانات"""
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.record(statement, elapsed)
+        else:
+            # استعلامات خارج المعالجات (مهام خلفية)
+            self._add(BACKGROUND, 1, elapsed)
+            if elapsed >= self.slow_threshold:
+                slow_query_logger.warning(
+                    f"handler={BACKGROUND} time={elapsed * 1000:.1f}ms statement={statement}"
+                )
+
+    def _add(self, handler: str, statements: int, db_time: float, calls: int = 0, slow: bool = False):
+        with self._lock:
+            counters = self.counters.get(handler)
+            if counters is None:
+                counters = self.counters[handler] = HandlerCounters()
+            counters.calls += calls
+            counters.statements += statements
+            counters.db_time += db_time
+            counters.max_statements = max(counters.max_statements, statements)
+            if slow:
+                counters.slow_updates += 1
+
+    def wrap(self, callback: Callable, name: Optional[str] = None) -> Callable:
+        """تغليف معالج تيليجرام لقياس استعلاماته (name يحل محل اسم الدالة في العدادات)"""
+        handler_name = name or getattr(callback, "__qualname__", repr(callback))
+
+        @functools.wraps(callback)
+        async def instrumented(update, context, *args):
+            stats = UpdateQueryStats(handler_name)
+            token = _current_stats.set(stats)
+            try:
+                return await callback(update, context, *args)
+            finally:
+                _current_stats.reset(token)
+                self._finish(stats)
+
+        return instrumented
+
+    def _finish(self, stats: UpdateQueryStats):
+        slow = stats.total_time >= self.slow_threshold
+        self._add(stats.handler, stats.statements, stats.total_time, calls=1, slow=slow)
+        if slow:
+            slow_query_logger.warning(
+                f"handler={stats.handler} statements={stats.statements} "
+                f"db_time={stats.total_time * 1000:.1f}ms "
+                f"slowest={stats.slowest_time * 1000:.1f}ms statement={stats.slowest_statement}"
+            )
+
+    def snapshot(self) -> List[Dict[str, float]]:
+        """العدادات لكل معالج مرتبة حسب عدد الجمل"""
+        with self._lock:
+            rows = [dict(handler=name, **counters.to_dict()) for name, counters in self.counters.items()]
+        rows.sort(key=lambda row: row["statements"], reverse=True)
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+
+def configure_slow_query_log(log_file: str):
+    """توجيه سجل الاستعلامات البطيئة إلى ملف مستقل"""
+    if not log_file:
+        return
+    file_handler = logging.FileHandler(log_file, encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+    slow_query_logger.addHandler(file_handler)
+    slow_query_logger.propagate = False
+
+# إنشاء الكائن العام
+sql_profiler = SQLProfiler(slow_threshold_ms=config.database.SLOW_QUERY_THRESHOLD_MS)
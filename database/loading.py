@@ -0,0 +1,57 @@
+"""
+ملفات التحميل المسبق (Loading profiles) للاستعلامات الساخنة
+
+كل ملف يحدد العلاقات التي يحتاجها المعالج ويحمّلها في نفس الاستعلام بدلاً
+من استعلام منفصل عند كل وصول (N+1). في الوضع الصارم يُضاف raiseload لكل
+العلاقات الأخرى فيرفع أي تحميل كسول غير متوقع استثناءً.
+"""
+
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy.orm import joinedload, raiseload
+
+from config import config
+from database.models import User, DriverProfile, Ride
+
+LOAD_PROFILES: Dict[str, Tuple[Callable, Tuple]] = {
+    # الرحلة مع الراكب والسائق (ride_status، الدردشة)
+    "ride_parties": (joinedload, (Ride.passenger, Ride.driver)),
+    # الرحلة مع الراكب فقط (accept_ride، complete_ride)
+    "ride_passenger": (joinedload, (Ride.passenger,)),
+    # المستخدم مع ملف السائق (ذاكرة المستخدمين، تفاصيل المستخدم)
+    "user_driver": (joinedload, (User.driver_profile,)),
+    # ملف السائق مع المستخدم (المديونية)
+    "driver_user": (joinedload, (DriverProfile.user,)),
+}
+
+_strict_loading = config.database.DB_STRICT_LOADING
+
+def set_strict_loading(enabled: bool):
+    """تفعيل/تعطيل الوضع الصارم (يُستخدم في الاختبارات)"""
+    global _strict_loading
+    _strict_loading = enabled
+
+def is_strict_loading() -> bool:
+    return _strict_loading
+
+def load_profile(name: str) -> List:
+    """
+    الحصول على خيارات التحميل لملف مسمى
+
+    Args:
+        name: اسم الملف في LOAD_PROFILES
+
+    Returns:
+        قائمة خيارات تمرر إلى query.options() أو session.get(options=...)
+    """
+    strategy, paths = LOAD_PROFILES[name]
+    options = []
+    for path in paths:
+        option = strategy(path)
+        if _strict_loading:
+            option = option.raiseload("*", sql_only=True)
+        options.append(option)
+
+    if _strict_loading:
+        options.append(raiseload("*", sql_only=True))
+    return options
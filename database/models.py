@@ -141,3 +141,72 @@ class AdminLog(Base):
     details = Column(JSON); ip_address = Column(String(45))
     created_at = Column(DateTime, default=datetime.utcnow)
     admin = relationship("User")
+
+class ArchivedRide(Base):
+    """فهرس الرحلات المؤرشفة (للوصول إلى رحلة واحدة من ملفات الأرشيف)"""
+    __tablename__ = "archived_rides"
+    id = Column(Integer, primary_key=True, index=True)
+    ride_code = Column(String(20), unique=True, index=True, nullable=False)
+    ride_id = Column(Integer, nullable=False)
+    passenger_id = Column(Integer, index=True); driver_id = Column(Integer, index=True)
+    status = Column(Enum(RideStatus)); requested_at = Column(DateTime)
+    archive_file = Column(String(255), nullable=False); line_number = Column(Integer, nullable=False)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class SystemState(Base):
+    """قيم داخلية للنظام (مثل بصمة مخطط قاعدة البيانات)"""
+    __tablename__ = "system_state"
+    key = Column(String(50), primary_key=True)
+    value = Column(String(255), nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class PendingUpdate(Base):
+    """تحديثات مستلمة لم تُعالج عند الإيقاف (تُعاد إلى الطابور عند بدء التشغيل)"""
+    __tablename__ = "pending_updates"
+    owner = Column(String(50), primary_key=True)  # العملية التي تعيدها (main أو shard:N)
+    update_id = Column(Integer, primary_key=True)
+    data = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class OutboxMessage(Base):
+    """إشعارات بانتظار الإرسال (تُكتب في نفس معاملة تغيير الحالة)"""
+    __tablename__ = "outbox_messages"
+    id = Column(Integer, primary_key=True, index=True)
+    chat_id = Column(Integer, nullable=False); kind = Column(String(30))
+    text = Column(Text, nullable=False); reply_markup = Column(JSON)
+    priority = Column(Integer, default=0)
+    status = Column(String(20), default="pending")  # pending, delivered, failed
+    attempts = Column(Integer, default=0); last_error = Column(String(255))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow); delivered_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('idx_outbox_due', 'status', 'next_attempt_at'),
+    )
+
+class Broadcast(Base):
+    """رسالة جماعية من الأدمن مع نقطة الاستئناف وعدادات التسليم"""
+    __tablename__ = "broadcasts"
+    id = Column(Integer, primary_key=True, index=True)
+    admin_id = Column(Integer, nullable=False)  # معرف تيليجرام للأدمن
+    audience = Column(String(20), nullable=False)  # drivers, passengers, all, area
+    text = Column(Text, nullable=False)
+    center_latitude = Column(Float); center_longitude = Column(Float); radius_km = Column(Float)
+    status = Column(String(20), default="running")  # running, completed, cancelled
+    # آخر users.id تم تسليمه (ترقيم keyset): الاستئناف يبدأ بعده
+    last_user_id = Column(Integer, default=0)
+    delivered = Column(Integer, default=0); failed = Column(Integer, default=0); blocked = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow); finished_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('idx_broadcast_status', 'status'),
+    )
+
+class MetricValue(Base):
+    """قيم المقاييس الحية المحفوظة دورياً (عدادات يومية ومؤشرات حالية)"""
+    __tablename__ = "metrics"
+    name = Column(String(50), primary_key=True)
+    day = Column(String(10), primary_key=True, default="")  # YYYY-MM-DD، وفارغ للمؤشرات
+    value = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,150 @@
+"""
+الاستعلامات الساخنة المبنية مسبقاً
+
+تُبنى جمل select() مرة واحدة بمعاملات مربوطة (bindparam) بدلاً من إعادة بناء
+الاستعلام عبر Query API في كل تحديث، فيبقى مفتاح ذاكرة الترجمة في SQLAlchemy
+ثابتاً ويقل العمل في بايثون لكل استدعاء.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, bindparam, update, delete
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from database.models import User, UserRole, UserStatus, DriverProfile, Ride, RideStatus, SystemState, PendingUpdate
+from database.loading import load_profile, is_strict_loading
+
+def _build_user_by_telegram_id() -> Select:
+    return select(User).options(
+        *load_profile("user_driver")
+    ).where(User.telegram_id == bindparam("telegram_id"))
+
+def _build_pending_ride_by_id() -> Select:
+    return select(Ride).options(
+        *load_profile("ride_passenger")
+    ).where(
+        Ride.id == bindparam("ride_id"),
+        Ride.status == RideStatus.PENDING
+    )
+
+def _build_available_drivers() -> Select:
+    return select(User, DriverProfile).join(
+        DriverProfile, User.id == DriverProfile.user_id
+    ).where(
+        User.role == UserRole.DRIVER,
+        User.status == UserStatus.ACTIVE,
+        DriverProfile.is_online == True,
+        DriverProfile.is_available == True,
+        User.latitude.isnot(None),
+        User.longitude.isnot(None)
+    )
+
+def _build_driver_profile_by_user_id() -> Select:
+    return select(DriverProfile).options(
+        *load_profile("driver_user")
+    ).where(DriverProfile.user_id == bindparam("user_id"))
+
+_BUILDERS = {
+    "user_by_telegram_id": _build_user_by_telegram_id,
+    "pending_ride_by_id": _build_pending_ride_by_id,
+    "available_drivers": _build_available_drivers,
+    "driver_profile_by_user_id": _build_driver_profile_by_user_id,
+}
+
+# (اسم الاستعلام، الوضع الصارم) -> الجملة المبنية
+_statements: Dict[Tuple[str, bool], Select] = {}
+
+def statement(name: str) -> Select:
+    """الحصول على الجملة المبنية مسبقاً (تُبنى مرة لكل وضع تحميل)"""
+    key = (name, is_strict_loading())
+    stmt = _statements.get(key)
+    if stmt is None:
+        stmt = _statements[key] = _BUILDERS[name]()
+    return stmt
+
+def get_user_by_telegram_id(
+    session: Session,
+    telegram_id: int,
+    refresh: bool = False
+) -> Optional[User]:
+    """
+    جلب المستخدم بمعرف التيليجرام مع ملف السائق
+
+    Args:
+        refresh: تحديث الكائن إن كان موجوداً مسبقاً في خريطة الهوية للجلسة
+    """
+    return session.execute(
+        statement("user_by_telegram_id"),
+        {"telegram_id": telegram_id},
+        execution_options={"populate_existing": refresh}
+    ).scalars().first()
+
+def get_pending_ride(session: Session, ride_id: int) -> Optional[Ride]:
+    """جلب رحلة في حالة الانتظار مع الراكب"""
+    return session.execute(
+        statement("pending_ride_by_id"),
+        {"ride_id": ride_id}
+    ).scalars().first()
+
+def claim_pending_ride(session: Session, ride_id: int, driver_id: int, accepted_at: datetime) -> bool:
+    """
+    قبول رحلة منتظرة بشرط أنها ما زالت منتظرة (مقارنة وتعيين في جملة واحدة)
+
+    يمنع قبول سائقين لنفس الرحلة حتى لو عولجا في عمليتين مختلفتين.
+    """
+    result = session.execute(
+        update(Ride).where(
+            Ride.id == ride_id,
+            Ride.status == RideStatus.PENDING
+        ).values(
+            driver_id=driver_id,
+            status=RideStatus.ACCEPTED,
+            accepted_at=accepted_at
+        )
+    )
+    return result.rowcount == 1
+
+def get_available_drivers(session: Session) -> List[Tuple[User, DriverProfile]]:
+    """جلب السائقين المتصلين والمتاحين ولهم موقع معروف"""
+    return session.execute(statement("available_drivers")).tuples().all()
+
+def get_driver_profile(session: Session, user_id: int) -> Optional[DriverProfile]:
+    """جلب ملف السائق بمعرف المستخدم مع المستخدم نفسه"""
+    return session.execute(
+        statement("driver_profile_by_user_id"),
+        {"user_id": user_id}
+    ).scalars().first()
+
+def get_system_value(session: Session, key: str, max_age: Optional[timedelta] = None) -> Optional[str]:
+    """قراءة قيمة داخلية للنظام (None إن كانت أقدم من max_age)"""
+    state = session.get(SystemState, key)
+    if state is None:
+        return None
+    if max_age is not None and state.updated_at and datetime.utcnow() - state.updated_at > max_age:
+        return None
+    return state.value
+
+def set_system_value(session: Session, key: str, value: str):
+    """كتابة قيمة داخلية للنظام (إنشاء أو تحديث)"""
+    state = session.get(SystemState, key)
+    if state is None:
+        session.add(SystemState(key=key, value=value))
+    else:
+        state.value = value
+
+def save_pending_updates(session: Session, owner: str, updates: List[Dict]):
+    """حفظ تحديثات لم تُعالج (قاموس Update.to_dict لكل تحديث)"""
+    for data in updates:
+        session.merge(PendingUpdate(owner=owner, update_id=data["update_id"], data=data))
+
+def pop_pending_updates(session: Session, owner: str) -> List[Dict]:
+    """قراءة التحديثات غير المعالجة بترتيبها وحذفها"""
+    updates = session.execute(
+        select(PendingUpdate.data).where(PendingUpdate.owner == owner).order_by(PendingUpdate.update_id)
+    ).scalars().all()
+    if updates:
+        session.execute(delete(PendingUpdate).where(PendingUpdate.owner == owner))
+    return list(updates)
@@ -0,0 +1,205 @@
+"""
+كتابة مؤجلة مجمعة لرسائل الدردشة
+
+بدلاً من حفظين متزامنين لكل رسالة (الإدراج ثم تحديث حالة التسليم)، تُجمع
+الرسائل وتحديثات التسليم في الذاكرة وتُكتب كل بضع مئات من الميلي ثانية أو
+عند بلوغ عدد معين، بإدراج جماعي واحد وتحديث جماعي واحد في معاملة واحدة.
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert, update
+
+from config import config
+from database.database import db_manager
+from database.models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+# حالات السجل المؤجل
+PENDING, IN_FLIGHT, WRITTEN, DROPPED = 0, 1, 2, 3
+
+MAX_WRITE_ATTEMPTS = 3
+
+class PendingChatMessage:
+    """رسالة دردشة بانتظار الكتابة"""
+    __slots__ = (
+        "id", "ride_id", "sender_id", "message_type", "content", "extra_data",
+        "sent_at", "is_delivered", "delivered_at", "state", "attempts"
+    )
+
+    def __init__(self, ride_id: int, sender_id: int, content: str,
+                 message_type: str = "text", extra_data: Optional[Dict] = None):
+        self.id = None
+        self.ride_id = ride_id
+        self.sender_id = sender_id
+        self.message_type = message_type
+        self.content = content
+        self.extra_data = extra_data
+        self.sent_at = datetime.utcnow()
+        self.is_delivered = False
+        self.delivered_at = None
+        self.state = PENDING
+        self.attempts = 0
+
+    def insert_params(self) -> Dict[str, Any]:
+        return {
+            "ride_id": self.ride_id,
+            "sender_id": self.sender_id,
+            "message_type": self.message_type,
+            "content": self.content,
+            "extra_data": self.extra_data,
+            "sent_at": self.sent_at,
+            "is_delivered": self.is_delivered,
+            "delivered_at": self.delivered_at
+        }
+
+class ChatMessageWriter:
+    """طابور الكتابة المؤجلة لرسائل الدردشة"""
+
+    def __init__(self, flush_interval_ms: int, batch_size: int):
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_size = batch_size
+        self._inserts: List[PendingChatMessage] = []
+        self._updates: List[PendingChatMessage] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._stopping = False
+
+    def add(self, ride_id: int, sender_id: int, content: str,
+            message_type: str = "text", extra_data: Optional[Dict] = None) -> PendingChatMessage:
+        """إضافة رسالة إلى الطابور (دون أي انتظار لقاعدة البيانات)"""
+        record = PendingChatMessage(ride_id, sender_id, content, message_type, extra_data)
+        self._inserts.append(record)
+        self._maybe_wake()
+        return record
+
+    def mark_delivered(self, record: PendingChatMessage):
+        """تسجيل تسليم الرسالة"""
+        record.is_delivered = True
+        record.delivered_at = datetime.utcnow()
+        if record.state in (IN_FLIGHT, WRITTEN):
+            # الرسالة كُتبت (أو قيد الكتابة) فنحتاج تحديثاً منفصلاً
+            self._updates.append(record)
+            self._maybe_wake()
+        # وإلا ستُدرج الحالة مع الرسالة نفسها
+
+    def _maybe_wake(self):
+        if self._wakeup is not None and len(self._inserts) + len(self._updates) >= self.batch_size:
+            self._wakeup.set()
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._inserts) + len(self._updates)
+
+    async def start(self):
+        """بدء مهمة الكتابة الدورية"""
+        if self._task is not None:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """إيقاف المهمة وكتابة كل ما تبقى (للإيقاف الآمن)"""
+        if self._task is not None:
+            # لا نلغي المهمة حتى لا تضيع معرفات دفعة قيد الكتابة
+            self._stopping = True
+            self._wakeup.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # التحديثات المعلقة على إدراج جارٍ تحتاج جولة إضافية
+        while self.pending_count:
+            before = self.pending_count
+            await self.flush()
+            if self.pending_count >= before:
+                break
+        if self.pending_count:
+            logger.error(f"تعذر حفظ {self.pending_count} من سجلات الدردشة عند الإيقاف")
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """كتابة كل السجلات المعلقة في معاملة واحدة"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            if not self._inserts and not self._updates:
+                return
+
+            inserts, self._inserts = self._inserts, []
+            # التحديثات لرسائل ما زالت قيد الإدراج تنتظر الدفعة التالية، أما
+            # الرسائل المعادة للطابور فستُدرج بحالة التسليم مباشرة
+            updates = [record for record in self._updates if record.id is not None]
+            self._updates = [record for record in self._updates if record.state == IN_FLIGHT]
+
+            for record in inserts:
+                record.state = IN_FLIGHT
+            insert_rows = [record.insert_params() for record in inserts]
+            update_rows = [
+                {"id": record.id, "is_delivered": record.is_delivered, "delivered_at": record.delivered_at}
+                for record in updates
+            ]
+
+            try:
+                ids = await asyncio.to_thread(self._write_batch, insert_rows, update_rows)
+            except Exception as e:
+                logger.error(f"خطأ في الكتابة المجمعة لرسائل الدردشة: {e}")
+                self._requeue(inserts, updates)
+                return
+
+            for record, record_id in zip(inserts, ids):
+                record.id = record_id
+                record.state = WRITTEN
+
+    def _requeue(self, inserts: List[PendingChatMessage], updates: List[PendingChatMessage]):
+        """إعادة السجلات الفاشلة للطابور مع حد أقصى للمحاولات"""
+        retry_inserts = []
+        dropped = False
+        for record in inserts:
+            record.attempts += 1
+            if record.attempts < MAX_WRITE_ATTEMPTS:
+                record.state = PENDING
+                retry_inserts.append(record)
+            else:
+                record.state = DROPPED
+                dropped = True
+                logger.error(f"إسقاط رسالة دردشة للرحلة {record.ride_id} بعد {record.attempts} محاولات")
+        self._inserts[:0] = retry_inserts
+        self._updates[:0] = updates
+        if dropped:
+            # تحديثات التسليم للرسالة المسقطة لن تجد صفاً تُكتب فيه أبداً
+            self._updates = [record for record in self._updates if record.state != DROPPED]
+
+    @staticmethod
+    def _write_batch(insert_rows: List[Dict[str, Any]], update_rows: List[Dict[str, Any]]) -> List[int]:
+        """الإدراج والتحديث الجماعي (يعمل في خيط منفصل)"""
+        ids = []
+        with db_manager.write_session() as session:
+            if insert_rows:
+                ids = session.scalars(
+                    insert(ChatMessage).returning(ChatMessage.id, sort_by_parameter_order=True),
+                    insert_rows
+                ).all()
+            if update_rows:
+                session.execute(update(ChatMessage), update_rows)
+        return ids
+
+# إنشاء الكائن العام
+chat_message_writer = ChatMessageWriter(
+    flush_interval_ms=config.database.WRITE_BEHIND_INTERVAL_MS,
+    batch_size=config.database.WRITE_BEHIND_BATCH_SIZE
+)
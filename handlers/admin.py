@@ -1,18 +1,32 @@
+import asyncio
 import logging
 from typing import Dict, List, Optional
 from datetime import datetime, timedelta
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
-from sqlalchemy import func, desc, or_
+from telegram.ext import ContextTypes, CommandHandler
+from sqlalchemy import desc, or_
 from sqlalchemy.orm import Session
 
 from config import config
 from database.database import db_manager
+from database.loading import load_profile
+from database.instrumentation import sql_profiler
+from middleware.callback_router import Action, callback_data, callback_router
+from utils.broadcast import AUDIENCES, broadcast_engine
+from utils.metrics import GAUGE, metrics
+from utils.outbound import outbound_scheduler, Priority
+from utils.stats import stats_service
 from database.models import User, UserRole, UserStatus, Ride, RideStatus, DriverProfile, DebtTransaction, AdminLog
 
 logger = logging.getLogger(__name__)
 
+PANEL_TEXT = "👨‍💼 **لوحة تحكم الأدمن**\n\nاختر الخيار المطلوب:"
+
+# صيغة التاريخ في أزرار التقارير (قصيرة لحد callback_data)
+REPORT_DATE_FORMAT = "%Y%m%d"
+MAX_REPORT_DAYS = 366
+
 class AdminHandlers:
     """معالجات لوحة تحكم الأدمن"""
     
@@ -30,158 +44,88 @@ class AdminHandlers:
                 return
             
             # إضافة سجل للأدمن
-            self._log_admin_action(
+            await self._log_admin_action(
                 admin_id=user_id,
                 action="access_panel",
                 details={"command": "admin_panel"}
             )
             
-            keyboard = [
-                [InlineKeyboardButton("📊 إحصائيات النظام", callback_data="admin_stats")],
-                [InlineKeyboardButton("👥 إدارة المستخدمين", callback_data="admin_users")],
-                [InlineKeyboardButton("🚕 إدارة السائقين", callback_data="admin_drivers")],
-                [InlineKeyboardButton("🚗 الرحلات النشطة", callback_data="admin_active_rides")],
-                [InlineKeyboardButton("💰 نظام المديونية", callback_data="admin_debts")],
-                [InlineKeyboardButton("⛔ حظر/فك حظر", callback_data="admin_ban")],
-                [InlineKeyboardButton("📈 تقارير اليوم", callback_data="admin_daily_report")],
-                [InlineKeyboardButton("⚙️ الإعدادات", callback_data="admin_settings")]
-            ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
             await update.message.reply_text(
-                "👨‍💼 **لوحة تحكم الأدمن**\n\n"
-                "اختر الخيار المطلوب:",
-                reply_markup=reply_markup
+                PANEL_TEXT,
+                reply_markup=self._panel_keyboard()
             )
             
         except Exception as e:
             logger.error(f"خطأ في عرض لوحة التحكم: {e}")
             await update.message.reply_text("حدث خطأ في عرض لوحة التحكم.")
     
-    async def admin_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """معالجة اختيارات لوحة التحكم"""
-        try:
+    @staticmethod
+    def _panel_keyboard() -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton("📊 إحصائيات النظام", callback_data=callback_data(Action.ADMIN_STATS))],
+            [InlineKeyboardButton("👥 إدارة المستخدمين", callback_data=callback_data(Action.ADMIN_USERS))],
+            [InlineKeyboardButton("🚕 إدارة السائقين", callback_data=callback_data(Action.ADMIN_DRIVERS))],
+            [InlineKeyboardButton("🚗 الرحلات النشطة", callback_data=callback_data(Action.ADMIN_ACTIVE_RIDES))],
+            [InlineKeyboardButton("💰 نظام المديونية", callback_data=callback_data(Action.ADMIN_DEBTS))],
+            [InlineKeyboardButton("⛔ حظر/فك حظر", callback_data=callback_data(Action.ADMIN_BAN))],
+            [InlineKeyboardButton("📈 تقارير اليوم", callback_data=callback_data(Action.ADMIN_DAILY_REPORT))],
+            [InlineKeyboardButton("📣 الرسائل الجماعية", callback_data=callback_data(Action.ADMIN_BROADCASTS))],
+            [InlineKeyboardButton("⚙️ الإعدادات", callback_data=callback_data(Action.ADMIN_SETTINGS))]
+        ])
+    
+    async def _show_panel(self, query):
+        """العودة إلى لوحة التحكم من زر الرجوع"""
+        await query.edit_message_text(PANEL_TEXT, reply_markup=self._panel_keyboard())
+    
+    def _admin_action(self, view):
+        """تغليف عرض من لوحة التحكم: الرد على الزر والتحقق من الصلاحية ومعالجة الأخطاء"""
+        async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE, *args):
             query = update.callback_query
-            await query.answer()
-            
-            admin_id = update.effective_user.id
-            
-            # التحقق من صلاحيات الأدمن
-            if admin_id not in config.bot.ADMIN_IDS:
-                await query.edit_message_text("⛔ ليس لديك صلاحية الوصول.")
-                return
-            
-            action = query.data
-            
-            if action == "admin_stats":
-                await self._show_system_stats(query)
-            elif action == "admin_users":
-                await self._show_users_management(query)
-            elif action == "admin_drivers":
-                await self._show_drivers_management(query)
-            elif action == "admin_active_rides":
-                await self._show_active_rides(query)
-            elif action == "admin_debts":
-                await self._show_debt_management(query)
-            elif action == "admin_ban":
-                await self._show_ban_management(query)
-            elif action == "admin_daily_report":
-                await self._show_daily_report(query)
-            elif action == "admin_settings":
-                await self._show_settings(query)
-            elif action.startswith("user_detail_"):
-                user_id = int(action.split("_")[2])
-                await self._show_user_detail(query, user_id)
-            elif action.startswith("driver_detail_"):
-                driver_id = int(action.split("_")[2])
-                await self._show_driver_detail(query, driver_id)
-            elif action.startswith("ride_detail_"):
-                ride_id = int(action.split("_")[2])
-                await self._show_ride_detail(query, ride_id)
-            elif action.startswith("ban_user_"):
-                user_id = int(action.split("_")[2])
-                await self._ban_user(query, user_id)
-            elif action.startswith("unban_user_"):
-                user_id = int(action.split("_")[2])
-                await self._unban_user(query, user_id)
-            elif action.startswith("suspend_driver_"):
-                driver_id = int(action.split("_")[2])
-                await self._suspend_driver(query, driver_id)
-            elif action.startswith("activate_driver_"):
-                driver_id = int(action.split("_")[2])
-                await self._activate_driver(query, driver_id)
-            elif action.startswith("clear_debt_"):
-                driver_id = int(action.split("_")[2])
-                await self._clear_debt(query, driver_id)
-            
-        except Exception as e:
-            logger.error(f"خطأ في معالجة callback الأدمن: {e}")
-            await query.edit_message_text("حدث خطأ في المعالجة.")
+            try:
+                await query.answer()
+                
+                # التحقق من صلاحيات الأدمن
+                if update.effective_user.id not in config.bot.ADMIN_IDS:
+                    await query.edit_message_text("⛔ ليس لديك صلاحية الوصول.")
+                    return
+                
+                await view(query, *args)
+                
+            except Exception as e:
+                logger.error(f"خطأ في معالجة callback الأدمن: {e}")
+                await query.edit_message_text("حدث خطأ في المعالجة.")
+        return callback
     
     async def _show_system_stats(self, query):
-        """عرض إحصائيات النظام"""
+        """عرض إحصائيات النظام (من اللقطة التي تُحدث في الخلفية)"""
         try:
-            # إحصائيات المستخدمين
-            total_users = self.session.query(User).count()
-            total_passengers = self.session.query(User).filter_by(role=UserRole.PASSENGER).count()
-            total_drivers = self.session.query(User).filter_by(role=UserRole.DRIVER).count()
-            active_drivers = self.session.query(DriverProfile).filter_by(is_online=True).count()
-            banned_users = self.session.query(User).filter_by(status=UserStatus.BANNED).count()
-            
-            # إحصائيات الرحلات
-            today = datetime.utcnow().date()
-            start_of_day = datetime.combine(today, datetime.min.time())
-            
-            total_rides = self.session.query(Ride).count()
-            today_rides = self.session.query(Ride).filter(
-                Ride.requested_at >= start_of_day
-            ).count()
-            
-            completed_rides = self.session.query(Ride).filter(
-                Ride.status == RideStatus.COMPLETED
-            ).count()
-            
-            # إحصائيات مالية
-            total_revenue = self.session.query(func.sum(Ride.commission_amount)).scalar() or 0
-            total_paid = self.session.query(func.sum(Ride.final_fare)).scalar() or 0
-            total_debt = self.session.query(func.sum(DriverProfile.current_debt)).scalar() or 0
-            
-            # تحليل النمو
-            week_ago = datetime.utcnow() - timedelta(days=7)
-            new_users_week = self.session.query(User).filter(
-                User.created_at >= week_ago
-            ).count()
-            
-            new_rides_week = self.session.query(Ride).filter(
-                Ride.requested_at >= week_ago
-            ).count()
+            stats = await stats_service.snapshot()
             
             stats_text = (
                 "📊 **إحصائيات النظام**\n\n"
                 f"👥 **المستخدمين:**\n"
-                f"• إجمالي المستخدمين: {total_users}\n"
-                f"• الركاب: {total_passengers}\n"
-                f"• السائقين: {total_drivers}\n"
-                f"• السائقين النشطين: {active_drivers}\n"
-                f"• المحظورين: {banned_users}\n"
-                f"• مستخدمين جدد (أسبوع): {new_users_week}\n\n"
+                f"• إجمالي المستخدمين: {stats['total_users']}\n"
+                f"• الركاب: {stats['total_passengers']}\n"
+                f"• السائقين: {stats['total_drivers']}\n"
+                f"• السائقين النشطين: {stats['active_drivers']}\n"
+                f"• المحظورين: {stats['banned_users']}\n"
+                f"• مستخدمين جدد (أسبوع): {stats['new_users_week']}\n\n"
                 
                 f"🚗 **الرحلات:**\n"
-                f"• إجمالي الرحلات: {total_rides}\n"
-                f"• الرحلات المكتملة: {completed_rides}\n"
-                f"• رحلات اليوم: {today_rides}\n"
-                f"• رحلات جديدة (أسبوع): {new_rides_week}\n\n"
+                f"• إجمالي الرحلات: {stats['total_rides']}\n"
+                f"• الرحلات المكتملة: {stats['completed_rides']}\n"
+                f"• رحلات اليوم: {stats['today_rides']}\n"
+                f"• رحلات جديدة (أسبوع): {stats['new_rides_week']}\n\n"
                 
                 f"💰 **المالية:**\n"
-                f"• إجمالي الإيرادات: {total_revenue:.2f} ريال\n"
-                f"• إجمالي المدفوعات: {total_paid:.2f} ريال\n"
-                f"• إجمالي المديونية: {total_debt:.2f} ريال\n\n"
+                f"• إجمالي الإيرادات: {stats['total_revenue']:.2f} ريال\n"
+                f"• إجمالي المدفوعات: {stats['total_paid']:.2f} ريال\n"
+                f"• إجمالي المديونية: {stats['total_debt']:.2f} ريال\n\n"
                 
-                f"⏰ **آخر تحديث:** {datetime.utcnow().strftime('%Y-%m-%d %H:%M')}"
+                f"⏰ **آخر تحديث:** {stats['computed_at'].strftime('%Y-%m-%d %H:%M')}"
             )
             
-            keyboard = [[InlineKeyboardButton("🔄 تحديث", callback_data="admin_stats")]]
+            keyboard = [[InlineKeyboardButton("🔄 تحديث", callback_data=callback_data(Action.ADMIN_STATS))]]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             await query.edit_message_text(
@@ -222,11 +166,11 @@ class AdminHandlers:
                 keyboard.append([
                     InlineKeyboardButton(
                         f"{user.first_name} ({user.role.value})",
-                        callback_data=f"user_detail_{user.id}"
+                        callback_data=callback_data(Action.ADMIN_USER_DETAIL, user.id)
                     )
                 ])
             
-            keyboard.append([InlineKeyboardButton("◀️ رجوع", callback_data="admin_panel")])
+            keyboard.append([InlineKeyboardButton("◀️ رجوع", callback_data=callback_data(Action.ADMIN_PANEL))])
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             await query.edit_message_text(
@@ -244,7 +188,9 @@ class AdminHandlers:
     async def _show_user_detail(self, query, user_id: int):
         """عرض تفاصيل المستخدم"""
         try:
-            user = self.session.query(User).filter_by(id=user_id).first()
+            user = self.session.query(User).options(
+                *load_profile("user_driver")
+            ).filter_by(id=user_id).first()
             
             if not user:
                 await query.edit_message_text("❌ لم يتم العثور على المستخدم.")
@@ -274,7 +220,7 @@ class AdminHandlers:
                     f"حالة العمل: {'🟢 نشط' if driver.is_online else '🔴 غير نشط'}\n"
                     f"المديونية: {driver.current_debt:.2f} ريال\n"
                     f"إجمالي الدخل: {driver.total_earnings:.2f} ريال\n"
-                    f"عدد الرحلات: {driver.user.total_rides}"
+                    f"عدد الرحلات: {user.total_rides}"
                 )
             
             # إحصائيات الرحلات
@@ -298,30 +244,30 @@ class AdminHandlers:
             
             if user.status != UserStatus.BANNED:
                 keyboard.append([
-                    InlineKeyboardButton("⛔ حظر المستخدم", callback_data=f"ban_user_{user.id}")
+                    InlineKeyboardButton("⛔ حظر المستخدم", callback_data=callback_data(Action.ADMIN_BAN_USER, user.id))
                 ])
             else:
                 keyboard.append([
-                    InlineKeyboardButton("✅ فك حظر المستخدم", callback_data=f"unban_user_{user.id}")
+                    InlineKeyboardButton("✅ فك حظر المستخدم", callback_data=callback_data(Action.ADMIN_UNBAN_USER, user.id))
                 ])
             
             if user.role == UserRole.DRIVER and user.driver_profile:
                 if user.status == UserStatus.ACTIVE:
                     keyboard.append([
-                        InlineKeyboardButton("⏸️ تعليق السائق", callback_data=f"suspend_driver_{user.id}")
+                        InlineKeyboardButton("⏸️ تعليق السائق", callback_data=callback_data(Action.ADMIN_SUSPEND_DRIVER, user.id))
                     ])
                 else:
                     keyboard.append([
-                        InlineKeyboardButton("▶️ تفعيل السائق", callback_data=f"activate_driver_{user.id}")
+                        InlineKeyboardButton("▶️ تفعيل السائق", callback_data=callback_data(Action.ADMIN_ACTIVATE_DRIVER, user.id))
                     ])
                 
                 if user.driver_profile.current_debt > 0:
                     keyboard.append([
-                        InlineKeyboardButton("💰 تسوية المديونية", callback_data=f"clear_debt_{user.id}")
+                        InlineKeyboardButton("💰 تسوية المديونية", callback_data=callback_data(Action.ADMIN_CLEAR_DEBT, user.id))
                     ])
             
             keyboard.append([
-                InlineKeyboardButton("◀️ رجوع", callback_data="admin_users")
+                InlineKeyboardButton("◀️ رجوع", callback_data=callback_data(Action.ADMIN_USERS))
             ])
             
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -348,7 +294,7 @@ class AdminHandlers:
             user.status = UserStatus.BANNED
             
             # إضافة سجل للأدمن
-            self._log_admin_action(
+            self._add_admin_log(
                 admin_id=admin_id,
                 action="ban_user",
                 target_type="user",
@@ -360,7 +306,7 @@ class AdminHandlers:
                 }
             )
             
-            self.session.commit()
+            await db_manager.commit(self.session)
             
             # محاولة إرسال إشعار للمستخدم
             try:
@@ -368,7 +314,8 @@ class AdminHandlers:
                     chat_id=user.telegram_id,
                     text="⛔ **تم حظر حسابك**\n\n"
                          "لقد تم حظر حسابك من قبل الإدارة.\n"
-                         "للإستفسار، يرجى التواصل مع الدعم."
+                         "للإستفسار، يرجى التواصل مع الدعم.",
+                    rate_limit_args={"priority": Priority.NOTICE}
                 )
             except:
                 pass
@@ -395,7 +342,7 @@ class AdminHandlers:
             user.status = UserStatus.ACTIVE
             
             # إضافة سجل للأدمن
-            self._log_admin_action(
+            self._add_admin_log(
                 admin_id=admin_id,
                 action="unban_user",
                 target_type="user",
@@ -406,7 +353,7 @@ class AdminHandlers:
                 }
             )
             
-            self.session.commit()
+            await db_manager.commit(self.session)
             
             # محاولة إرسال إشعار للمستخدم
             try:
@@ -414,7 +361,8 @@ class AdminHandlers:
                     chat_id=user.telegram_id,
                     text="✅ **تم فك حظر حسابك**\n\n"
                          "تم إعادة تفعيل حسابك.\n"
-                         "يمكنك الآن استخدام الخدمة مرة أخرى."
+                         "يمكنك الآن استخدام الخدمة مرة أخرى.",
+                    rate_limit_args={"priority": Priority.NOTICE}
                 )
             except:
                 pass
@@ -463,13 +411,13 @@ class AdminHandlers:
                 keyboard.append([
                     InlineKeyboardButton(
                         f"{user.first_name} - {driver.current_debt:.2f} ريال",
-                        callback_data=f"driver_detail_{user.id}"
+                        callback_data=callback_data(Action.ADMIN_DRIVER_DETAIL, user.id)
                     )
                 ])
             
             debt_summary += f"\n📊 **إجمالي المديونية:** {total_debt:.2f} ريال"
             
-            keyboard.append([InlineKeyboardButton("◀️ رجوع", callback_data="admin_panel")])
+            keyboard.append([InlineKeyboardButton("◀️ رجوع", callback_data=callback_data(Action.ADMIN_PANEL))])
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             await query.edit_message_text(
@@ -486,7 +434,9 @@ class AdminHandlers:
         try:
             admin_id = query.from_user.id
             
-            driver = self.session.query(DriverProfile).filter_by(user_id=driver_id).first()
+            driver = self.session.query(DriverProfile).options(
+                *load_profile("driver_user")
+            ).filter_by(user_id=driver_id).first()
             if not driver:
                 await query.answer("السائق غير موجود!")
                 return
@@ -506,6 +456,7 @@ class AdminHandlers:
             driver.current_debt = 0.0
             
             # إذا كان موقوفاً بسبب المديونية، نقوم بتفعيله
+            was_online = driver.is_online
             if driver.user.status == UserStatus.SUSPENDED:
                 driver.user.status = UserStatus.ACTIVE
                 driver.is_online = True
@@ -513,7 +464,7 @@ class AdminHandlers:
             self.session.add(transaction)
             
             # إضافة سجل للأدمن
-            self._log_admin_action(
+            self._add_admin_log(
                 admin_id=admin_id,
                 action="clear_debt",
                 target_type="driver",
@@ -525,7 +476,8 @@ class AdminHandlers:
                 }
             )
             
-            self.session.commit()
+            await db_manager.commit(self.session)
+            metrics.driver_status_changed(was_online, driver.is_online)
             
             await query.answer(f"✅ تم تسوية مديونية بقيمة {old_debt:.2f} ريال")
             
@@ -538,68 +490,118 @@ class AdminHandlers:
     
     async def _show_daily_report(self, query):
         """عرض تقرير اليوم"""
+        await self._show_report(query, datetime.utcnow().strftime(REPORT_DATE_FORMAT), 1)
+    
+    async def _show_report(self, query, start: str, days: int):
+        """عرض تقرير فترة: days يوماً بدءاً من start (YYYYMMDD)"""
         try:
-            today = datetime.utcnow().date()
-            start_of_day = datetime.combine(today, datetime.min.time())
-            
-            # إحصائيات الرحلات اليومية
-            today_rides = self.session.query(Ride).filter(
-                Ride.requested_at >= start_of_day
-            ).all()
-            
-            completed_rides = [r for r in today_rides if r.status == RideStatus.COMPLETED]
-            cancelled_rides = [r for r in today_rides if r.status == RideStatus.CANCELLED]
-            
-            # الإيرادات اليومية
-            daily_revenue = sum(r.commission_amount or 0 for r in completed_rides)
-            daily_earnings = sum(r.final_fare or 0 for r in completed_rides)
-            
-            # المستخدمين الجدد
-            new_users_today = self.session.query(User).filter(
-                User.created_at >= start_of_day
-            ).count()
+            start_date = datetime.strptime(start, REPORT_DATE_FORMAT)
+            days = min(max(days, 1), MAX_REPORT_DAYS)
+            report = await asyncio.to_thread(
+                stats_service.ride_report, start_date, start_date + timedelta(days=days)
+            )
             
-            # النشاط حسب الساعة
-            hourly_stats = {}
-            for ride in today_rides:
-                hour = ride.requested_at.hour
-                hourly_stats[hour] = hourly_stats.get(hour, 0) + 1
+            # التنقل بين الفترات بنفس الطول
+            previous = (start_date - timedelta(days=days)).strftime(REPORT_DATE_FORMAT)
+            following = (start_date + timedelta(days=days)).strftime(REPORT_DATE_FORMAT)
+            today = datetime.utcnow().strftime(REPORT_DATE_FORMAT)
+            week_start = (datetime.utcnow() - timedelta(days=6)).strftime(REPORT_DATE_FORMAT)
+            keyboard = [
+                [
+                    InlineKeyboardButton("◀️ السابق", callback_data=callback_data(Action.ADMIN_REPORT_RANGE, previous, days)),
+                    InlineKeyboardButton("🔄 تحديث", callback_data=callback_data(Action.ADMIN_REPORT_RANGE, start, days)),
+                    InlineKeyboardButton("التالي ▶️", callback_data=callback_data(Action.ADMIN_REPORT_RANGE, following, days))
+                ],
+                [
+                    InlineKeyboardButton("📅 اليوم", callback_data=callback_data(Action.ADMIN_REPORT_RANGE, today, 1)),
+                    InlineKeyboardButton("🗓️ آخر 7 أيام", callback_data=callback_data(Action.ADMIN_REPORT_RANGE, week_start, 7))
+                ]
+            ]
             
-            # بناء النص
-            report_text = (
-                f"📈 **تقرير اليوم** ({today.strftime('%Y-%m-%d')})\n\n"
-                f"🚗 **الرحلات:**\n"
-                f"• إجمالي الرحلات: {len(today_rides)}\n"
-                f"• المكتملة: {len(completed_rides)}\n"
-                f"• الملغاة: {len(cancelled_rides)}\n"
-                f"• نسبة الإلغاء: {(len(cancelled_rides)/len(today_rides)*100 if today_rides else 0):.1f}%\n\n"
-                
-                f"💰 **المالية:**\n"
-                f"• الإيرادات: {daily_revenue:.2f} ريال\n"
-                f"• إجمالي المبيعات: {daily_earnings:.2f} ريال\n"
-                f"• متوسط الرحلة: {(daily_earnings/len(completed_rides) if completed_rides else 0):.2f} ريال\n\n"
-                
-                f"👥 **المستخدمين:**\n"
-                f"• مستخدمين جدد: {new_users_today}\n\n"
-                
-                f"⏰ **التوزيع الساعي:**\n"
+            await query.edit_message_text(
+                self._report_text(report),
+                reply_markup=InlineKeyboardMarkup(keyboard)
             )
             
-            # إضافة الإحصائيات الساعية
-            for hour in sorted(hourly_stats.keys()):
-                report_text += f"• {hour:02d}:00 - {hourly_stats[hour]} رحلة\n"
+        except Exception as e:
+            logger.error(f"خطأ في عرض تقرير الفترة: {e}")
+            await query.edit_message_text("حدث خطأ في جلب التقرير.")
+    
+    @staticmethod
+    def _report_text(report: Dict) -> str:
+        """نص تقرير الفترة"""
+        start, end = report["start"], report["end"]
+        last_day = end - timedelta(days=1)
+        if last_day.date() == start.date():
+            period = start.strftime('%Y-%m-%d')
+            title = "تقرير اليوم" if start.date() == datetime.utcnow().date() else "تقرير يوم"
+        else:
+            period = f"{start.strftime('%Y-%m-%d')} → {last_day.strftime('%Y-%m-%d')}"
+            title = "تقرير الفترة"
+        
+        total_rides = report["total_rides"]
+        completed = report["by_status"][RideStatus.COMPLETED]
+        cancelled = report["by_status"][RideStatus.CANCELLED]
+        
+        report_text = (
+            f"📈 **{title}** ({period})\n\n"
+            f"🚗 **الرحلات:**\n"
+            f"• إجمالي الرحلات: {total_rides}\n"
+            f"• المكتملة: {completed}\n"
+            f"• الملغاة: {cancelled}\n"
+            f"• نسبة الإلغاء: {(cancelled/total_rides*100 if total_rides else 0):.1f}%\n\n"
+            
+            f"💰 **المالية:**\n"
+            f"• الإيرادات: {report['revenue']:.2f} ريال\n"
+            f"• إجمالي المبيعات: {report['earnings']:.2f} ريال\n"
+            f"• متوسط الرحلة: {(report['earnings']/completed if completed else 0):.2f} ريال\n\n"
+            
+            f"👥 **المستخدمين:**\n"
+            f"• مستخدمين جدد: {report['new_users']}\n\n"
+            
+            f"⏰ **التوزيع الساعي:**\n"
+        )
+        
+        for hour, rides in report["hourly"].items():
+            report_text += f"• {hour:02d}:00 - {rides} رحلة\n"
+        
+        return report_text
+    
+    async def report(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        تقرير أي فترة
+        
+        /report                        اليوم
+        /report 2024-05-01             يوم واحد
+        /report 2024-05-01 2024-05-31  من تاريخ إلى تاريخ (شاملاً)
+        """
+        try:
+            if update.effective_user.id not in config.bot.ADMIN_IDS:
+                await update.message.reply_text("⛔ ليس لديك صلاحية الوصول.")
+                return
             
-            keyboard = [[InlineKeyboardButton("🔄 تحديث", callback_data="admin_daily_report")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            try:
+                dates = [datetime.strptime(arg, "%Y-%m-%d") for arg in context.args[:2]]
+            except ValueError:
+                dates = None
+            if dates is None or (len(dates) == 2 and dates[1] < dates[0]):
+                await update.message.reply_text(
+                    "الاستخدام: /report [من YYYY-MM-DD] [إلى YYYY-MM-DD]"
+                )
+                return
             
-            await query.edit_message_text(
-                report_text,
-                reply_markup=reply_markup
+            start = dates[0] if dates else datetime.combine(datetime.utcnow().date(), datetime.min.time())
+            last_day = dates[-1] if dates else start
+            days = min((last_day - start).days + 1, MAX_REPORT_DAYS)
+            
+            report = await asyncio.to_thread(
+                stats_service.ride_report, start, start + timedelta(days=days)
             )
+            await update.message.reply_text(self._report_text(report))
             
         except Exception as e:
-            logger.error(f"خطأ في عرض تقرير اليوم: {e}")
-            await query.edit_message_text("حدث خطأ في جلب تقرير اليوم.")
+            logger.error(f"خطأ في عرض تقرير الفترة: {e}")
+            await update.message.reply_text("حدث خطأ في جلب التقرير.")
     
     async def _show_settings(self, query):
         """عرض إعدادات النظام"""
@@ -626,7 +628,7 @@ class AdminHandlers:
                 f"• وضع الإنتاج: {'نعم' if config.bot.is_production else 'لا'}"
             )
             
-            keyboard = [[InlineKeyboardButton("◀️ رجوع", callback_data="admin_panel")]]
+            keyboard = [[InlineKeyboardButton("◀️ رجوع", callback_data=callback_data(Action.ADMIN_PANEL))]]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             await query.edit_message_text(
@@ -638,35 +640,308 @@ class AdminHandlers:
             logger.error(f"خطأ في عرض الإعدادات: {e}")
             await query.edit_message_text("حدث خطأ في جلب الإعدادات.")
     
-    def _log_admin_action(self, admin_id: int, action: str, target_type: str = None, 
-                         target_id: int = None, details: dict = None):
-        """تسجيل إجراءات الأدمن"""
+    async def _show_broadcasts(self, query):
+        """عرض آخر الرسائل الجماعية وتقدمها"""
         try:
-            log = AdminLog(
-                admin_id=admin_id,
-                action=action,
-                target_type=target_type,
-                target_id=target_id,
-                details=details or {}
+            broadcasts = await asyncio.to_thread(broadcast_engine.recent)
+            
+            status_icons = {"running": "⏳", "completed": "✅", "cancelled": "🚫"}
+            broadcasts_text = "📣 **الرسائل الجماعية**\n\n"
+            keyboard = []
+            for broadcast in broadcasts:
+                broadcasts_text += (
+                    f"{status_icons.get(broadcast['status'], '•')} #{broadcast['id']} "
+                    f"({broadcast['audience']}) - {broadcast['created_at'].strftime('%Y-%m-%d %H:%M')}\n"
+                    f"   تم التسليم: {broadcast['delivered']} | حظروا البوت: {broadcast['blocked']} "
+                    f"| فشل: {broadcast['failed']}\n"
+                )
+                if broadcast["status"] == "running":
+                    keyboard.append([InlineKeyboardButton(
+                        f"🚫 إلغاء #{broadcast['id']}",
+                        callback_data=callback_data(Action.ADMIN_BROADCAST_CANCEL, broadcast["id"])
+                    )])
+            if not broadcasts:
+                broadcasts_text += "لا توجد رسائل جماعية بعد.\n"
+            
+            broadcasts_text += (
+                "\n**الإرسال:**\n"
+                "/broadcast drivers <النص>\n"
+                "/broadcast passengers <النص>\n"
+                "/broadcast all <النص>\n"
+                "/broadcast area <خط العرض> <خط الطول> <نصف القطر كم> <النص>"
+            )
+            
+            keyboard.append([InlineKeyboardButton("🔄 تحديث", callback_data=callback_data(Action.ADMIN_BROADCASTS))])
+            keyboard.append([InlineKeyboardButton("◀️ رجوع", callback_data=callback_data(Action.ADMIN_PANEL))])
+            
+            await query.edit_message_text(
+                broadcasts_text,
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+            
+        except Exception as e:
+            logger.error(f"خطأ في عرض الرسائل الجماعية: {e}")
+            await query.edit_message_text("حدث خطأ في جلب الرسائل الجماعية.")
+    
+    async def _cancel_broadcast(self, query, broadcast_id: int):
+        """إلغاء رسالة جماعية جارية"""
+        try:
+            if await broadcast_engine.cancel(broadcast_id):
+                await self._log_admin_action(
+                    admin_id=query.from_user.id,
+                    action="cancel_broadcast",
+                    target_type="broadcast",
+                    target_id=broadcast_id
+                )
+                await query.answer(f"✅ تم إلغاء الرسالة #{broadcast_id}")
+            else:
+                await query.answer("الرسالة انتهت مسبقاً.")
+            
+            await self._show_broadcasts(query)
+            
+        except Exception as e:
+            logger.error(f"خطأ في إلغاء الرسالة الجماعية: {e}")
+            await query.answer("❌ حدث خطأ في إلغاء الرسالة!")
+    
+    async def broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        إنشاء رسالة جماعية وبدء إرسالها في الخلفية
+        
+        /broadcast <drivers|passengers|all> <النص>
+        /broadcast area <خط العرض> <خط الطول> <نصف القطر كم> <النص>
+        """
+        try:
+            if update.effective_user.id not in config.bot.ADMIN_IDS:
+                await update.message.reply_text("⛔ ليس لديك صلاحية الوصول.")
+                return
+            
+            # النص يُؤخذ من الرسالة الأصلية حتى تبقى الأسطر كما كتبها الأدمن
+            audience = context.args[0] if context.args else None
+            area, text = None, ""
+            if audience == "area":
+                parts = update.message.text.split(maxsplit=5)
+                if len(parts) == 6:
+                    try:
+                        area = (float(parts[2]), float(parts[3]), float(parts[4]))
+                        text = parts[5].strip()
+                    except ValueError:
+                        pass
+            elif audience in AUDIENCES:
+                parts = update.message.text.split(maxsplit=2)
+                if len(parts) == 3:
+                    text = parts[2].strip()
+            
+            if not text:
+                await update.message.reply_text(
+                    "الاستخدام:\n"
+                    "/broadcast drivers <النص>\n"
+                    "/broadcast passengers <النص>\n"
+                    "/broadcast all <النص>\n"
+                    "/broadcast area <خط العرض> <خط الطول> <نصف القطر كم> <النص>"
+                )
+                return
+            
+            broadcast_id, total = await asyncio.to_thread(
+                broadcast_engine.create, update.effective_user.id, audience, text, area
+            )
+            broadcast_engine.launch(broadcast_id)
+            
+            await self._log_admin_action(
+                admin_id=update.effective_user.id,
+                action="broadcast",
+                target_type="broadcast",
+                target_id=broadcast_id,
+                details={"audience": audience, "area": area, "recipients": total}
+            )
+            
+            await update.message.reply_text(
+                f"📣 بدأ إرسال الرسالة #{broadcast_id} إلى {'حوالي ' if area else ''}{total} مستخدم.\n"
+                f"ستصلك النتيجة عند الانتهاء، والتقدم في لوحة التحكم."
+            )
+            
+        except Exception as e:
+            logger.error(f"خطأ في إنشاء الرسالة الجماعية: {e}")
+            await update.message.reply_text("حدث خطأ في إنشاء الرسالة الجماعية.")
+    
+    async def broadcast_cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """إلغاء رسالة جماعية: /broadcast_cancel <رقم الرسالة>"""
+        try:
+            if update.effective_user.id not in config.bot.ADMIN_IDS:
+                await update.message.reply_text("⛔ ليس لديك صلاحية الوصول.")
+                return
+            
+            if not context.args or not context.args[0].isdigit():
+                await update.message.reply_text("الاستخدام: /broadcast_cancel <رقم الرسالة>")
+                return
+            
+            broadcast_id = int(context.args[0])
+            if await broadcast_engine.cancel(broadcast_id):
+                await self._log_admin_action(
+                    admin_id=update.effective_user.id,
+                    action="cancel_broadcast",
+                    target_type="broadcast",
+                    target_id=broadcast_id
+                )
+                await update.message.reply_text(f"✅ تم إلغاء الرسالة #{broadcast_id}")
+            else:
+                await update.message.reply_text("❌ الرسالة غير موجودة أو انتهت مسبقاً.")
+            
+        except Exception as e:
+            logger.error(f"خطأ في إلغاء الرسالة الجماعية: {e}")
+    
+    async def live_metrics(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """عرض المقاييس الحية لليوم (من الذاكرة دون استعلام الجداول)"""
+        try:
+            if update.effective_user.id not in config.bot.ADMIN_IDS:
+                await update.message.reply_text("⛔ ليس لديك صلاحية الوصول.")
+                return
+            
+            created = metrics.get("rides_created")
+            cancelled = metrics.get("rides_cancelled")
+            metrics_text = (
+                f"📟 **المقاييس الحية** ({datetime.utcnow().strftime('%Y-%m-%d %H:%M')})\n\n"
+                f"🚗 **رحلات اليوم:**\n"
+                f"• المطلوبة: {created:.0f}\n"
+                f"• المقبولة: {metrics.get('rides_accepted'):.0f}\n"
+                f"• المكتملة: {metrics.get('rides_completed'):.0f}\n"
+                f"• الملغاة: {cancelled:.0f} "
+                f"({(cancelled/created*100 if created else 0):.1f}%)\n\n"
+                f"💰 **مالية اليوم:**\n"
+                f"• الإيرادات: {metrics.get('revenue'):.2f} ريال\n"
+                f"• المبيعات: {metrics.get('fares'):.2f} ريال\n"
+                f"• مديونية مسجلة: {metrics.get('debt_posted'):.2f} ريال\n\n"
+                f"🚕 السائقون المتصلون الآن: {metrics.get('drivers_online', GAUGE):.0f}"
             )
             
-            self.session.add(log)
-            self.session.commit()
+            await update.message.reply_text(metrics_text)
+            
+        except Exception as e:
+            logger.error(f"خطأ في عرض المقاييس الحية: {e}")
+    
+    async def sql_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """عرض عدادات استعلامات SQL لكل معالج"""
+        try:
+            if update.effective_user.id not in config.bot.ADMIN_IDS:
+                await update.message.reply_text("⛔ ليس لديك صلاحية الوصول.")
+                return
+            
+            rows = sql_profiler.snapshot()[:15]
+            if not rows:
+                await update.message.reply_text("لا توجد بيانات استعلامات بعد.")
+                return
+            
+            stats_text = "🗄️ **استعلامات SQL حسب المعالج**\n\n"
+            for row in rows:
+                stats_text += (
+                    f"• {row['handler']}\n"
+                    f"   الاستدعاءات: {row['calls']} | الجمل: {row['statements']} "
+                    f"(متوسط {row['avg_statements']:.1f}، أقصى {row['max_statements']})\n"
+                    f"   زمن القاعدة: {row['db_time_ms']:.0f}ms | بطيئة: {row['slow_updates']}\n"
+                )
+            
+            await update.message.reply_text(stats_text)
+            
+        except Exception as e:
+            logger.error(f"خطأ في عرض إحصائيات SQL: {e}")
+    
+    async def outbound_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """عرض مقاييس طابور الرسائل الصادرة"""
+        try:
+            if update.effective_user.id not in config.bot.ADMIN_IDS:
+                await update.message.reply_text("⛔ ليس لديك صلاحية الوصول.")
+                return
+            
+            stats = outbound_scheduler.snapshot()
+            waiting = " | ".join(f"{name}: {count}" for name, count in stats['waiting'].items())
+            stats_text = (
+                f"📤 **طابور الرسائل الصادرة**\n\n"
+                f"العمق الحالي: {stats['queue_depth']}\n"
+                f"حسب الأولوية: {waiting}\n"
+                f"المرسلة: {stats['sent']} | المدمجة: {stats['coalesced']} | RetryAfter: {stats['retries']}\n"
+                f"زمن الانتظار: متوسط {stats['avg_wait_ms']:.0f}ms، "
+                f"p95 {stats['p95_wait_ms']:.0f}ms، أقصى {stats['max_wait_ms']:.0f}ms\n"
+                f"{'⏸️ الإرسال متوقف مؤقتاً (RetryAfter)' if stats['paused'] else ''}"
+            )
+            
+            await update.message.reply_text(stats_text)
+            
+        except Exception as e:
+            logger.error(f"خطأ في عرض إحصائيات الرسائل الصادرة: {e}")
+    
+    async def callback_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """عرض عدادات أزرار الـ Callback لكل فعل"""
+        try:
+            if update.effective_user.id not in config.bot.ADMIN_IDS:
+                await update.message.reply_text("⛔ ليس لديك صلاحية الوصول.")
+                return
+            
+            rows = callback_router.snapshot()[:15]
+            if not rows:
+                await update.message.reply_text("لا توجد بيانات أزرار بعد.")
+                return
+            
+            stats_text = "🔘 **أزرار الـ Callback حسب الفعل**\n\n"
+            for row in rows:
+                stats_text += (
+                    f"• {row['action']}\n"
+                    f"   الاستدعاءات: {row['calls']} | الأخطاء: {row['errors']}\n"
+                    f"   الزمن: متوسط {row['avg_ms']:.0f}ms، أقصى {row['max_ms']:.0f}ms\n"
+                )
+            stats_text += f"\nحمولات غير معروفة: {callback_router.unknown}"
+            
+            await update.message.reply_text(stats_text)
+            
+        except Exception as e:
+            logger.error(f"خطأ في عرض إحصائيات الأزرار: {e}")
+    
+    async def _log_admin_action(self, admin_id: int, action: str, target_type: str = None, 
+                                target_id: int = None, details: dict = None):
+        """تسجيل إجراءات الأدمن"""
+        try:
+            self._add_admin_log(admin_id, action, target_type, target_id, details)
+            await db_manager.commit(self.session)
             
         except Exception as e:
             logger.error(f"خطأ في تسجيل إجراء الأدمن: {e}")
     
+    def _add_admin_log(self, admin_id: int, action: str, target_type: str = None, 
+                       target_id: int = None, details: dict = None):
+        """إضافة سجل إجراء الأدمن إلى الجلسة ليُحفظ مع التغيير الذي يصفه"""
+        self.session.add(AdminLog(
+            admin_id=admin_id,
+            action=action,
+            target_type=target_type,
+            target_id=target_id,
+            details=details or {}
+        ))
+    
     def get_handlers(self):
         """الحصول على جميع معالجات الأدمن"""
         return [
             CommandHandler("admin", self.admin_panel),
-            CallbackQueryHandler(self.admin_callback, pattern="^admin_"),
-            CallbackQueryHandler(self.admin_callback, pattern="^user_detail_"),
-            CallbackQueryHandler(self.admin_callback, pattern="^driver_detail_"),
-            CallbackQueryHandler(self.admin_callback, pattern="^ride_detail_"),
-            CallbackQueryHandler(self.admin_callback, pattern="^ban_"),
-            CallbackQueryHandler(self.admin_callback, pattern="^unban_"),
-            CallbackQueryHandler(self.admin_callback, pattern="^suspend_"),
-            CallbackQueryHandler(self.admin_callback, pattern="^activate_"),
-            CallbackQueryHandler(self.admin_callback, pattern="^clear_debt_")
+            CommandHandler("sql_stats", self.sql_stats),
+            CommandHandler("outbound_stats", self.outbound_stats),
+            CommandHandler("callback_stats", self.callback_stats),
+            CommandHandler("broadcast", self.broadcast),
+            CommandHandler("broadcast_cancel", self.broadcast_cancel),
+            CommandHandler("report", self.report),
+            CommandHandler("metrics", self.live_metrics)
+        ]
+    
+    def get_callback_routes(self):
+        """أزرار لوحة التحكم في موجه الـ Callback"""
+        return [
+            (Action.ADMIN_PANEL, self._admin_action(self._show_panel)),
+            (Action.ADMIN_STATS, self._admin_action(self._show_system_stats)),
+            (Action.ADMIN_USERS, self._admin_action(self._show_users_management)),
+            (Action.ADMIN_DEBTS, self._admin_action(self._show_debt_management)),
+            (Action.ADMIN_DAILY_REPORT, self._admin_action(self._show_daily_report)),
+            (Action.ADMIN_REPORT_RANGE, self._admin_action(self._show_report), (str, int)),
+            (Action.ADMIN_SETTINGS, self._admin_action(self._show_settings)),
+            (Action.ADMIN_USER_DETAIL, self._admin_action(self._show_user_detail), (int,)),
+            (Action.ADMIN_BAN_USER, self._admin_action(self._ban_user), (int,)),
+            (Action.ADMIN_UNBAN_USER, self._admin_action(self._unban_user), (int,)),
+            (Action.ADMIN_CLEAR_DEBT, self._admin_action(self._clear_debt), (int,)),
+            (Action.ADMIN_BROADCASTS, self._admin_action(self._show_broadcasts)),
+            (Action.ADMIN_BROADCAST_CANCEL, self._admin_action(self._cancel_broadcast), (int,))
         ]
\ No newline at end of file
@@ -1,11 +1,18 @@
 import logging
+from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
+from telegram.ext import ContextTypes, CommandHandler
 from sqlalchemy.orm import Session
 
-from database.models import User, UserRole, DriverProfile
+from database.models import User, UserRole, DriverProfile, Ride, RideStatus
 from database.database import db_manager
+from database.cache import user_cache
+from database.loading import load_profile
+from database.queries import get_pending_ride, claim_pending_ride
+from middleware.callback_router import Action, callback_data
 from utils.debt_system import DebtManager
+from utils.metrics import metrics
+from utils.outbox import enqueue_notification, outbox_drainer
 
 logger = logging.getLogger(__name__)
 
@@ -21,17 +28,13 @@ class DriverHandlers:
         try:
             user_id = update.effective_user.id
             
-            user = self.session.query(User).filter_by(
-                telegram_id=user_id,
-                role=UserRole.DRIVER
-            ).first()
+            user = user_cache.get(self.session, user_id)
             
-            if not user:
+            if not user or user.role != UserRole.DRIVER:
                 await update.message.reply_text("أنت لست مسجلاً كسائق.")
                 return
             
-            driver_profile = user.driver_profile
-            if not driver_profile:
+            if not user.driver_profile:
                 await update.message.reply_text("يجب إكمال ملف السائق أولاً.")
                 return
             
@@ -47,10 +50,12 @@ class DriverHandlers:
                 return
             
             # تبديل الحالة
+            driver_profile = self.session.get(DriverProfile, user.driver_profile.id)
             driver_profile.is_online = not driver_profile.is_online
             status = "🟢 مفعل" if driver_profile.is_online else "🔴 معطل"
             
-            self.session.commit()
+            await db_manager.commit(self.session)
+            metrics.driver_status_changed(not driver_profile.is_online, driver_profile.is_online)
             
             await update.message.reply_text(
                 f"✅ تم {status} وضع السائق\n\n"
@@ -62,83 +67,100 @@ class DriverHandlers:
             await update.message.reply_text("حدث خطأ.")
     
     async def accept_ride(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """قبول رحلة"""
+        """قبول رحلة بالأمر /accept"""
         try:
-            if not context.args:
-                await update.message.reply_text("الرجاء تحديد رقم الرحلة: /accept_ride <رقم_الرحلة>")
+            if not context.args or not context.args[0].isdigit():
+                await update.message.reply_text("الرجاء تحديد رقم الرحلة: /accept <رقم_الرحلة>")
                 return
             
-            ride_id = context.args[0]
-            user_id = update.effective_user.id
-            
-            # التحقق من هوية السائق
-            driver = self.session.query(User).filter_by(
-                telegram_id=user_id,
-                role=UserRole.DRIVER
-            ).first()
-            
-            if not driver or not driver.driver_profile:
-                await update.message.reply_text("أنت لست مسجلاً كسائق.")
-                return
-            
-            if not driver.driver_profile.is_online:
-                await update.message.reply_text("يجب تفعيل وضع السائق أولاً.")
-                return
-            
-            # البحث عن الرحلة
-            from database.models import Ride, RideStatus
-            ride = self.session.query(Ride).filter_by(
-                id=ride_id,
-                status=RideStatus.PENDING
-            ).first()
-            
-            if not ride:
-                await update.message.reply_text("الرحلة غير موجودة أو تم قبولها مسبقاً.")
-                return
-            
-            # قبول الرحلة
-            ride.driver_id = driver.id
-            ride.status = RideStatus.ACCEPTED
-            ride.accepted_at = datetime.utcnow()
-            
-            driver.driver_profile.current_ride_id = ride.id
-            driver.driver_profile.is_available = False
-            
-            self.session.commit()
-            
-            # إرسال إشعار للراكب
-            await context.bot.send_message(
-                chat_id=ride.passenger.telegram_id,
-                text=f"✅ تم قبول رحلتك!\n\n"
-                     f"السائق: {driver.first_name}\n"
-                     f"رقم الرحلة: {ride.ride_code}\n"
-                     f"سيتم التواصل معك قريباً."
-            )
-            
-            await update.message.reply_text(
-                f"✅ تم قبول الرحلة رقم {ride.ride_code}\n\n"
-                f"تفاصيل الرحلة:\n"
-                f"الراكب: {ride.passenger.first_name}\n"
-                f"التكلفة التقديرية: {ride.estimated_fare:.2f} ريال\n"
-                f"المسافة: {ride.distance_km:.2f} كم\n\n"
-                f"يمكنك التواصل مع الراكب عبر: /chat"
-            )
+            reply = await self._accept(update.effective_user.id, int(context.args[0]))
+            await update.message.reply_text(reply)
             
         except Exception as e:
             logger.error(f"خطأ في قبول الرحلة: {e}")
+            self.session.rollback()
             await update.message.reply_text("حدث خطأ في قبول الرحلة.")
     
+    async def accept_ride_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, ride_id: int):
+        """قبول رحلة من زر عرض الرحلة"""
+        query = update.callback_query
+        try:
+            await query.answer()
+            reply = await self._accept(update.effective_user.id, ride_id)
+            await query.edit_message_text(reply)
+            
+        except Exception as e:
+            logger.error(f"خطأ في قبول الرحلة: {e}")
+            self.session.rollback()
+            await query.edit_message_text("حدث خطأ في قبول الرحلة.")
+    
+    async def decline_ride_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """رفض عرض رحلة (إخفاء أزرار العرض فقط)"""
+        query = update.callback_query
+        await query.answer()
+        await query.edit_message_text("تم رفض الرحلة.")
+    
+    async def _accept(self, user_id: int, ride_id: int) -> str:
+        """قبول الرحلة للسائق وإرجاع نص الرد"""
+        # التحقق من هوية السائق
+        driver = user_cache.get(self.session, user_id)
+        
+        if not driver or driver.role != UserRole.DRIVER or not driver.driver_profile:
+            return "أنت لست مسجلاً كسائق."
+        
+        if not driver.driver_profile.is_online:
+            return "يجب تفعيل وضع السائق أولاً."
+        
+        # البحث عن الرحلة
+        ride = get_pending_ride(self.session, ride_id)
+        
+        if not ride:
+            return "الرحلة غير موجودة أو تم قبولها مسبقاً."
+        
+        driver_profile = self.session.get(DriverProfile, driver.driver_profile.id)
+        driver_profile.current_ride_id = ride.id
+        driver_profile.is_available = False
+        
+        # إشعار الراكب يُحفظ في نفس المعاملة ويُرسل من صندوق الصادر
+        enqueue_notification(
+            self.session,
+            chat_id=ride.passenger.telegram_id,
+            text=f"✅ تم قبول رحلتك!\n\n"
+                 f"السائق: {driver.first_name}\n"
+                 f"رقم الرحلة: {ride.ride_code}\n"
+                 f"سيتم التواصل معك قريباً.",
+            kind="ride_accepted"
+        )
+        
+        # قبول الرحلة (قد يسبقه سائق آخر يُعالج في عملية أخرى)، والحجز
+        # والتغييرات السابقة تُحفظ معاً خارج حلقة الأحداث
+        accepted_at = datetime.utcnow()
+        if not await db_manager.commit(
+            self.session,
+            lambda session: claim_pending_ride(session, ride.id, driver.id, accepted_at)
+        ):
+            return "الرحلة غير موجودة أو تم قبولها مسبقاً."
+        
+        outbox_drainer.notify()
+        metrics.ride_accepted()
+        
+        return (
+            f"✅ تم قبول الرحلة رقم {ride.ride_code}\n\n"
+            f"تفاصيل الرحلة:\n"
+            f"الراكب: {ride.passenger.first_name}\n"
+            f"التكلفة التقديرية: {ride.estimated_fare:.2f} ريال\n"
+            f"المسافة: {ride.distance_km:.2f} كم\n\n"
+            f"يمكنك التواصل مع الراكب عبر: /chat"
+        )
+    
     async def complete_ride(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """إكمال الرحلة"""
         try:
             user_id = update.effective_user.id
             
-            driver = self.session.query(User).filter_by(
-                telegram_id=user_id,
-                role=UserRole.DRIVER
-            ).first()
+            driver = user_cache.get(self.session, user_id)
             
-            if not driver or not driver.driver_profile:
+            if not driver or driver.role != UserRole.DRIVER or not driver.driver_profile:
                 await update.message.reply_text("أنت لست مسجلاً كسائق.")
                 return
             
@@ -147,39 +169,59 @@ class DriverHandlers:
                 await update.message.reply_text("ليس لديك أي رحلة نشطة.")
                 return
             
-            ride = self.session.query(Ride).get(ride_id)
+            ride = self.session.get(Ride, ride_id, options=load_profile("ride_passenger"))
             if not ride:
                 await update.message.reply_text("الرحلة غير موجودة.")
                 return
             
             # تحديث حالة الرحلة
-            from database.models import RideStatus
             ride.status = RideStatus.COMPLETED
             ride.completed_at = datetime.utcnow()
             ride.final_fare = ride.estimated_fare  # يمكن تعديله لاحقاً
             
             # تحديث إحصائيات السائق
-            driver.driver_profile.current_ride_id = None
-            driver.driver_profile.is_available = True
-            driver.driver_profile.total_earnings += ride.driver_earning
-            driver.total_rides += 1
-            
-            # إضافة العمولة إلى المديونية
-            self.debt_manager.add_commission_to_debt(
-                driver_id=driver.id,
-                ride_id=ride.id,
-                commission_amount=ride.commission_amount,
-                description=f"عمولة رحلة #{ride.ride_code}"
-            )
+            driver_profile = self.session.get(DriverProfile, driver.driver_profile.id)
+            driver_profile.current_ride_id = None
+            driver_profile.is_available = True
+            driver_profile.total_earnings += ride.driver_earning
+            self.session.get(User, driver.id).total_rides += 1
             
             # تحديث إحصائيات الراكب
             ride.passenger.total_rides += 1
             
-            self.session.commit()
+            # طلب تقييم السائق من الراكب (يُحفظ مع تغيير الحالة)
+            enqueue_notification(
+                self.session,
+                chat_id=ride.passenger.telegram_id,
+                text=f"تم إكمال رحلتك رقم {ride.ride_code}\n"
+                     f"قم بتقييم السائق:",
+                kind="ride_completed",
+                reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton(str(i), callback_data=callback_data(Action.RATE_DRIVER, ride.id, i)) for i in range(1, 6)]
+                ])
+            )
+            
+            # إضافة العمولة إلى المديونية (تحفظ مع كل ما سبق في نفس المعاملة)
+            commission = ride.commission_amount
+            description = f"عمولة رحلة #{ride.ride_code}"
+            debt = await db_manager.commit(
+                self.session,
+                lambda session: self.debt_manager.add_commission_to_debt(
+                    driver_id=driver.id,
+                    ride_id=ride.id,
+                    commission_amount=commission,
+                    description=description
+                )
+            )
+            outbox_drainer.notify()
+            metrics.debt_posted(commission)
+            if debt['suspended']:
+                metrics.driver_status_changed(debt['was_online'], False)
+            metrics.ride_completed(ride.final_fare, ride.commission_amount)
             
             # إرسال تقييم للراكب
             keyboard = [
-                [InlineKeyboardButton(str(i), callback_data=f"rate_passenger_{i}") for i in range(1, 6)]
+                [InlineKeyboardButton(str(i), callback_data=callback_data(Action.RATE_PASSENGER, ride.id, i)) for i in range(1, 6)]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
@@ -193,16 +235,6 @@ class DriverHandlers:
                 reply_markup=reply_markup
             )
             
-            # إرسال طلب تقييم للراكب
-            await context.bot.send_message(
-                chat_id=ride.passenger.telegram_id,
-                text=f"تم إكمال رحلتك رقم {ride.ride_code}\n"
-                     f"قم بتقييم السائق:",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton(str(i), callback_data=f"rate_driver_{i}") for i in range(1, 6)]
-                ])
-            )
-            
         except Exception as e:
             logger.error(f"خطأ في إكمال الرحلة: {e}")
             await update.message.reply_text("حدث خطأ في إكمال الرحلة.")
@@ -212,12 +244,9 @@ class DriverHandlers:
         try:
             user_id = update.effective_user.id
             
-            driver = self.session.query(User).filter_by(
-                telegram_id=user_id,
-                role=UserRole.DRIVER
-            ).first()
+            driver = user_cache.get(self.session, user_id)
             
-            if not driver or not driver.driver_profile:
+            if not driver or driver.role != UserRole.DRIVER or not driver.driver_profile:
                 await update.message.reply_text("أنت لست مسجلاً كسائق.")
                 return
             
@@ -254,3 +283,10 @@ class DriverHandlers:
             CommandHandler("stats", self.driver_stats),
             CommandHandler("earnings", self.driver_stats),
         ]
+    
+    def get_callback_routes(self):
+        """أزرار عروض الرحلات في موجه الـ Callback"""
+        return [
+            (Action.RIDE_ACCEPT, self.accept_ride_callback, (int,)),
+            (Action.RIDE_DECLINE, self.decline_ride_callback)
+        ]
@@ -1,14 +1,23 @@
+import asyncio
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardRemove
+from telegram.ext import ContextTypes, CommandHandler
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from datetime import datetime
 
 from config import config
 from database.models import User, UserRole, Ride, RideStatus
 from database.database import db_manager
+from database.cache import user_cache
+from database.loading import load_profile
+from middleware.callback_router import Action, callback_data
+from middleware.conversation import ConversationState, conversation_store
 from utils.location import Location, LocationService
 from utils.pricing import PricingService
+from utils.archive import RideArchiver
+from utils.metrics import metrics
+from utils.outbound import Priority
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +28,7 @@ class RideHandlers:
         self.session = db_manager.get_session_direct()
         self.location_service = LocationService()
         self.pricing_service = PricingService()
+        self.archiver = RideArchiver()
     
     async def request_ride(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """طلب رحلة جديدة"""
@@ -26,12 +36,9 @@ class RideHandlers:
             user_id = update.effective_user.id
             
             # التحقق من هوية المستخدم
-            user = self.session.query(User).filter_by(
-                telegram_id=user_id,
-                role=UserRole.PASSENGER
-            ).first()
+            user = user_cache.get(self.session, user_id)
             
-            if not user:
+            if not user or user.role != UserRole.PASSENGER:
                 await update.message.reply_text("أنت لست مسجلاً كراكب.")
                 return
             
@@ -47,43 +54,40 @@ class RideHandlers:
             await update.message.reply_text(
                 "📍 **رجاءً أرسل موقع الوجهة:**\n\n"
                 "يمكنك:\n"
-                "1. إرسال الموقع مباشرة\n"
-                "2. كتابة العنوان\n"
-                "3. استخدام /cancel للإلغاء"
+                "1. إرسال الموقع مباشرة (📎 ← الموقع)\n"
+                "2. استخدام /cancel للإلغاء"
             )
             
             # حفظ حالة الطلب
             context.user_data['ride_request'] = {
                 'passenger_id': user.id,
-                'pickup_location': Location(user.latitude, user.longitude),
-                'step': 'awaiting_destination'
+                'pickup_location': Location(user.latitude, user.longitude)
             }
+            conversation_store.set(user_id, ConversationState.AWAITING_DESTINATION)
             
         except Exception as e:
             logger.error(f"خطأ في طلب الرحلة: {e}")
             await update.message.reply_text("حدث خطأ في طلب الرحلة.")
     
     async def handle_destination(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """معالجة موقع الوجهة"""
+        """معالجة موقع الوجهة (يُستدعى في حالة انتظار الوجهة فقط)"""
         try:
+            user_id = update.effective_user.id
             if 'ride_request' not in context.user_data:
-                return
-            
-            if context.user_data['ride_request']['step'] != 'awaiting_destination':
+                conversation_store.clear(user_id)
                 return
             
             if not update.message.location:
-                await update.message.reply_text("يجب إرسال موقع صحيح.")
+                # تبقى الحالة حتى يرسل موقعاً أو يلغي
+                await update.message.reply_text("يجب إرسال موقع صحيح، أو /cancel للإلغاء.")
                 return
             
+            conversation_store.clear(user_id)
             location = update.message.location
             destination = Location(location.latitude, location.longitude)
             
             # تحديث بيانات الطلب
-            context.user_data['ride_request'].update({
-                'destination_location': destination,
-                'step': 'confirming_ride'
-            })
+            context.user_data['ride_request']['destination_location'] = destination
             
             # حساب المسافة والتكلفة
             pickup = context.user_data['ride_request']['pickup_location']
@@ -116,8 +120,8 @@ class RideHandlers:
             
             # عرض تفاصيل الرحلة للموافقة
             keyboard = [
-                [InlineKeyboardButton("✅ تأكيد الطلب", callback_data="confirm_ride")],
-                [InlineKeyboardButton("❌ إلغاء", callback_data="cancel_ride")]
+                [InlineKeyboardButton("✅ تأكيد الطلب", callback_data=callback_data(Action.RIDE_CONFIRM))],
+                [InlineKeyboardButton("❌ إلغاء", callback_data=callback_data(Action.RIDE_CANCEL))]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
@@ -169,8 +173,13 @@ class RideHandlers:
                 requested_at=datetime.utcnow()
             )
             
-            self.session.add(ride)
-            self.session.commit()
+            def create_ride(session):
+                session.add(ride)
+                session.flush()
+                return ride.id, ride.ride_code
+            
+            ride_id, ride_code = await db_manager.write(create_ride)
+            metrics.ride_created()
             
             # إرسال طلبات للسائقين القريبين
             drivers_notified = 0
@@ -178,8 +187,8 @@ class RideHandlers:
                 try:
                     keyboard = [
                         [
-                            InlineKeyboardButton("✅ قبول الرحلة", callback_data=f"accept_ride_{ride.id}"),
-                            InlineKeyboardButton("❌ رفض", callback_data="decline_ride")
+                            InlineKeyboardButton("✅ قبول الرحلة", callback_data=callback_data(Action.RIDE_ACCEPT, ride_id)),
+                            InlineKeyboardButton("❌ رفض", callback_data=callback_data(Action.RIDE_DECLINE))
                         ]
                     ]
                     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -196,7 +205,8 @@ class RideHandlers:
                     await context.bot.send_message(
                         chat_id=driver['telegram_id'],
                         text=driver_message,
-                        reply_markup=reply_markup
+                        reply_markup=reply_markup,
+                        rate_limit_args={"priority": Priority.RIDE}
                     )
                     drivers_notified += 1
                     
@@ -206,10 +216,10 @@ class RideHandlers:
             # إرسال تأكيد للراكب
             await query.edit_message_text(
                 f"✅ تم إرسال طلب رحلتك!\n\n"
-                f"رقم الرحلة: {ride.ride_code}\n"
+                f"رقم الرحلة: {ride_code}\n"
                 f"تم إرسال الطلب لـ {drivers_notified} سائق\n"
                 f"سيتم إعلامك عند قبول الرحلة.\n\n"
-                f"يمكنك متابعة حالة الرحلة باستخدام: /ride_status {ride.id}"
+                f"يمكنك متابعة حالة الرحلة باستخدام: /ride_status {ride_code}"
             )
             
             # تنظيف البيانات المؤقتة
@@ -219,6 +229,99 @@ class RideHandlers:
             logger.error(f"خطأ في تأكيد الرحلة: {e}")
             await query.edit_message_text("حدث خطأ في تأكيد الرحلة.")
     
+    async def cancel_ride_request(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """إلغاء طلب الرحلة قبل تأكيده"""
+        query = update.callback_query
+        await query.answer()
+        context.user_data.pop('ride_request', None)
+        await query.edit_message_text("تم إلغاء طلب الرحلة.")
+    
+    async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """أمر /cancel: الخروج من أي خطوة منتظرة وإلغاء طلب الرحلة غير المؤكد"""
+        user_id = update.effective_user.id
+        pending = conversation_store.get(user_id) != ConversationState.IDLE
+        conversation_store.clear(user_id)
+        pending = context.user_data.pop('ride_request', None) is not None or pending
+        
+        await update.message.reply_text(
+            "تم الإلغاء." if pending else "لا يوجد ما يمكن إلغاؤه.",
+            reply_markup=ReplyKeyboardRemove()
+        )
+    
+    async def rate_driver(self, update: Update, context: ContextTypes.DEFAULT_TYPE, ride_id: int, stars: int):
+        """تقييم الراكب للسائق بعد إكمال الرحلة"""
+        await self._rate(update, ride_id, stars, rate_driver=True)
+    
+    async def rate_passenger(self, update: Update, context: ContextTypes.DEFAULT_TYPE, ride_id: int, stars: int):
+        """تقييم السائق للراكب بعد إكمال الرحلة"""
+        await self._rate(update, ride_id, stars, rate_driver=False)
+    
+    async def _rate(self, update: Update, ride_id: int, stars: int, rate_driver: bool):
+        """
+        حفظ التقييم على الرحلة وتحديث متوسط تقييم الطرف الآخر
+        
+        ride_id = 0 يأتي من أزرار قديمة لم تحمل رقم الرحلة: تُستخدم آخر رحلة
+        مكتملة للمستخدم.
+        """
+        query = update.callback_query
+        try:
+            await query.answer()
+            
+            if not 1 <= stars <= 5:
+                await query.edit_message_text("تقييم غير صالح.")
+                return
+            
+            user = user_cache.get(self.session, update.effective_user.id)
+            if not user:
+                await query.edit_message_text("لا يمكن تقييم هذه الرحلة.")
+                return
+            
+            # المقيِّم وعمود التقييم حسب الطرف المقيَّم
+            rater_column = Ride.passenger_id if rate_driver else Ride.driver_id
+            rating_column = Ride.driver_rating if rate_driver else Ride.passenger_rating
+            
+            if ride_id:
+                ride = self.session.get(Ride, ride_id)
+            else:
+                ride = self.session.query(Ride).filter(
+                    rater_column == user.id,
+                    Ride.status == RideStatus.COMPLETED
+                ).order_by(Ride.completed_at.desc()).first()
+            
+            rater_id = None
+            if ride:
+                rater_id = ride.passenger_id if rate_driver else ride.driver_id
+            if not ride or rater_id != user.id or ride.status != RideStatus.COMPLETED:
+                await query.edit_message_text("لا يمكن تقييم هذه الرحلة.")
+                return
+            
+            if getattr(ride, rating_column.key) is not None:
+                await query.edit_message_text("تم تقييم هذه الرحلة مسبقاً.")
+                return
+            
+            setattr(ride, rating_column.key, stars)
+            rated_id = ride.driver_id if rate_driver else ride.passenger_id
+            rated_column = Ride.driver_id if rate_driver else Ride.passenger_id
+            
+            def save_rating(session):
+                # متوسط تقييمات الطرف المقيَّم في كل رحلاته (بعد كتابة التقييم
+                # الجديد، لذلك تحت نفس قفل الكتابة حتى الحفظ)
+                session.flush()
+                average = session.query(func.avg(rating_column)).filter(
+                    rated_column == rated_id,
+                    rating_column.isnot(None)
+                ).scalar()
+                session.get(User, rated_id).rating = round(float(average), 2)
+            
+            await db_manager.commit(self.session, save_rating)
+            
+            await query.edit_message_text(f"شكراً لتقييمك! {'⭐' * stars}")
+            
+        except Exception as e:
+            logger.error(f"خطأ في حفظ التقييم: {e}")
+            self.session.rollback()
+            await query.edit_message_text("حدث خطأ في حفظ التقييم.")
+    
     async def ride_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """عرض حالة الرحلة"""
         try:
@@ -227,15 +330,34 @@ class RideHandlers:
                 return
             
             ride_code = context.args[0]
-            ride = self.session.query(Ride).filter_by(ride_code=ride_code).first()
-            
-            if not ride:
-                await update.message.reply_text("لم يتم العثور على الرحلة.")
-                return
+            ride = self.session.query(Ride).options(
+                *load_profile("ride_parties")
+            ).filter_by(ride_code=ride_code).first()
             
             # التحقق من صلاحية المستخدم
             user_id = update.effective_user.id
-            user = self.session.query(User).filter_by(telegram_id=user_id).first()
+            user = user_cache.get(self.session, user_id)
+            
+            if not ride:
+                # قد تكون الرحلة مؤرشفة
+                archived = await asyncio.to_thread(self.archiver.fetch, self.session, ride_code)
+                if not archived:
+                    await update.message.reply_text("لم يتم العثور على الرحلة.")
+                    return
+                
+                if not user or user.id not in (archived['passenger_id'], archived['driver_id']):
+                    await update.message.reply_text("ليس لديك صلاحية لعرض هذه الرحلة.")
+                    return
+                
+                await update.message.reply_text(
+                    f"🗄️ **رحلة مؤرشفة**\n\n"
+                    f"🆔 **رقم الرحلة:** {archived['ride_code']}\n"
+                    f"📋 **الحالة:** {archived['status']}\n"
+                    f"📏 **المسافة:** {archived['distance_km'] or 0:.2f} كم\n"
+                    f"💰 **التكلفة:** {archived['final_fare'] or archived['estimated_fare'] or 0:.2f} ريال\n"
+                    f"⏰ **وقت الطلب:** {archived['requested_at'][:16].replace('T', ' ')}\n"
+                )
+                return
             
             if not user or (user.id != ride.passenger_id and user.id != ride.driver_id):
                 await update.message.reply_text("ليس لديك صلاحية لعرض هذه الرحلة.")
@@ -297,7 +419,14 @@ class RideHandlers:
         return [
             CommandHandler("request_ride", self.request_ride),
             CommandHandler("ride_status", self.ride_status),
-            CallbackQueryHandler(self.confirm_ride_request, pattern="^confirm_ride$"),
-            CallbackQueryHandler(self.confirm_ride_request, pattern="^accept_ride_"),
-            MessageHandler(filters.LOCATION, self.handle_destination)
+            CommandHandler("cancel", self.cancel)
+        ]
+    
+    def get_callback_routes(self):
+        """أزرار طلب الرحلة والتقييم في موجه الـ Callback"""
+        return [
+            (Action.RIDE_CONFIRM, self.confirm_ride_request),
+            (Action.RIDE_CANCEL, self.cancel_ride_request),
+            (Action.RATE_DRIVER, self.rate_driver, (int, int)),
+            (Action.RATE_PASSENGER, self.rate_passenger, (int, int))
         ]
@@ -1,11 +1,18 @@
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes, CommandHandler, MessageHandler, filters, CallbackQueryHandler
+from datetime import datetime
+from telegram import (
+    Update, InlineKeyboardButton, InlineKeyboardMarkup,
+    KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
+)
+from telegram.ext import ContextTypes, CommandHandler
 from sqlalchemy.orm import Session
 
 from config import config
 from database.models import User, UserRole, UserStatus
 from database.database import db_manager
+from database.cache import user_cache, UserSnapshot
+from middleware.callback_router import Action, callback_data
+from middleware.conversation import ConversationState, conversation_store
 
 logger = logging.getLogger(__name__)
 
@@ -21,9 +28,7 @@ class UserHandlers:
             user_id = update.effective_user.id
             
             # التحقق إذا كان المستخدم مسجلاً مسبقاً
-            existing_user = self.session.query(User).filter_by(
-                telegram_id=user_id
-            ).first()
+            existing_user = user_cache.get(self.session, user_id)
             
             if existing_user:
                 # ترحيب بالمستخدم المسجل
@@ -33,8 +38,8 @@ class UserHandlers:
             # عرض خيارات التسجيل للمستخدم الجديد
             keyboard = [
                 [
-                    InlineKeyboardButton("🚖 سائق", callback_data="register_driver"),
-                    InlineKeyboardButton("👤 راكب", callback_data="register_passenger")
+                    InlineKeyboardButton("🚖 سائق", callback_data=callback_data(Action.REGISTER, "driver")),
+                    InlineKeyboardButton("👤 راكب", callback_data=callback_data(Action.REGISTER, "passenger"))
                 ]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -56,14 +61,13 @@ class UserHandlers:
             logger.error(f"خطأ في معالجة start: {e}")
             await update.message.reply_text("حدث خطأ، يرجى المحاولة لاحقاً.")
     
-    async def register_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def register_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE, role: str):
         """معالجة اختيار نوع المستخدم"""
         try:
             query = update.callback_query
             await query.answer()
             
             user_data = query.from_user
-            role = query.data.replace("register_", "")
             
             # التحقق من الصلاحية
             if role not in ["driver", "passenger"]:
@@ -71,9 +75,7 @@ class UserHandlers:
                 return
             
             # التحقق من عدم التسجيل مسبقاً
-            existing_user = self.session.query(User).filter_by(
-                telegram_id=user_data.id
-            ).first()
+            existing_user = user_cache.get(self.session, user_data.id)
             
             if existing_user:
                 await query.edit_message_text(
@@ -92,7 +94,7 @@ class UserHandlers:
             )
             
             self.session.add(new_user)
-            self.session.commit()
+            await db_manager.commit(self.session)
             
             # رسالة الترحيب حسب الدور
             if role == "driver":
@@ -121,7 +123,7 @@ class UserHandlers:
             self.session.rollback()
             await query.edit_message_text("حدث خطأ في التسجيل.")
     
-    async def _show_main_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user: User):
+    async def _show_main_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user: UserSnapshot):
         """عرض القائمة الرئيسية حسب دور المستخدم"""
         if user.role == UserRole.DRIVER:
             keyboard = [
@@ -143,8 +145,8 @@ class UserHandlers:
         
         else:  # ADMIN
             keyboard = [
-                [InlineKeyboardButton("👨‍💼 لوحة التحكم", callback_data="admin_panel")],
-                [InlineKeyboardButton("📊 إحصائيات النظام", callback_data="system_stats")]
+                [InlineKeyboardButton("👨‍💼 لوحة التحكم", callback_data=callback_data(Action.ADMIN_PANEL))],
+                [InlineKeyboardButton("📊 إحصائيات النظام", callback_data=callback_data(Action.ADMIN_STATS))]
             ]
             message = f"مرحباً بالأدمن {user.first_name}!"
         
@@ -163,10 +165,12 @@ class UserHandlers:
     
     async def set_location(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """طلب تحديد الموقع من المستخدم"""
+        # زر مشاركة الموقع متاح في لوحة المفاتيح العادية فقط وليس في الأزرار المضمنة
         keyboard = [
-            [InlineKeyboardButton("📍 إرسال موقعي الحالي", request_location=True)]
+            [KeyboardButton("📍 إرسال موقعي الحالي", request_location=True)]
         ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+        conversation_store.set(update.effective_user.id, ConversationState.AWAITING_LOCATION)
         
         await update.message.reply_text(
             "رجاءً أرسل موقعك الحالي لتحديد أقرب السائقين لك:",
@@ -178,22 +182,31 @@ class UserHandlers:
         try:
             location = update.message.location
             user_id = update.effective_user.id
+            conversation_store.clear(user_id)
             
-            user = self.session.query(User).filter_by(telegram_id=user_id).first()
+            user = user_cache.get(self.session, user_id)
             if not user:
-                await update.message.reply_text("لم يتم العثور على حسابك.")
+                await update.message.reply_text(
+                    "لم يتم العثور على حسابك.",
+                    reply_markup=ReplyKeyboardRemove()
+                )
                 return
             
-            # تحديث الموقع
-            user.latitude = location.latitude
-            user.longitude = location.longitude
-            user.location_updated_at = datetime.utcnow()
-            
-            self.session.commit()
+            # تحديث الموقع عبر طابور الكتابة
+            await db_manager.write(
+                lambda session: session.query(User).filter_by(id=user.id).update({
+                    User.latitude: location.latitude,
+                    User.longitude: location.longitude,
+                    User.location_updated_at: datetime.utcnow()
+                }, synchronize_session=False)
+            )
+            # التحديث الجماعي لا يمر بأحداث الـ ORM
+            user_cache.invalidate(user_id)
             
             await update.message.reply_text(
                 "✅ تم تحديث موقعك بنجاح!\n\n"
-                f"الإحداثيات: {location.latitude}, {location.longitude}"
+                f"الإحداثيات: {location.latitude}, {location.longitude}",
+                reply_markup=ReplyKeyboardRemove()
             )
             
         except Exception as e:
@@ -204,7 +217,7 @@ class UserHandlers:
         """عرض الملف الشخصي"""
         try:
             user_id = update.effective_user.id
-            user = self.session.query(User).filter_by(telegram_id=user_id).first()
+            user = user_cache.get(self.session, user_id)
             
             if not user:
                 await update.message.reply_text("لم يتم العثور على حسابك.")
@@ -241,7 +254,11 @@ class UserHandlers:
         return [
             CommandHandler("start", self.start),
             CommandHandler("profile", self.my_profile),
-            CommandHandler("set_location", self.set_location),
-            CallbackQueryHandler(self.register_user, pattern="^register_"),
-            MessageHandler(filters.LOCATION, self.handle_location)
+            CommandHandler("set_location", self.set_location)
+        ]
+    
+    def get_callback_routes(self):
+        """أزرار التسجيل في موجه الـ Callback"""
+        return [
+            (Action.REGISTER, self.register_user, (str,))
         ]
@@ -0,0 +1,246 @@
+"""
+موجه أزرار الـ Callback
+
+بدلاً من تسجيل CallbackQueryHandler بنمط regex لكل بادئة ثم إعادة تحليل
+query.data بسلسلة if/elif، يُسجل معالج واحد يفك حمولة مختصرة ومرقمة الإصدار
+ويوجهها بالبحث في قاموس:
+
+    1:<رمز الفعل>[:<معامل>...]      مثال: "1:ra:152" = قبول الرحلة 152
+
+الأزرار القديمة الموجودة في رسائل أُرسلت سابقاً (accept_ride_152،
+admin_stats...) ما زالت تعمل عبر جدول التوافق. لكل فعل عدادات زمن المعالجة.
+"""
+
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from telegram import Update
+from telegram.ext import CallbackQueryHandler, ContextTypes
+
+from database.instrumentation import sql_profiler
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_VERSION = "1"
+# حد تيليجرام لـ callback_data بالبايت
+MAX_CALLBACK_DATA = 64
+
+class Action:
+    """
+    رموز الأفعال المختصرة
+
+    لا يُعاد استخدام رمز لفعل آخر: الأزرار في الرسائل القديمة تحمله.
+    """
+    ADMIN_PANEL = "ap"
+    ADMIN_STATS = "as"
+    ADMIN_USERS = "au"
+    ADMIN_DRIVERS = "adr"
+    ADMIN_ACTIVE_RIDES = "aar"
+    ADMIN_DEBTS = "ad"
+    ADMIN_BAN = "ab"
+    ADMIN_DAILY_REPORT = "aq"
+    ADMIN_SETTINGS = "ast"
+    ADMIN_USER_DETAIL = "aud"
+    ADMIN_DRIVER_DETAIL = "add"
+    ADMIN_RIDE_DETAIL = "ard"
+    ADMIN_BAN_USER = "abu"
+    ADMIN_UNBAN_USER = "auu"
+    ADMIN_SUSPEND_DRIVER = "asd"
+    ADMIN_ACTIVATE_DRIVER = "aad"
+    ADMIN_CLEAR_DEBT = "acd"
+    ADMIN_BROADCASTS = "abr"
+    ADMIN_BROADCAST_CANCEL = "abx"
+    ADMIN_REPORT_RANGE = "arr"
+    REGISTER = "rg"
+    RIDE_CONFIRM = "rc"
+    RIDE_CANCEL = "rx"
+    RIDE_ACCEPT = "ra"
+    RIDE_DECLINE = "rd"
+    RATE_DRIVER = "rtd"
+    RATE_PASSENGER = "rtp"
+
+ACTION_NAMES: Dict[str, str] = {
+    code: name.lower() for name, code in vars(Action).items() if not name.startswith("_")
+}
+
+# الأفعال التي معاملها الأول رقم رحلة (لتسلسل تحديثات نفس الرحلة)
+RIDE_KEYED_ACTIONS = {
+    Action.RIDE_ACCEPT, Action.ADMIN_RIDE_DETAIL, Action.RATE_DRIVER, Action.RATE_PASSENGER
+}
+
+# الحمولات القديمة الكاملة -> (الفعل، المعاملات)
+LEGACY_EXACT: Dict[str, Tuple[str, Tuple[str, ...]]] = {
+    "admin_panel": (Action.ADMIN_PANEL, ()),
+    "admin_stats": (Action.ADMIN_STATS, ()),
+    "admin_users": (Action.ADMIN_USERS, ()),
+    "admin_drivers": (Action.ADMIN_DRIVERS, ()),
+    "admin_active_rides": (Action.ADMIN_ACTIVE_RIDES, ()),
+    "admin_debts": (Action.ADMIN_DEBTS, ()),
+    "admin_ban": (Action.ADMIN_BAN, ()),
+    "admin_daily_report": (Action.ADMIN_DAILY_REPORT, ()),
+    "admin_settings": (Action.ADMIN_SETTINGS, ()),
+    "register_driver": (Action.REGISTER, ("driver",)),
+    "register_passenger": (Action.REGISTER, ("passenger",)),
+    "confirm_ride": (Action.RIDE_CONFIRM, ()),
+    "cancel_ride": (Action.RIDE_CANCEL, ()),
+    "decline_ride": (Action.RIDE_DECLINE, ()),
+}
+
+# البادئات القديمة بمعامل رقمي في آخرها -> دالة تبني (الفعل، المعاملات)
+LEGACY_PREFIX: Dict[str, Callable[[str], Tuple[str, Tuple[str, ...]]]] = {
+    "user_detail": lambda value: (Action.ADMIN_USER_DETAIL, (value,)),
+    "driver_detail": lambda value: (Action.ADMIN_DRIVER_DETAIL, (value,)),
+    "ride_detail": lambda value: (Action.ADMIN_RIDE_DETAIL, (value,)),
+    "ban_user": lambda value: (Action.ADMIN_BAN_USER, (value,)),
+    "unban_user": lambda value: (Action.ADMIN_UNBAN_USER, (value,)),
+    "suspend_driver": lambda value: (Action.ADMIN_SUSPEND_DRIVER, (value,)),
+    "activate_driver": lambda value: (Action.ADMIN_ACTIVATE_DRIVER, (value,)),
+    "clear_debt": lambda value: (Action.ADMIN_CLEAR_DEBT, (value,)),
+    "accept_ride": lambda value: (Action.RIDE_ACCEPT, (value,)),
+    # أزرار التقييم القديمة لم تحمل رقم الرحلة: 0 = آخر رحلة مكتملة للمستخدم
+    "rate_driver": lambda value: (Action.RATE_DRIVER, ("0", value)),
+    "rate_passenger": lambda value: (Action.RATE_PASSENGER, ("0", value)),
+}
+
+def callback_data(action: str, *args: Any) -> str:
+    """بناء حمولة زر بالصيغة الحالية"""
+    data = ":".join((CALLBACK_VERSION, action, *map(str, args)))
+    if len(data.encode()) > MAX_CALLBACK_DATA:
+        raise ValueError(f"callback_data أطول من {MAX_CALLBACK_DATA} بايت: {data}")
+    return data
+
+def decode(data: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
+    """فك الحمولة إلى (الفعل، المعاملات النصية)، أو None إن لم تُعرف"""
+    if not data:
+        return None
+
+    version, sep, rest = data.partition(":")
+    if sep and version == CALLBACK_VERSION:
+        action, *args = rest.split(":")
+        return action, tuple(args)
+
+    legacy = LEGACY_EXACT.get(data)
+    if legacy is not None:
+        return legacy
+
+    prefix, sep, value = data.rpartition("_")
+    if sep and value.isdigit():
+        build = LEGACY_PREFIX.get(prefix)
+        if build is not None:
+            return build(value)
+    return None
+
+class ActionStats:
+    """عدادات فعل واحد"""
+    __slots__ = ("calls", "errors", "total_time", "max_time")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def add(self, elapsed: float, failed: bool):
+        self.calls += 1
+        self.errors += failed
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+class _Route:
+    __slots__ = ("callback", "arg_types")
+
+    def __init__(self, callback: Callable[..., Awaitable[Any]], arg_types: Sequence[type]):
+        self.callback = callback
+        self.arg_types = tuple(arg_types)
+
+class CallbackRouter:
+    """التوجيه من رمز الفعل إلى المعالج"""
+
+    def __init__(self):
+        self._routes: Dict[str, _Route] = {}
+        self.stats: Dict[str, ActionStats] = {}
+        self.unknown = 0
+
+    def register(
+        self,
+        action: str,
+        callback: Callable[..., Awaitable[Any]],
+        arg_types: Sequence[type] = ()
+    ):
+        """
+        ربط فعل بمعالج يُستدعى بـ (update, context, *args)
+
+        Args:
+            arg_types: أنواع المعاملات بالترتيب، تُحول قبل الاستدعاء وتُرفض
+                الحمولة إن لم تطابقها
+        """
+        if action in self._routes:
+            raise ValueError(f"الفعل {action} مسجل مسبقاً")
+        name = f"callback:{ACTION_NAMES.get(action, action)}"
+        self._routes[action] = _Route(sql_profiler.wrap(callback, name=name), arg_types)
+        self.stats[action] = ActionStats()
+
+    def register_all(self, routes: List[Tuple]):
+        """تسجيل قائمة (الفعل، المعالج[، أنواع المعاملات])"""
+        for route in routes:
+            self.register(*route)
+
+    def ride_id(self, data: str) -> Optional[int]:
+        """رقم الرحلة في حمولة الزر إن كان الفعل خاصاً برحلة"""
+        decoded = decode(data)
+        if decoded is None:
+            return None
+        action, args = decoded
+        if action in RIDE_KEYED_ACTIONS and args and args[0].isdigit() and args[0] != "0":
+            return int(args[0])
+        return None
+
+    async def handle(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        decoded = decode(query.data)
+        route = self._routes.get(decoded[0]) if decoded else None
+        if route is None:
+            self.unknown += 1
+            await query.answer("هذا الخيار غير متاح حالياً.")
+            return
+
+        action, raw_args = decoded
+        try:
+            if len(raw_args) != len(route.arg_types):
+                raise ValueError(raw_args)
+            args = [arg_type(raw) for arg_type, raw in zip(route.arg_types, raw_args)]
+        except ValueError:
+            self.unknown += 1
+            logger.warning(f"حمولة callback غير صالحة: {query.data}")
+            await query.answer("زر غير صالح.")
+            return
+
+        started = time.perf_counter()
+        failed = True
+        try:
+            await route.callback(update, context, *args)
+            failed = False
+        finally:
+            self.stats[action].add(time.perf_counter() - started, failed)
+
+    def get_handler(self) -> CallbackQueryHandler:
+        return CallbackQueryHandler(self.handle)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """عدادات الأفعال مرتبة حسب عدد الاستدعاءات"""
+        rows = [
+            {
+                "action": ACTION_NAMES.get(action, action),
+                "calls": stats.calls,
+                "errors": stats.errors,
+                "avg_ms": stats.total_time / stats.calls * 1000 if stats.calls else 0,
+                "max_ms": stats.max_time * 1000
+            }
+            for action, stats in self.stats.items() if stats.calls
+        ]
+        rows.sort(key=lambda row: row["calls"], reverse=True)
+        return rows
+
+# إنشاء الكائن العام
+callback_router = CallbackRouter()
@@ -1,47 +1,120 @@
+import asyncio
 import logging
-from typing import Dict, Optional
+from typing import Any, Callable, Dict, Optional
 from datetime import datetime
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes, MessageHandler, filters, CallbackQueryHandler
+from telegram.ext import ContextTypes, CommandHandler, filters, CallbackQueryHandler
+from sqlalchemy import select, func
 from sqlalchemy.orm import Session
 
 from database.models import Ride, RideStatus, ChatMessage, User
 from database.database import db_manager
+from database.loading import load_profile
+from database.write_behind import chat_message_writer
+from middleware.chat_registry import ChatSession, create_chat_registry
+from utils.outbound import Priority
 
 logger = logging.getLogger(__name__)
 
+# أنواع الوسائط المنسوخة (الصور تُعالج منفصلة لأنها قائمة مقاسات)
+# ملاحظة: animation قبل document لأن تيليجرام يرسل الصور المتحركة بالحقلين معاً
+MEDIA_ATTRIBUTES = ("animation", "video", "video_note", "voice", "audio", "document", "sticker")
+
+# الأنواع التي تقبل تعليقاً عند النسخ
+CAPTIONED_MEDIA = {"photo", "animation", "video", "voice", "audio", "document"}
+
+CHAT_MEDIA_FILTER = (
+    filters.PHOTO | filters.ANIMATION | filters.VIDEO | filters.VIDEO_NOTE |
+    filters.VOICE | filters.AUDIO | filters.Document.ALL | filters.Sticker.ALL
+)
+
 class ChatManager:
     """مدير الدردشة الوسيطة بين الراكب والسائق"""
     
     def __init__(self):
         self.session = db_manager.get_session_direct()
-        self.active_chats: Dict[int, Dict] = {}  # ride_id -> chat_data
+        # سجل الدردشات النشطة (ذاكرة أو SQLite أو Redis حسب الإعدادات)
+        self.registry = create_chat_registry()
+    
+    async def _registry_call(self, method: Callable[..., Any], *args) -> Any:
+        """استدعاء السجل خارج حلقة الأحداث إن كان مخزنه يحجب (SQLite أو Redis)"""
+        if self.registry.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
     
-    def get_active_chat(self, user_id: int) -> Optional[Dict]:
+    async def get_active_chat(self, user_id: int) -> Optional[ChatSession]:
         """الحصول على الدردشة النشطة للمستخدم"""
-        for ride_id, chat_data in self.active_chats.items():
-            if user_id in [chat_data.get('passenger_id'), chat_data.get('driver_id')]:
-                return chat_data
-        return None
+        return await self._registry_call(self.registry.get_by_user, user_id)
+    
+    def rehydrate(self) -> int:
+        """
+        مزامنة السجل مع الرحلات الجارية في قاعدة البيانات (عند بدء التشغيل)
+        
+        تُضاف الرحلات الجارية غير الموجودة في السجل مع عدد رسائلها، وتُحذف من
+        السجل الدردشات التي لم تعد رحلاتها جارية.
+        
+        Returns:
+            عدد الدردشات المستعادة
+        """
+        session = db_manager.session_factory()
+        try:
+            rides = session.execute(
+                select(Ride).options(*load_profile("ride_parties")).where(
+                    Ride.status == RideStatus.IN_PROGRESS,
+                    Ride.driver_id.isnot(None)
+                )
+            ).scalars().all()
+            in_progress = {ride.id: ride for ride in rides}
+            
+            known = self.registry.ride_ids()
+            for ride_id in known - in_progress.keys():
+                self.registry.remove(ride_id)
+            
+            missing = [ride_id for ride_id in in_progress if ride_id not in known]
+            message_counts = {}
+            if missing:
+                message_counts = dict(session.execute(
+                    select(ChatMessage.ride_id, func.count(ChatMessage.id)).where(
+                        ChatMessage.ride_id.in_(missing)
+                    ).group_by(ChatMessage.ride_id)
+                ).all())
+            
+            for ride_id in missing:
+                ride = in_progress[ride_id]
+                self.registry.add(ChatSession(
+                    ride_id=ride.id,
+                    passenger_id=ride.passenger.telegram_id,
+                    driver_id=ride.driver.telegram_id,
+                    passenger_user_id=ride.passenger_id,
+                    driver_user_id=ride.driver_id,
+                    started_at=ride.started_at,
+                    message_count=message_counts.get(ride.id, 0)
+                ))
+        finally:
+            session.close()
+        
+        if missing:
+            logger.info(f"تمت استعادة {len(missing)} دردشة نشطة")
+        return len(missing)
     
     async def start_chat(self, ride_id: int, context: ContextTypes.DEFAULT_TYPE):
         """بدء دردشة جديدة لرحلة"""
         try:
-            ride = self.session.query(Ride).get(ride_id)
+            ride = self.session.get(Ride, ride_id, options=load_profile("ride_parties"))
             if not ride or ride.status != RideStatus.IN_PROGRESS:
                 return False
             
             # إنشاء بيانات الدردشة
-            chat_data = {
-                'ride_id': ride_id,
-                'passenger_id': ride.passenger.telegram_id,
-                'driver_id': ride.driver.telegram_id,
-                'started_at': datetime.utcnow(),
-                'message_count': 0
-            }
+            chat_data = ChatSession(
+                ride_id=ride_id,
+                passenger_id=ride.passenger.telegram_id,
+                driver_id=ride.driver.telegram_id,
+                passenger_user_id=ride.passenger_id,
+                driver_user_id=ride.driver_id
+            )
             
-            self.active_chats[ride_id] = chat_data
+            await self._registry_call(self.registry.add, chat_data)
             
             # إرسال رسالة بدء الدردشة للطرفين
             start_message = (
@@ -70,68 +143,79 @@ class ChatManager:
             logger.error(f"خطأ في بدء الدردشة: {e}")
             return False
     
-    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """معالجة الرسائل في الدردشة الوسيطة"""
+    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE, chat_data: ChatSession):
+        """
+        معالجة الرسائل في الدردشة الوسيطة
+        
+        يُستدعى من موجه المحادثة بالدردشة النشطة التي وجدها للمرسل.
+        """
         try:
             user_id = update.effective_user.id
             
-            # البحث عن الدردشة النشطة
-            chat_data = self.get_active_chat(user_id)
-            if not chat_data:
-                return  # ليس في دردشة نشطة
-            
             # تحديد المستقبل
-            if user_id == chat_data['passenger_id']:
+            if user_id == chat_data.passenger_id:
                 sender_role = "الراكب"
-                recipient_id = chat_data['driver_id']
+                sender_user_id = chat_data.passenger_user_id
+                recipient_id = chat_data.driver_id
             else:
                 sender_role = "السائق"
-                recipient_id = chat_data['passenger_id']
+                sender_user_id = chat_data.driver_user_id
+                recipient_id = chat_data.passenger_id
             
-            message_content = update.message.text or update.message.caption
+            message = update.message
+            media = self._extract_media(message)
+            message_content = message.text or message.caption
             
-            if not message_content:
-                await update.message.reply_text("يجب إرسال نص في الرسالة.")
+            if not message_content and not media:
+                await update.message.reply_text("نوع الرسالة غير مدعوم في الدردشة.")
                 return
             
-            # حفظ الرسالة في قاعدة البيانات
-            chat_message = ChatMessage(
-                ride_id=chat_data['ride_id'],
-                sender_id=user_id,
-                content=message_content,
-                message_type="text",
-                extra_data={
-                    'has_media': bool(update.message.photo or update.message.video or update.message.document),
-                    'media_type': 'photo' if update.message.photo else 
-                                 'video' if update.message.video else 
-                                 'document' if update.message.document else None
-                }
+            # حفظ الرسالة عبر طابور الكتابة المؤجلة (بدون انتظار قاعدة البيانات)
+            chat_message = chat_message_writer.add(
+                ride_id=chat_data.ride_id,
+                sender_id=sender_user_id,
+                content=message_content or f"[{media['t']}]",
+                message_type=media['t'] if media else "text",
+                extra_data=media
             )
             
-            self.session.add(chat_message)
-            self.session.commit()
-            
             # زيادة عداد الرسائل
-            chat_data['message_count'] += 1
+            chat_data.message_count = await self._registry_call(
+                self.registry.increment_messages, chat_data.ride_id
+            )
             
             # إعادة توجيه الرسالة للمستقبل
             try:
-                forwarded_message = (
-                    f"💬 **رسالة من {sender_role}:**\n\n"
-                    f"{message_content}\n\n"
-                    f"───\n"
-                    f"📨 يمكنك الرد مباشرة على هذه الرسالة."
-                )
+                header = f"💬 **رسالة من {sender_role}:**"
                 
-                await context.bot.send_message(
-                    chat_id=recipient_id,
-                    text=forwarded_message
-                )
+                if media:
+                    # نسخ الوسائط عبر تيليجرام مباشرة (file_id) دون تنزيلها أو إعادة رفعها
+                    caption = None
+                    if media['t'] in CAPTIONED_MEDIA:
+                        caption = f"{header}\n\n{message_content}" if message_content else header
+                    await context.bot.copy_message(
+                        chat_id=recipient_id,
+                        from_chat_id=message.chat_id,
+                        message_id=message.message_id,
+                        caption=caption,
+                        rate_limit_args={"priority": Priority.CHAT}
+                    )
+                else:
+                    forwarded_message = (
+                        f"{header}\n\n"
+                        f"{message_content}\n\n"
+                        f"───\n"
+                        f"📨 يمكنك الرد مباشرة على هذه الرسالة."
+                    )
+                    
+                    await context.bot.send_message(
+                        chat_id=recipient_id,
+                        text=forwarded_message,
+                        rate_limit_args={"priority": Priority.CHAT}
+                    )
                 
-                # تحديث حالة الرسالة
-                chat_message.is_delivered = True
-                chat_message.delivered_at = datetime.utcnow()
-                self.session.commit()
+                # تحديث حالة الرسالة (يُدمج مع الإدراج إن لم يُكتب بعد)
+                chat_message_writer.mark_delivered(chat_message)
                 
                 # تأكيد الإرسال للمرسل
                 await update.message.reply_text("✅ تم إرسال رسالتك.")
@@ -143,10 +227,29 @@ class ChatManager:
         except Exception as e:
             logger.error(f"خطأ في معالجة رسالة الدردشة: {e}")
     
+    @staticmethod
+    def _extract_media(message) -> Optional[Dict]:
+        """
+        استخراج نوع الوسائط ومعرف الملف بصيغة مختصرة لسجل المحادثة
+        
+        Returns:
+            {'t': النوع, 'f': file_id} أو {'t': 'location', 'lat': ..., 'lon': ...} أو None للنص
+        """
+        if message.photo:
+            # أكبر مقاس هو الأخير
+            return {'t': 'photo', 'f': message.photo[-1].file_id}
+        for media_type in MEDIA_ATTRIBUTES:
+            attachment = getattr(message, media_type)
+            if attachment:
+                return {'t': media_type, 'f': attachment.file_id}
+        if message.location:
+            return {'t': 'location', 'lat': message.location.latitude, 'lon': message.location.longitude}
+        return None
+    
     async def end_chat(self, ride_id: int, context: ContextTypes.DEFAULT_TYPE):
         """إنهاء دردشة الرحلة"""
         try:
-            chat_data = self.active_chats.get(ride_id)
+            chat_data = await self._registry_call(self.registry.get, ride_id)
             if not chat_data:
                 return
             
@@ -154,22 +257,22 @@ class ChatManager:
             end_message = (
                 "🔒 **تم إغلاق قناة التواصل**\n\n"
                 "انتهت الرحلة وأغلقت قناة التواصل.\n"
-                f"عدد الرسائل المتبادلة: {chat_data['message_count']}\n\n"
+                f"عدد الرسائل المتبادلة: {chat_data.message_count}\n\n"
                 "شكراً لاستخدامكم خدمتنا! 🚕"
             )
             
             await context.bot.send_message(
-                chat_id=chat_data['passenger_id'],
+                chat_id=chat_data.passenger_id,
                 text=end_message
             )
             
             await context.bot.send_message(
-                chat_id=chat_data['driver_id'],
+                chat_id=chat_data.driver_id,
                 text=end_message
             )
             
             # حذف الدردشة من الذاكرة
-            del self.active_chats[ride_id]
+            await self._registry_call(self.registry.remove, ride_id)
             
             logger.info(f"أغلقت دردشة الرحلة {ride_id}")
             
@@ -182,7 +285,7 @@ class ChatManager:
             user_id = update.effective_user.id
             
             # التحقق من وجود دردشة نشطة
-            chat_data = self.get_active_chat(user_id)
+            chat_data = await self.get_active_chat(user_id)
             if not chat_data:
                 await update.message.reply_text(
                     "ليس لديك أي دردشة نشطة.\n"
@@ -191,9 +294,9 @@ class ChatManager:
                 return
             
             # عرض معلومات الدردشة
-            ride = self.session.query(Ride).get(chat_data['ride_id'])
+            ride = self.session.get(Ride, chat_data.ride_id, options=load_profile("ride_parties"))
             
-            if user_id == chat_data['passenger_id']:
+            if user_id == chat_data.passenger_id:
                 other_party = ride.driver.first_name if ride.driver else "السائق"
             else:
                 other_party = ride.passenger.first_name
@@ -202,11 +305,11 @@ class ChatManager:
                 f"💬 **الدردشة النشطة**\n\n"
                 f"مع: {other_party}\n"
                 f"رقم الرحلة: {ride.ride_code}\n"
-                f"الرسائل المتبادلة: {chat_data['message_count']}\n"
-                f"بدأت منذ: {self._format_duration(chat_data['started_at'])}\n\n"
+                f"الرسائل المتبادلة: {chat_data.message_count}\n"
+                f"بدأت منذ: {self._format_duration(chat_data.started_at)}\n\n"
                 f"يمكنك:\n"
                 f"• إرسال الرسائل مباشرة\n"
-                f"• إرسال الموقع: /send_location\n"
+                f"• إرسال الموقع: أرسل موقعك مباشرة\n"
                 f"• إنهاء الرحلة: /end_ride"
             )
             
@@ -230,6 +333,5 @@ class ChatManager:
     def get_handlers(self):
         """الحصول على معالجات الدردشة"""
         return [
-            CommandHandler("chat", self.chat_commands),
-            MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message)
+            CommandHandler("chat", self.chat_commands)
         ]
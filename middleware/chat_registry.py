@@ -0,0 +1,331 @@
+"""
+سجل الدردشات النشطة
+
+يفصل حالة الدردشات عن ChatManager خلف واجهة موحدة بعدة مخازن:
+- memory: قاموس داخل العملية (الافتراضي، الأسرع، لا ينجو من إعادة التشغيل)
+- sqlite: ملف SQLite مشترك بين العمليات على نفس الخادم
+- redis: مشترك بين عدة خوادم، ويُستبدل بمخزن SQLite محلي إن لم تتوفر مكتبة redis
+"""
+
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Optional, Set
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+class ChatSession:
+    """حالة دردشة رحلة واحدة"""
+    __slots__ = (
+        "ride_id", "passenger_id", "driver_id", "passenger_user_id", "driver_user_id",
+        "started_at", "message_count"
+    )
+
+    def __init__(self, ride_id: int, passenger_id: int, driver_id: int,
+                 passenger_user_id: int, driver_user_id: int,
+                 started_at: Optional[datetime] = None, message_count: int = 0):
+        self.ride_id = ride_id
+        # معرفات التيليجرام للطرفين
+        self.passenger_id = passenger_id
+        self.driver_id = driver_id
+        # معرفات جدول المستخدمين (لحفظ الرسائل)
+        self.passenger_user_id = passenger_user_id
+        self.driver_user_id = driver_user_id
+        self.started_at = started_at or datetime.utcnow()
+        self.message_count = message_count
+
+class ChatRegistry(ABC):
+    """الواجهة المشتركة لمخازن الدردشات النشطة"""
+
+    # العمليات تحجب الخيط (قرص أو شبكة)، فتُستدعى من حلقة الأحداث عبر asyncio.to_thread
+    blocking = True
+
+    @abstractmethod
+    def get(self, ride_id: int) -> Optional[ChatSession]:
+        ...
+
+    @abstractmethod
+    def get_by_user(self, telegram_id: int) -> Optional[ChatSession]:
+        ...
+
+    @abstractmethod
+    def add(self, chat: ChatSession):
+        ...
+
+    @abstractmethod
+    def remove(self, ride_id: int) -> Optional[ChatSession]:
+        ...
+
+    @abstractmethod
+    def increment_messages(self, ride_id: int) -> int:
+        """زيادة عداد الرسائل وإرجاع القيمة الجديدة"""
+
+    @abstractmethod
+    def ride_ids(self) -> Set[int]:
+        ...
+
+    def close(self):
+        pass
+
+class InMemoryChatRegistry(ChatRegistry):
+    """مخزن داخل العملية مع فهرس المستخدمين"""
+
+    blocking = False
+
+    def __init__(self):
+        self.chats: Dict[int, ChatSession] = {}  # ride_id -> chat
+        self._user_index: Dict[int, int] = {}  # telegram_id -> ride_id
+
+    def get(self, ride_id: int) -> Optional[ChatSession]:
+        return self.chats.get(ride_id)
+
+    def get_by_user(self, telegram_id: int) -> Optional[ChatSession]:
+        ride_id = self._user_index.get(telegram_id)
+        if ride_id is None:
+            return None
+        return self.chats.get(ride_id)
+
+    def add(self, chat: ChatSession):
+        if chat.ride_id in self.chats:
+            self.remove(chat.ride_id)
+        self.chats[chat.ride_id] = chat
+        self._user_index[chat.passenger_id] = chat.ride_id
+        self._user_index[chat.driver_id] = chat.ride_id
+
+    def remove(self, ride_id: int) -> Optional[ChatSession]:
+        chat = self.chats.pop(ride_id, None)
+        if chat is None:
+            return None
+        for telegram_id in (chat.passenger_id, chat.driver_id):
+            # لا نحذف الفهرس إن كان المستخدم قد انتقل لدردشة أحدث
+            if self._user_index.get(telegram_id) == ride_id:
+                del self._user_index[telegram_id]
+        return chat
+
+    def increment_messages(self, ride_id: int) -> int:
+        chat = self.chats.get(ride_id)
+        if chat is None:
+            return 0
+        chat.message_count += 1
+        return chat.message_count
+
+    def ride_ids(self) -> Set[int]:
+        return set(self.chats)
+
+class SQLiteChatRegistry(ChatRegistry):
+    """مخزن SQLite مشترك بين عمليات البوت على نفس الخادم"""
+
+    _COLUMNS = "c.ride_id, c.passenger_id, c.driver_id, c.passenger_user_id, c.driver_user_id, c.started_at, c.message_count"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS active_chats (
+                ride_id INTEGER PRIMARY KEY,
+                passenger_id INTEGER NOT NULL,
+                driver_id INTEGER NOT NULL,
+                passenger_user_id INTEGER NOT NULL,
+                driver_user_id INTEGER NOT NULL,
+                started_at TEXT NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS active_chat_users (
+                telegram_id INTEGER PRIMARY KEY,
+                ride_id INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_active_chat_users_ride_id ON active_chat_users (ride_id);
+        """)
+
+    @staticmethod
+    def _to_chat(row) -> Optional[ChatSession]:
+        if row is None:
+            return None
+        return ChatSession(
+            ride_id=row[0],
+            passenger_id=row[1],
+            driver_id=row[2],
+            passenger_user_id=row[3],
+            driver_user_id=row[4],
+            started_at=datetime.fromisoformat(row[5]),
+            message_count=row[6]
+        )
+
+    def get(self, ride_id: int) -> Optional[ChatSession]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {self._COLUMNS} FROM active_chats c WHERE c.ride_id = ?", (ride_id,)
+            ).fetchone()
+        return self._to_chat(row)
+
+    def get_by_user(self, telegram_id: int) -> Optional[ChatSession]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {self._COLUMNS} FROM active_chat_users u "
+                f"JOIN active_chats c ON c.ride_id = u.ride_id WHERE u.telegram_id = ?",
+                (telegram_id,)
+            ).fetchone()
+        return self._to_chat(row)
+
+    def add(self, chat: ChatSession):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO active_chats VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (chat.ride_id, chat.passenger_id, chat.driver_id, chat.passenger_user_id,
+                     chat.driver_user_id, chat.started_at.isoformat(), chat.message_count)
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO active_chat_users VALUES (?, ?)",
+                    ((chat.passenger_id, chat.ride_id), (chat.driver_id, chat.ride_id))
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def remove(self, ride_id: int) -> Optional[ChatSession]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    f"SELECT {self._COLUMNS} FROM active_chats c WHERE c.ride_id = ?", (ride_id,)
+                ).fetchone()
+                self._conn.execute("DELETE FROM active_chat_users WHERE ride_id = ?", (ride_id,))
+                self._conn.execute("DELETE FROM active_chats WHERE ride_id = ?", (ride_id,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self._to_chat(row)
+
+    def increment_messages(self, ride_id: int) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE active_chats SET message_count = message_count + 1 "
+                "WHERE ride_id = ? RETURNING message_count",
+                (ride_id,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def ride_ids(self) -> Set[int]:
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT ride_id FROM active_chats")}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class RedisChatRegistry(ChatRegistry):
+    """مخزن Redis مشترك بين عدة خوادم"""
+
+    def __init__(self, client, prefix: str = "chat"):
+        self.client = client
+        self.prefix = prefix
+
+    def _chat_key(self, ride_id: int) -> str:
+        return f"{self.prefix}:ride:{ride_id}"
+
+    def _user_key(self, telegram_id: int) -> str:
+        return f"{self.prefix}:user:{telegram_id}"
+
+    @property
+    def _rides_key(self) -> str:
+        return f"{self.prefix}:rides"
+
+    @staticmethod
+    def _to_chat(data: Dict) -> Optional[ChatSession]:
+        if not data:
+            return None
+        data = {
+            (key.decode() if isinstance(key, bytes) else key): (value.decode() if isinstance(value, bytes) else value)
+            for key, value in data.items()
+        }
+        return ChatSession(
+            ride_id=int(data["ride_id"]),
+            passenger_id=int(data["passenger_id"]),
+            driver_id=int(data["driver_id"]),
+            passenger_user_id=int(data["passenger_user_id"]),
+            driver_user_id=int(data["driver_user_id"]),
+            started_at=datetime.fromisoformat(data["started_at"]),
+            message_count=int(data["message_count"])
+        )
+
+    def get(self, ride_id: int) -> Optional[ChatSession]:
+        return self._to_chat(self.client.hgetall(self._chat_key(ride_id)))
+
+    def get_by_user(self, telegram_id: int) -> Optional[ChatSession]:
+        ride_id = self.client.get(self._user_key(telegram_id))
+        if ride_id is None:
+            return None
+        return self.get(int(ride_id))
+
+    def add(self, chat: ChatSession):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hset(self._chat_key(chat.ride_id), mapping={
+            "ride_id": chat.ride_id,
+            "passenger_id": chat.passenger_id,
+            "driver_id": chat.driver_id,
+            "passenger_user_id": chat.passenger_user_id,
+            "driver_user_id": chat.driver_user_id,
+            "started_at": chat.started_at.isoformat(),
+            "message_count": chat.message_count
+        })
+        pipe.set(self._user_key(chat.passenger_id), chat.ride_id)
+        pipe.set(self._user_key(chat.driver_id), chat.ride_id)
+        pipe.sadd(self._rides_key, chat.ride_id)
+        pipe.execute()
+
+    def remove(self, ride_id: int) -> Optional[ChatSession]:
+        chat = self.get(ride_id)
+        if chat is None:
+            return None
+        pipe = self.client.pipeline(transaction=True)
+        for telegram_id in (chat.passenger_id, chat.driver_id):
+            # لا نحذف الفهرس إن كان المستخدم قد انتقل لدردشة أحدث
+            current = self.client.get(self._user_key(telegram_id))
+            if current is not None and int(current) == ride_id:
+                pipe.delete(self._user_key(telegram_id))
+        pipe.delete(self._chat_key(ride_id))
+        pipe.srem(self._rides_key, ride_id)
+        pipe.execute()
+        return chat
+
+    def increment_messages(self, ride_id: int) -> int:
+        if not self.client.exists(self._chat_key(ride_id)):
+            return 0
+        return int(self.client.hincrby(self._chat_key(ride_id), "message_count", 1))
+
+    def ride_ids(self) -> Set[int]:
+        return {int(ride_id) for ride_id in self.client.smembers(self._rides_key)}
+
+    def close(self):
+        self.client.close()
+
+def create_chat_registry(backend: Optional[str] = None) -> ChatRegistry:
+    """إنشاء مخزن الدردشات حسب الإعدادات"""
+    backend = (backend or config.chat.CHAT_REGISTRY_BACKEND).lower()
+
+    if backend == "sqlite":
+        return SQLiteChatRegistry(config.chat.CHAT_REGISTRY_PATH)
+
+    if backend == "redis":
+        try:
+            import redis
+        except ImportError:
+            # بديل محلي عند عدم توفر redis (التطوير أو خادم واحد)
+            logger.warning("مكتبة redis غير مثبتة، سيتم استخدام مخزن SQLite المحلي بدلاً منها")
+            return SQLiteChatRegistry(config.chat.CHAT_REGISTRY_PATH)
+        return RedisChatRegistry(redis.Redis.from_url(config.chat.REDIS_URL))
+
+    if backend != "memory":
+        logger.warning(f"مخزن دردشات غير معروف: {backend}، سيتم استخدام الذاكرة")
+    return InMemoryChatRegistry()
@@ -0,0 +1,150 @@
+"""
+توجيه الرسائل حسب حالة المحادثة لكل مستخدم
+
+كل الرسائل غير الأوامر (نص، موقع، وسائط) تمر بمعالج واحد يقرأ حالة المستخدم
+مرة واحدة ويوجه الرسالة إلى معالج واحد فقط:
+
+    بانتظار موقع المستخدم (/set_location)   + موقع  -> تحديث الموقع
+    بانتظار الوجهة (/request_ride)          + موقع/نص -> معالجة الوجهة
+    خامل وفي دردشة رحلة                      + أي رسالة -> الدردشة الوسيطة
+    خامل                                     + موقع  -> تحديث الموقع
+    خامل                                     + نص    -> رسالة المساعدة
+    أي حالة أخرى                              + أي رسالة -> رد يوضح المطلوب
+
+الحالات تُحفظ في الذاكرة للمستخدمين غير الخاملين فقط، وتنتهي بعد مدة حتى لا
+تخطف حالة قديمة رسائل المستخدم. لا تُحفظ مع user_data عمداً: كل حالة خطوة
+قصيرة تنتظر رسالة واحدة، وبعد إعادة التشغيل (أو نقل المستخدم لعامل آخر) يعود
+المستخدم خاملاً ويعيد الأمر. الدردشة تُقرأ من سجل الدردشات لأنه المصدر
+المشترك بين العمليات.
+"""
+
+import logging
+import time
+from enum import IntEnum
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from telegram import Message, Update
+from telegram.ext import ContextTypes, MessageHandler, filters
+
+from config import config
+from database.instrumentation import sql_profiler
+from middleware.chat_manager import CHAT_MEDIA_FILTER
+
+logger = logging.getLogger(__name__)
+
+class ConversationState(IntEnum):
+    """حالة المستخدم في التدفقات متعددة الخطوات"""
+    IDLE = 0
+    AWAITING_LOCATION = 1
+    AWAITING_DESTINATION = 2
+
+class MessageKind(IntEnum):
+    TEXT = 0
+    LOCATION = 1
+    MEDIA = 2
+
+def message_kind(message: Message) -> MessageKind:
+    if message.location:
+        return MessageKind.LOCATION
+    if message.text:
+        return MessageKind.TEXT
+    return MessageKind.MEDIA
+
+class ConversationStore:
+    """حالات المستخدمين غير الخاملين مع مهلة انتهاء"""
+
+    def __init__(self, ttl: float, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        # telegram_id -> (الحالة، وقت الانتهاء)
+        self._states: Dict[int, Tuple[ConversationState, float]] = {}
+
+    def get(self, user_id: int) -> ConversationState:
+        entry = self._states.get(user_id)
+        if entry is None:
+            return ConversationState.IDLE
+        state, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._states[user_id]
+            return ConversationState.IDLE
+        return state
+
+    def set(self, user_id: int, state: ConversationState):
+        if state == ConversationState.IDLE:
+            self._states.pop(user_id, None)
+            return
+        if len(self._states) >= self.max_size:
+            self._prune()
+        self._states[user_id] = (state, time.monotonic() + self.ttl)
+
+    def clear(self, user_id: int):
+        self._states.pop(user_id, None)
+
+    def _prune(self):
+        now = time.monotonic()
+        for user_id in [user_id for user_id, (_, expires_at) in self._states.items() if expires_at < now]:
+            del self._states[user_id]
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+Callback = Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[None]]
+
+class ConversationRouter:
+    """
+    المعالج الوحيد للرسائل غير الأوامر
+
+    Args:
+        routes: (الحالة، نوع الرسالة) -> المعالج
+        chat_lookup: دالة غير متزامنة تعيد الدردشة النشطة للمستخدم أو None
+        chat_relay: معالج الدردشة الوسيطة، يُستدعى بـ (update, context, الدردشة)
+        fallback_replies: رد لكل حالة عند رسالة لا معالج لها فيها (مثل نص
+            بانتظار الموقع)، فلا تُتجاهل الرسالة بصمت
+    """
+
+    # الرسائل الجديدة فقط: الرسائل المعدلة (ومنها تحديثات الموقع المباشر) لا تحمل update.message
+    MESSAGE_FILTER = filters.UpdateType.MESSAGE & (
+        (filters.TEXT & ~filters.COMMAND) | filters.LOCATION | CHAT_MEDIA_FILTER
+    )
+
+    def __init__(
+        self,
+        store: ConversationStore,
+        routes: Dict[Tuple[ConversationState, MessageKind], Callback],
+        chat_lookup: Callable[[int], Awaitable[Optional[object]]],
+        chat_relay: Callable[..., Awaitable[None]],
+        fallback_replies: Optional[Dict[ConversationState, str]] = None
+    ):
+        self.store = store
+        self.fallback_replies = fallback_replies or {}
+        self.chat_lookup = chat_lookup
+        self.routes = {
+            key: sql_profiler.wrap(callback, name=f"message:{key[0].name.lower()}:{key[1].name.lower()}")
+            for key, callback in routes.items()
+        }
+        self.chat_relay = sql_profiler.wrap(chat_relay, name="message:chat")
+
+    async def handle(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        state = self.store.get(user_id)
+
+        if state == ConversationState.IDLE:
+            chat = await self.chat_lookup(user_id)
+            if chat is not None:
+                await self.chat_relay(update, context, chat)
+                return
+
+        callback = self.routes.get((state, message_kind(update.message)))
+        if callback is not None:
+            await callback(update, context)
+            return
+
+        reply = self.fallback_replies.get(state)
+        if reply is not None:
+            await update.message.reply_text(reply)
+
+    def get_handler(self) -> MessageHandler:
+        return MessageHandler(self.MESSAGE_FILTER, self.handle)
+
+# إنشاء الكائن العام
+conversation_store = ConversationStore(ttl=config.bot.CONVERSATION_TIMEOUT)
@@ -0,0 +1,390 @@
+"""
+حفظ context.user_data بين عمليات إعادة التشغيل
+
+بديل لـ PicklePersistence التي تعيد كتابة الملف كاملاً عند كل دورة حفظ:
+- كل مستخدم في صف مستقل (SQLite) أو مفتاح مستقل (Redis)، بصيغة pickle
+  مضغوطة عند الحاجة.
+- PTB يعلّم كل مستخدم وصله تحديث كمتغير، لذلك تُقارن بصمة البيانات بآخر ما
+  كُتب ولا يُكتب إلا ما تغير فعلاً، في معاملة واحدة لكل دورة.
+- البيانات الفارغة لا تُخزن، وبيانات المستخدم الخامل أكثر من PERSISTENCE_TTL
+  تُحذف من الذاكرة ومن المخزن.
+"""
+
+import asyncio
+import hashlib
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Tuple
+
+from telegram.ext import Application, BasePersistence, PersistenceInput
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# بادئة البايت الأول: pickle خام أو مضغوط
+_RAW, _COMPRESSED = b"p", b"z"
+# لا يُضغط ما دون هذا الحجم (الضغط لا يوفر شيئاً في البيانات الصغيرة)
+COMPRESS_THRESHOLD = 512
+
+def encode(data: Dict) -> bytes:
+    blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(blob) >= COMPRESS_THRESHOLD:
+        return _COMPRESSED + zlib.compress(blob, 1)
+    return _RAW + blob
+
+def decode(blob: bytes) -> Dict:
+    if blob[:1] == _COMPRESSED:
+        return pickle.loads(zlib.decompress(blob[1:]))
+    return pickle.loads(blob[1:])
+
+def _digest(blob: bytes) -> bytes:
+    return hashlib.blake2b(blob, digest_size=8).digest()
+
+class UserDataStore(ABC):
+    """الواجهة المشتركة لمخازن بيانات المستخدمين"""
+
+    @abstractmethod
+    def load(self, cutoff: float) -> Dict[int, bytes]:
+        """كل البيانات المحدثة بعد cutoff"""
+
+    @abstractmethod
+    def write(self, upserts: List[Tuple[int, bytes]], deletes: List[int]):
+        """كتابة دفعة في معاملة واحدة"""
+
+    @abstractmethod
+    def purge(self, cutoff: float) -> int:
+        """حذف البيانات الأقدم من cutoff"""
+
+    def close(self):
+        pass
+
+class SQLiteUserDataStore(UserDataStore):
+    """مخزن SQLite (صف لكل مستخدم)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS user_data (
+                user_id INTEGER PRIMARY KEY,
+                data BLOB NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_user_data_updated_at ON user_data (updated_at);
+        """)
+
+    def load(self, cutoff: float) -> Dict[int, bytes]:
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT user_id, data FROM user_data WHERE updated_at >= ?", (cutoff,)
+            ))
+
+    def write(self, upserts: List[Tuple[int, bytes]], deletes: List[int]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if upserts:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO user_data VALUES (?, ?, ?)",
+                        ((user_id, blob, now) for user_id, blob in upserts)
+                    )
+                if deletes:
+                    self._conn.executemany(
+                        "DELETE FROM user_data WHERE user_id = ?", ((user_id,) for user_id in deletes)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def purge(self, cutoff: float) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM user_data WHERE updated_at < ?", (cutoff,)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class RedisUserDataStore(UserDataStore):
+    """مخزن Redis (مفتاح لكل مستخدم، ومدة الصلاحية يتولاها Redis)"""
+
+    def __init__(self, client, ttl: float, prefix: str = "user_data"):
+        self.client = client
+        self.ttl = int(ttl)
+        self.prefix = prefix
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}:{user_id}"
+
+    def load(self, cutoff: float) -> Dict[int, bytes]:
+        keys = list(self.client.scan_iter(match=f"{self.prefix}:*", count=1000))
+        data = {}
+        for start in range(0, len(keys), 1000):
+            chunk = keys[start:start + 1000]
+            for key, blob in zip(chunk, self.client.mget(chunk)):
+                if blob is not None:
+                    key = key.decode() if isinstance(key, bytes) else key
+                    data[int(key.rsplit(":", 1)[1])] = blob
+        return data
+
+    def write(self, upserts: List[Tuple[int, bytes]], deletes: List[int]):
+        pipe = self.client.pipeline(transaction=True)
+        for user_id, blob in upserts:
+            pipe.set(self._key(user_id), blob, ex=self.ttl)
+        if deletes:
+            pipe.delete(*(self._key(user_id) for user_id in deletes))
+        pipe.execute()
+
+    def purge(self, cutoff: float) -> int:
+        return 0
+
+    def close(self):
+        self.client.close()
+
+class UserDataPersistence(BasePersistence):
+    """
+    حفظ user_data فقط (البوت لا يستخدم chat_data ولا bot_data)
+
+    Args:
+        store: مخزن البيانات
+        update_interval: الفاصل بين دورات الحفظ في PTB (بالثواني)
+        ttl: مدة خمول المستخدم قبل حذف بياناته (بالثواني)
+        owns: في وضع العمليات المتعددة، تحدد المستخدمين الذين يُحمّلهم هذا العامل
+    """
+
+    def __init__(
+        self,
+        store: UserDataStore,
+        update_interval: float,
+        ttl: float,
+        owns: Optional[Callable[[int], bool]] = None
+    ):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.store = store
+        self.ttl = ttl
+        self.owns = owns
+        # آخر نشاط لكل مستخدم، وبصمة آخر بيانات مكتوبة (للمستخدمين ذوي البيانات فقط)
+        self._seen: Dict[int, float] = {}
+        self._digests: Dict[int, bytes] = {}
+        # user_id -> البيانات المرمزة، أو None للحذف
+        self._pending: Dict[int, Optional[bytes]] = {}
+        # مستخدمون انتقلوا إلى هذا العامل: (البيانات، البصمة) حتى أول تحديث لهم
+        self._adopted: Dict[int, Tuple[Dict, bytes]] = {}
+        self._write_task: Optional[asyncio.Task] = None
+
+        # المقاييس
+        self.skipped = 0
+        self.written = 0
+        self.evicted = 0
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        # في المخزن تُحسب الصلاحية من آخر تغيير للبيانات، وفي الذاكرة من آخر نشاط
+        cutoff = time.time() - self.ttl
+        purged = await asyncio.to_thread(self.store.purge, cutoff)
+        rows = await asyncio.to_thread(self.store.load, cutoff)
+
+        user_data = {}
+        now = time.monotonic()
+        for user_id, blob in rows.items():
+            if self.owns is not None and not self.owns(user_id):
+                continue
+            try:
+                user_data[user_id] = decode(blob)
+            except Exception as e:
+                logger.error(f"خطأ في قراءة بيانات المستخدم {user_id}: {e}")
+                self._pending[user_id] = None
+                continue
+            self._digests[user_id] = _digest(blob)
+            self._seen[user_id] = now
+        if self._pending:
+            self._schedule_write()
+
+        logger.info(f"تم تحميل بيانات {len(user_data)} مستخدم (حُذف {purged} منتهي الصلاحية)")
+        return user_data
+
+    async def update_user_data(self, user_id: int, data: Dict) -> None:
+        self._seen[user_id] = time.monotonic()
+        if not data:
+            if user_id in self._digests:
+                del self._digests[user_id]
+                self._queue(user_id, None)
+            return
+
+        blob = encode(data)
+        digest = _digest(blob)
+        if self._digests.get(user_id) == digest:
+            self.skipped += 1
+            return
+        self._digests[user_id] = digest
+        self._queue(user_id, blob)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._seen.pop(user_id, None)
+        self._adopted.pop(user_id, None)
+        if self._digests.pop(user_id, None) is not None:
+            self._queue(user_id, None)
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        # كل مستخدم تعالجه عملية واحدة، فلا تغيير خارجي يُعاد تحميله إلا
+        # بيانات المستخدمين المنقولين من عامل مستبعد عند أول تحديث لهم هنا
+        adopted = self._adopted.pop(user_id, None)
+        if adopted is None or user_data:
+            return
+        data, digest = adopted
+        user_data.update(data)
+        self._digests[user_id] = digest
+        self._seen[user_id] = time.monotonic()
+
+    async def adopt_users(self) -> int:
+        """
+        تحميل بيانات المستخدمين الذين صار هذا العامل مسؤولاً عنهم
+
+        يُستدعى بعد تغير العمال النشطين (owns تعكس العضوية الجديدة). تُدمج
+        البيانات في user_data عند أول تحديث للمستخدم عبر refresh_user_data.
+        """
+        if self.owns is None:
+            return 0
+        cutoff = time.time() - self.ttl
+        rows = await asyncio.to_thread(self.store.load, cutoff)
+        for user_id, blob in rows.items():
+            if user_id in self._digests or user_id in self._adopted or not self.owns(user_id):
+                continue
+            try:
+                self._adopted[user_id] = (decode(blob), _digest(blob))
+            except Exception as e:
+                logger.error(f"خطأ في قراءة بيانات المستخدم {user_id}: {e}")
+        logger.info(f"بانتظار دمج بيانات {len(self._adopted)} مستخدم منقول")
+        return len(self._adopted)
+
+    def _queue(self, user_id: int, blob: Optional[bytes]):
+        self._pending[user_id] = blob
+        self._schedule_write()
+
+    def _schedule_write(self):
+        # PTB يستدعي update_user_data لكل المستخدمين معاً عبر gather، فمهمة واحدة
+        # تُنشأ بعد أولها وتكتب الدورة كلها في معاملة واحدة
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            upserts = [(user_id, blob) for user_id, blob in batch.items() if blob is not None]
+            deletes = [user_id for user_id, blob in batch.items() if blob is None]
+            try:
+                await asyncio.to_thread(self.store.write, upserts, deletes)
+                self.written += len(batch)
+            except Exception as e:
+                logger.error(f"خطأ في حفظ بيانات المستخدمين: {e}")
+                # إعادة الدفعة دون الكتابة فوق تغييرات أحدث وصلت أثناء المحاولة
+                for user_id, blob in batch.items():
+                    self._pending.setdefault(user_id, blob)
+                return
+
+    def evict(self, application: Application) -> int:
+        """حذف بيانات المستخدمين الخاملين من الذاكرة (ومن المخزن عبر drop_user_data)"""
+        cutoff = time.monotonic() - self.ttl
+        idle = [user_id for user_id, seen in self._seen.items() if seen < cutoff]
+        for user_id in idle:
+            del self._seen[user_id]
+            application.drop_user_data(user_id)
+        self.evicted += len(idle)
+        return len(idle)
+
+    async def flush(self) -> None:
+        """آخر استدعاء عند إيقاف التطبيق: كتابة المتبقي وإغلاق المخزن"""
+        if self._write_task is not None:
+            await self._write_task
+        await self._write_pending()
+        if self._pending:
+            logger.error(f"تعذر حفظ بيانات {len(self._pending)} مستخدم عند الإيقاف")
+        self.store.close()
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "tracked_users": len(self._seen),
+            "stored_users": len(self._digests),
+            "pending": len(self._pending),
+            "adopted_waiting": len(self._adopted),
+            "written": self.written,
+            "skipped_unchanged": self.skipped,
+            "evicted": self.evicted
+        }
+
+    # البيانات غير المحفوظة (store_data يستبعدها فلا يستدعيها PTB للتحديث)
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: Dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        pass
+
+def create_persistence(
+    backend: Optional[str] = None,
+    owns: Optional[Callable[[int], bool]] = None
+) -> Optional[UserDataPersistence]:
+    """إنشاء الحفظ حسب الإعدادات (None إن كان معطلاً)"""
+    settings = config.persistence
+    backend = (backend or settings.PERSISTENCE_BACKEND).lower()
+
+    if backend == "none":
+        return None
+
+    if backend == "redis":
+        try:
+            import redis
+            store = RedisUserDataStore(redis.Redis.from_url(config.chat.REDIS_URL), ttl=settings.PERSISTENCE_TTL)
+        except ImportError:
+            # بديل محلي عند عدم توفر redis (التطوير أو خادم واحد)
+            logger.warning("مكتبة redis غير مثبتة، سيتم استخدام مخزن SQLite المحلي بدلاً منها")
+            store = SQLiteUserDataStore(settings.PERSISTENCE_PATH)
+    else:
+        if backend != "sqlite":
+            logger.warning(f"مخزن حفظ غير معروف: {backend}، سيتم استخدام sqlite")
+        store = SQLiteUserDataStore(settings.PERSISTENCE_PATH)
+
+    return UserDataPersistence(
+        store,
+        update_interval=settings.PERSISTENCE_INTERVAL,
+        ttl=settings.PERSISTENCE_TTL,
+        owns=owns
+    )
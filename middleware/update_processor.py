@@ -0,0 +1,241 @@
+"""
+معالجة التحديثات بالتوازي مع الحفاظ على الترتيب لكل مستخدم ولكل رحلة
+
+تُعالج تحديثات المستخدمين المختلفين في نفس الوقت، بينما تُسلسل تحديثات نفس
+المستخدم (فتبقى context.user_data متسقة) وتحديثات نفس الرحلة (مثل قبول سائقين
+لنفس الرحلة معاً). لكل تحديث جلسة قاعدة بيانات مستقلة.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from database.database import db_manager
+from middleware.callback_router import callback_router
+from utils.startup import startup_profiler
+
+logger = logging.getLogger(__name__)
+
+# الأوامر التي معاملها الأول رقم رحلة
+RIDE_COMMANDS = ("/accept",)
+
+# أقصى عدد تحديثات منتهية تنتظر رقماً لم يصل قبل اعتباره غير موجود
+MAX_UPDATE_ID_GAP = 10000
+
+class KeyedLocks:
+    """أقفال حسب المفتاح تُحذف تلقائياً عند عدم استخدامها"""
+
+    def __init__(self):
+        self._locks: Dict[Any, Tuple[asyncio.Lock, int]] = {}
+
+    async def acquire(self, key):
+        lock, users = self._locks.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[key] = (lock, users + 1)
+        try:
+            await lock.acquire()
+        except BaseException:
+            self._release_ref(key)
+            raise
+
+    def release(self, key):
+        lock, _ = self._locks[key]
+        lock.release()
+        self._release_ref(key)
+
+    def _release_ref(self, key):
+        lock, users = self._locks[key]
+        if users <= 1:
+            del self._locks[key]
+        else:
+            self._locks[key] = (lock, users - 1)
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+def update_keys(update: object) -> List[Tuple[str, int]]:
+    """مفاتيح التسلسل للتحديث: المستخدم، والرحلة إن أمكن استخراجها"""
+    if not isinstance(update, Update):
+        return []
+
+    keys = []
+    if update.effective_user:
+        keys.append(("user", update.effective_user.id))
+
+    ride_id = None
+    if update.callback_query and update.callback_query.data:
+        ride_id = callback_router.ride_id(update.callback_query.data)
+    elif update.message and update.message.text:
+        parts = update.message.text.split()
+        if len(parts) > 1 and parts[0].split("@")[0] in RIDE_COMMANDS and parts[1].isdigit():
+            ride_id = int(parts[1])
+    if ride_id is not None:
+        keys.append(("ride", ride_id))
+
+    # ترتيب ثابت لتجنب الجمود عند أخذ أكثر من قفل
+    keys.sort()
+    return keys
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """
+    معالج تحديثات متوازٍ مع أقفال حسب المستخدم والرحلة
+
+    رقم آخر تحديث المحفوظ عند الإيقاف حد أدنى متصل: أعلى رقم كل ما قبله مما
+    وصل لهذه العملية انتهت معالجته بنجاح. التحديث الملغى أو الفاشل أو الذي
+    بقي في الطابور يوقف الحد قبله، فلا يُتجاهل عند إعادة تسليمه.
+
+    Args:
+        max_concurrent_updates: أقصى عدد تحديثات تُنفذ معالجاتها في نفس الوقت
+        max_pending_updates: أقصى عدد تحديثات قيد الانتظار أو التنفيذ (حد PTB)
+        contiguous_ids: أرقام التحديثات متتالية (عملية واحدة ترى كل التحديثات)،
+            فلا يتجاوز الحد رقماً لم يصل بعد. عامل التقسيم يرى جزءاً منها فقط
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: int, contiguous_ids: bool = True):
+        # حد PTB يُطبق قبل أقفال المفاتيح، لذلك نجعله حداً للانتظار الكلي
+        # ونطبق حد التنفيذ الفعلي بعد أخذ الأقفال، فلا يحجز مستخدم كثير
+        # التحديثات كل الأماكن وهو ينتظر قفله
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self.max_running_updates = max_concurrent_updates
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks = KeyedLocks()
+        self._tasks = set()
+        self._shutting_down = False
+
+        # ما قبل skip_through يُتجاهل إن أُعيد تسليمه (يُحمّل من الإيقاف السابق)
+        self.skip_through: Optional[int] = None
+        self.contiguous_ids = contiguous_ids
+        # الحد الأدنى المتصل، والتحديثات التي وصلت ولم تنتهِ بنجاح، والمنتهية
+        # فوق الحد بانتظار ما قبلها
+        self._watermark: Optional[int] = None
+        self._unfinished = set()
+        self._done_above = set()
+        # تحديثات أكد تيليجرام استلامها ولم تُعالج (أُلغيت أو بقيت في الطابور
+        # عند انتهاء مهلة الإيقاف)، تُحفظ لتُعاد إلى الطابور عند التشغيل التالي
+        self.unprocessed: List[Update] = []
+
+        # المقاييس
+        self.in_flight = 0
+        self.processed = 0
+        self.duplicates = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def pending(self) -> int:
+        """عدد التحديثات المنتظرة لأقفالها أو قيد التنفيذ"""
+        return len(self._tasks)
+
+    @property
+    def last_update_id(self) -> Optional[int]:
+        """أعلى رقم تحديث كل ما قبله مما وصل انتهت معالجته بنجاح"""
+        if self._watermark is None:
+            return None
+        if not self.contiguous_ids:
+            self._skip_gaps()
+        if self._unfinished:
+            # تحديث وصل متأخراً برقم أقل من بداية الحد ولم ينتهِ
+            return min(self._watermark, min(self._unfinished) - 1)
+        return self._watermark
+
+    def mark_unprocessed(self, update: object):
+        """تسجيل تحديث لن يُعالج (بقي في الطابور عند انتهاء مهلة الإيقاف)"""
+        if isinstance(update, Update):
+            self._received(update.update_id)
+            self.unprocessed.append(update)
+
+    def _received(self, update_id: int):
+        if self._watermark is None:
+            # ما قبل أول تحديث يصل إما عولج في التشغيل السابق أو لا يخص العملية
+            self._watermark = update_id - 1
+            if self.skip_through is not None:
+                self._watermark = max(self._watermark, self.skip_through)
+        self._unfinished.add(update_id)
+
+    def _finished(self, update_id: int):
+        self._unfinished.discard(update_id)
+        if update_id <= self._watermark:
+            return
+        self._done_above.add(update_id)
+        watermark = self._watermark
+        while watermark + 1 in self._done_above:
+            watermark += 1
+            self._done_above.remove(watermark)
+        self._watermark = watermark
+        if len(self._done_above) > (MAX_UPDATE_ID_GAP if self.contiguous_ids else 1024):
+            self._skip_gaps()
+
+    def _skip_gaps(self):
+        """تجاوز الأرقام التي لم تصل (وليس تحديثاً وصل ولم ينتهِ)"""
+        floor = min(self._unfinished, default=None)
+        below = [update_id for update_id in self._done_above if floor is None or update_id < floor]
+        if below:
+            self._watermark = max(below)
+            self._done_above.difference_update(below)
+
+    def cancel_in_flight(self) -> int:
+        """إلغاء كل التحديثات الجارية (عند انتهاء مهلة الإيقاف)"""
+        self._shutting_down = True
+        for task in self._tasks:
+            task.cancel()
+        return len(self._tasks)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]):
+        update_id = update.update_id if isinstance(update, Update) else None
+        if update_id is not None and self.skip_through is not None and update_id <= self.skip_through:
+            # عولج قبل آخر إيقاف وأعاد تيليجرام تسليمه
+            self.duplicates += 1
+            if hasattr(coroutine, "close"):
+                coroutine.close()
+            return
+
+        if update_id is not None:
+            self._received(update_id)
+        if not self.processed:
+            startup_profiler.first_update()
+        keys = update_keys(update)
+        acquired = []
+        started = False
+        succeeded = False
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            for key in keys:
+                await self._locks.acquire(key)
+                acquired.append(key)
+
+            async with self._running:
+                self.in_flight += 1
+                started = True
+                try:
+                    with db_manager.update_scope():
+                        await coroutine
+                    succeeded = True
+                finally:
+                    self.in_flight -= 1
+                    self.processed += 1
+        except asyncio.CancelledError:
+            if not self._shutting_down:
+                raise
+            # ألغاه الإيقاف: الخروج بشكل عادي وإلا لن يُعلّم PTB التحديث
+            # كمنتهٍ في الطابور وينتظره application.stop إلى الأبد
+            logger.warning(f"تم إلغاء معالجة التحديث {update_id} عند الإيقاف")
+            if update_id is not None:
+                self.unprocessed.append(update)
+        finally:
+            self._tasks.discard(task)
+            if succeeded and update_id is not None:
+                self._finished(update_id)
+            for key in reversed(acquired):
+                self._locks.release(key)
+            if not started and hasattr(coroutine, "close"):
+                # أُلغي قبل التنفيذ: إغلاق الكوروتين لتجنب تحذير عدم انتظاره
+                coroutine.close()
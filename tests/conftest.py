@@ -0,0 +1,17 @@
+"""إعداد بيئة الاختبارات: قاعدة SQLite مؤقتة قبل تحميل الإعدادات"""
+
+import os
+import sys
+import tempfile
+
+_tmp_dir = tempfile.mkdtemp(prefix="delivery-bot-tests-")
+os.environ.setdefault("BOT_TOKEN", "123:test")
+os.environ["DB_TYPE"] = "sqlite"
+os.environ["DB_NAME"] = os.path.join(_tmp_dir, "test")
+os.environ["DB_REPLICA_URL"] = ""
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.database import db_manager  # noqa: E402
+
+db_manager.init_database()
@@ -0,0 +1,145 @@
+"""اختبارات صندوق الصادر مع Bot API وهمي"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import Forbidden, NetworkError
+
+from database.database import db_manager
+from database.models import OutboxMessage
+from utils.outbox import OutboxDrainer, enqueue_notification
+
+class FakeBot:
+    """
+    Bot API وهمي يسجل الرسائل المرسلة
+
+    Args:
+        failures: عدد مرات فشل الشبكة لكل محادثة قبل النجاح
+        blocked: محادثات حظرت البوت (Forbidden)
+    """
+
+    def __init__(self, failures=None, blocked=()):
+        self.failures = dict(failures or {})
+        self.blocked = set(blocked)
+        self.sent = []
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        await asyncio.sleep(0)
+        if chat_id in self.blocked:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        if self.failures.get(chat_id, 0) > 0:
+            self.failures[chat_id] -= 1
+            raise NetworkError("connection reset")
+        self.sent.append((chat_id, text, reply_markup))
+
+def make_drainer(**kwargs) -> OutboxDrainer:
+    options = dict(batch_size=50, interval=0.01, max_attempts=3, backoff_base=0.0, backoff_max=0.0, lease=60)
+    options.update(kwargs)
+    return OutboxDrainer(**options)
+
+def enqueue(*chat_ids, reply_markup=None):
+    with db_manager.get_session() as session:
+        for chat_id in chat_ids:
+            enqueue_notification(session, chat_id, f"إشعار {chat_id}", "test", reply_markup)
+
+def rows():
+    with db_manager.get_session() as session:
+        return {
+            row.chat_id: (row.status, row.attempts, row.last_error)
+            for row in session.query(OutboxMessage)
+        }
+
+async def drain(drainer: OutboxDrainer, bot: FakeBot, rounds: int = 5):
+    drainer.bot = bot
+    for _ in range(rounds):
+        await drainer.drain_once()
+
+@pytest.fixture(autouse=True)
+def empty_outbox():
+    with db_manager.get_session() as session:
+        session.execute(delete(OutboxMessage))
+    yield
+
+def test_delivers_with_reply_markup():
+    markup = InlineKeyboardMarkup([[InlineKeyboardButton("قبول", callback_data="x")]])
+    enqueue(1, reply_markup=markup)
+    bot = FakeBot()
+
+    asyncio.run(drain(make_drainer(), bot, rounds=1))
+
+    assert [(chat_id, text) for chat_id, text, _ in bot.sent] == [(1, "إشعار 1")]
+    assert bot.sent[0][2] == markup
+    assert rows() == {1: ("delivered", 1, None)}
+
+def test_retries_transient_errors_until_delivered():
+    enqueue(1)
+    bot = FakeBot(failures={1: 2})
+    drainer = make_drainer()
+
+    asyncio.run(drain(drainer, bot))
+
+    assert len(bot.sent) == 1
+    assert rows() == {1: ("delivered", 3, "connection reset")}
+    assert (drainer.retried, drainer.delivered, drainer.failed) == (2, 1, 0)
+
+def test_retry_waits_for_backoff():
+    enqueue(1)
+    bot = FakeBot(failures={1: 1})
+
+    asyncio.run(drain(make_drainer(backoff_base=60, backoff_max=60), bot))
+
+    assert bot.sent == []
+    assert rows() == {1: ("pending", 1, "connection reset")}
+
+def test_permanent_error_is_not_retried():
+    enqueue(1, 2)
+    bot = FakeBot(blocked={1})
+    drainer = make_drainer()
+
+    asyncio.run(drain(drainer, bot))
+
+    assert [chat_id for chat_id, _, _ in bot.sent] == [2]
+    status, attempts, error = rows()[1]
+    assert (status, attempts) == ("failed", 1)
+    assert "blocked" in error
+
+def test_gives_up_after_max_attempts():
+    enqueue(1)
+    bot = FakeBot(failures={1: 10})
+
+    asyncio.run(drain(make_drainer(max_attempts=3), bot))
+
+    assert bot.sent == []
+    assert rows() == {1: ("failed", 3, "connection reset")}
+
+def test_claimed_rows_are_skipped_by_other_drainers():
+    enqueue(1, 2, 3)
+    first, second = make_drainer(), make_drainer()
+
+    # المرسل الثاني قرأ السطور المستحقة قبل أن يحجزها الأول
+    now = datetime.utcnow() + timedelta(seconds=1)
+    with db_manager.get_session() as session:
+        stale = second._select_due(session, now)
+    claimed = first._claim_batch()
+    with db_manager.write_session() as session:
+        claimed_again = second._claim(session, stale, now)
+
+    assert sorted(row["chat_id"] for row in claimed) == [1, 2, 3]
+    assert claimed_again == []
+
+def test_concurrent_drainers_deliver_each_message_once():
+    chat_ids = list(range(1, 121))
+    enqueue(*chat_ids)
+    bot = FakeBot()
+
+    async def run():
+        drainers = [make_drainer(batch_size=10) for _ in range(3)]
+        await asyncio.gather(*(drain(drainer, bot, rounds=10) for drainer in drainers))
+
+    asyncio.run(run())
+
+    assert sorted(chat_id for chat_id, _, _ in bot.sent) == chat_ids
+    assert {status for status, _, _ in rows().values()} == {"delivered"}
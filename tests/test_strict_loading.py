@@ -0,0 +1,116 @@
+"""اختبارات الوضع الصارم: الاستعلامات الساخنة وتقارير الأدمن بلا تحميل كسول"""
+
+import asyncio
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database.database import db_manager
+from database.loading import is_strict_loading, set_strict_loading
+from database.models import Base, DriverProfile, Ride, RideStatus, User, UserRole, UserStatus
+from database.queries import get_available_drivers, get_driver_profile, get_pending_ride, get_user_by_telegram_id
+from handlers.admin import AdminHandlers
+from utils.stats import stats_service
+
+PASSENGER, DRIVER = 1001, 2002
+
+def seed(session):
+    passenger = User(telegram_id=PASSENGER, first_name="راكب", role=UserRole.PASSENGER, status=UserStatus.ACTIVE)
+    driver = User(
+        telegram_id=DRIVER, first_name="سائق", role=UserRole.DRIVER, status=UserStatus.ACTIVE,
+        latitude=24.7, longitude=46.7
+    )
+    session.add_all([passenger, driver])
+    session.flush()
+    session.add(DriverProfile(user_id=driver.id, is_online=True, is_available=True, current_debt=12.5))
+    session.add_all([
+        Ride(
+            ride_code="PENDING", passenger_id=passenger.id, status=RideStatus.PENDING,
+            pickup_latitude=24.7, pickup_longitude=46.7, destination_latitude=24.8, destination_longitude=46.8
+        ),
+        Ride(
+            ride_code="DONE", passenger_id=passenger.id, driver_id=driver.id, status=RideStatus.COMPLETED,
+            pickup_latitude=24.7, pickup_longitude=46.7, destination_latitude=24.8, destination_longitude=46.8,
+            final_fare=30.0, commission_amount=6.0, driver_earning=24.0, completed_at=datetime.utcnow()
+        )
+    ])
+    session.commit()
+
+@pytest.fixture
+def session_factory(monkeypatch):
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine, autoflush=False)
+    with factory() as session:
+        seed(session)
+    # تقارير الأدمن تقرأ عبر read_session
+    monkeypatch.setattr(db_manager, "_open_read_session", factory)
+
+    previous = is_strict_loading()
+    set_strict_loading(True)
+    yield factory
+    set_strict_loading(previous)
+    engine.dispose()
+
+@pytest.fixture
+def admin(session_factory):
+    handlers = AdminHandlers()
+    handlers.session = session_factory()
+    yield handlers
+    handlers.session.close()
+
+def fake_query():
+    return MagicMock(edit_message_text=AsyncMock(), answer=AsyncMock())
+
+def shown_text(query) -> str:
+    return query.edit_message_text.call_args.args[0]
+
+def test_strict_mode_rejects_lazy_loads(session_factory):
+    with session_factory() as session:
+        ride = get_pending_ride(session, 1)
+        with pytest.raises(InvalidRequestError):
+            ride.chat_messages
+
+def test_hot_queries_load_what_handlers_use(session_factory):
+    with session_factory() as session:
+        user = get_user_by_telegram_id(session, DRIVER)
+        assert user.driver_profile.current_debt == 12.5
+
+    with session_factory() as session:
+        ride = get_pending_ride(session, 1)
+        assert ride.passenger.telegram_id == PASSENGER
+
+    with session_factory() as session:
+        drivers = get_available_drivers(session)
+        assert [(user.telegram_id, profile.is_online) for user, profile in drivers] == [(DRIVER, True)]
+
+    with session_factory() as session:
+        profile = get_driver_profile(session, 2)
+        assert profile.user.status == UserStatus.ACTIVE
+
+def test_admin_user_views(admin):
+    query = fake_query()
+    asyncio.run(admin._show_users_management(query))
+    assert "إدارة المستخدمين" in shown_text(query)
+
+    query = fake_query()
+    asyncio.run(admin._show_user_detail(query, 2))
+    assert "معلومات السائق" in shown_text(query)
+
+def test_admin_debt_management(admin):
+    query = fake_query()
+    asyncio.run(admin._show_debt_management(query))
+    assert "12.50" in shown_text(query)
+
+def test_admin_reports(admin):
+    query = fake_query()
+    asyncio.run(admin._show_daily_report(query))
+    assert "المكتملة: 1" in shown_text(query)
+
+    stats = stats_service.compute()
+    assert (stats["total_users"], stats["total_rides"], stats["total_debt"]) == (2, 2, 12.5)
@@ -0,0 +1,252 @@
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select, insert, update, delete, func
+
+from config import config
+from database.database import db_manager
+from database.models import Ride, RideStatus, ChatMessage, DebtTransaction, DriverProfile, ArchivedRide
+
+logger = logging.getLogger(__name__)
+
+# الحالات النهائية فقط قابلة للأرشفة
+ARCHIVABLE_STATUSES = (RideStatus.COMPLETED, RideStatus.CANCELLED)
+
+# لاحقة ملف الدفعة قبل اكتمال حذف صفوفها
+TMP_SUFFIX = ".tmp"
+
+def _to_json_value(value: Any) -> Any:
+    """تحويل القيم إلى صيغة JSON"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+def _row_to_dict(row) -> Dict[str, Any]:
+    return {key: _to_json_value(value) for key, value in row.items()}
+
+class RideArchiver:
+    """
+    أرشفة الرحلات المنتهية القديمة مع رسائل دردشتها إلى ملفات مضغوطة
+
+    كل دفعة تُكتب في ملف JSON Lines مضغوط (سطر لكل رحلة مع رسائلها)، ثم
+    تُحذف من الجداول الساخنة ويُضاف لكل رحلة سطر في فهرس archived_rides
+    حتى يمكن جلبها لاحقاً بـ ride_code.
+    """
+
+    def __init__(
+        self,
+        archive_dir: Optional[str] = None,
+        older_than_days: Optional[int] = None,
+        batch_size: Optional[int] = None
+    ):
+        self.archive_dir = archive_dir or config.archive.ARCHIVE_DIR
+        self.older_than_days = older_than_days if older_than_days is not None else config.archive.ARCHIVE_AFTER_DAYS
+        self.batch_size = batch_size or config.archive.ARCHIVE_BATCH_SIZE
+
+    def run(self, max_batches: Optional[int] = None) -> int:
+        """
+        أرشفة الدفعات حتى لا يبقى شيء قابل للأرشفة
+
+        Returns:
+            عدد الرحلات المؤرشفة
+        """
+        # هنا وليس عند الإنشاء: المعالجات تنشئ الكائن للقراءة فقط عند الاستيراد
+        os.makedirs(self.archive_dir, exist_ok=True)
+        self.recover_files()
+        total = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            archived = self.archive_batch()
+            if not archived:
+                break
+            total += archived
+            batches += 1
+
+        if total:
+            logger.info(f"تمت أرشفة {total} رحلة في {batches} دفعة")
+        return total
+
+    def archive_batch(self) -> int:
+        """
+        أرشفة دفعة واحدة، وإرجاع عدد الرحلات المؤرشفة
+
+        تُقرأ الدفعة دون قفل الكتابة، ويُكتب الملف في ملف مؤقت ويُزامن مع
+        القرص، ثم تُحذف الصفوف في جلسة كتابة قصيرة تتحقق أن الدفعة لم تتغير.
+        لا يأخذ الملف اسمه النهائي إلا بعد نجاح الحذف، فالفشل لا يترك دفعة
+        مؤرشفة نصف أرشفة.
+        """
+        cutoff = datetime.utcnow() - timedelta(days=self.older_than_days)
+        # الرحلات المرتبطة بسائق حالياً لا تُؤرشف
+        active_ride_ids = select(DriverProfile.current_ride_id).where(
+            DriverProfile.current_ride_id.isnot(None)
+        )
+        archivable = (
+            Ride.status.in_(ARCHIVABLE_STATUSES),
+            func.coalesce(Ride.completed_at, Ride.requested_at) < cutoff,
+            Ride.id.notin_(active_ride_ids)
+        )
+
+        with db_manager.get_session() as session:
+            rides = session.execute(
+                select(Ride.__table__).where(*archivable).order_by(Ride.id).limit(self.batch_size)
+            ).mappings().all()
+
+            if not rides:
+                return 0
+
+            ride_ids = [ride["id"] for ride in rides]
+
+            # رسائل الدردشة ومعاملات المديونية للدفعة كلها في استعلام واحد لكل منهما
+            messages: Dict[int, List[Dict[str, Any]]] = {}
+            for message in session.execute(
+                select(ChatMessage.__table__).where(
+                    ChatMessage.ride_id.in_(ride_ids)
+                ).order_by(ChatMessage.id)
+            ).mappings():
+                messages.setdefault(message["ride_id"], []).append(_row_to_dict(message))
+
+            transactions: Dict[int, List[int]] = {}
+            for transaction_id, ride_id in session.execute(
+                select(DebtTransaction.id, DebtTransaction.ride_id).where(
+                    DebtTransaction.ride_id.in_(ride_ids)
+                )
+            ):
+                transactions.setdefault(ride_id, []).append(transaction_id)
+
+        file_name = f"rides-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}-{ride_ids[0]}.jsonl.gz"
+        file_path = os.path.join(self.archive_dir, file_name)
+        tmp_path = file_path + TMP_SUFFIX
+        records = []
+        for ride in rides:
+            record = _row_to_dict(ride)
+            record["chat_messages"] = messages.get(ride["id"], [])
+            record["debt_transaction_ids"] = transactions.get(ride["id"], [])
+            records.append(record)
+        message_count = sum(len(ride_messages) for ride_messages in messages.values())
+
+        try:
+            self._write_file(tmp_path, records)
+
+            with db_manager.write_session() as session:
+                # تغيرت الدفعة منذ قراءتها (رسالة جديدة، رحلة أُسندت لسائق):
+                # تُترك للمرة القادمة
+                unchanged = session.execute(
+                    select(func.count()).select_from(Ride).where(Ride.id.in_(ride_ids), *archivable)
+                ).scalar() == len(ride_ids) and session.execute(
+                    select(func.count()).select_from(ChatMessage).where(ChatMessage.ride_id.in_(ride_ids))
+                ).scalar() == message_count
+                if not unchanged:
+                    os.remove(tmp_path)
+                    logger.warning(f"تغيرت دفعة الأرشفة التي تبدأ بالرحلة {ride_ids[0]}، تم تأجيلها")
+                    return 0
+
+                session.execute(insert(ArchivedRide), [
+                    {
+                        "ride_code": ride["ride_code"] or f"ID-{ride['id']}",
+                        "ride_id": ride["id"],
+                        "passenger_id": ride["passenger_id"],
+                        "driver_id": ride["driver_id"],
+                        "status": ride["status"],
+                        "requested_at": ride["requested_at"],
+                        "archive_file": file_name,
+                        "line_number": line_number
+                    }
+                    for line_number, ride in enumerate(rides)
+                ])
+                # سجل المديونية يبقى، ويُفك ربطه بالرحلة المحذوفة فقط
+                session.execute(
+                    update(DebtTransaction).where(
+                        DebtTransaction.ride_id.in_(ride_ids)
+                    ).values(ride_id=None)
+                )
+                session.execute(delete(ChatMessage).where(ChatMessage.ride_id.in_(ride_ids)))
+                session.execute(delete(Ride).where(Ride.id.in_(ride_ids)))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        # تعطل قبل هذا السطر يترك ملفاً مؤقتاً يكمله recover_files
+        self._promote(tmp_path, file_path)
+        return len(rides)
+
+    def recover_files(self) -> int:
+        """
+        إكمال الملفات المؤقتة المتبقية من تعطل سابق
+
+        الملف المؤقت المسجل في فهرس الأرشيف حُذفت صفوفه فيأخذ اسمه النهائي،
+        وغير المسجل لم يكتمل حذف صفوفه فيُحذف.
+
+        Returns:
+            عدد الملفات التي تم إكمالها
+        """
+        pending = [name for name in os.listdir(self.archive_dir) if name.endswith(TMP_SUFFIX)]
+        if not pending:
+            return 0
+
+        file_names = [name[:-len(TMP_SUFFIX)] for name in pending]
+        with db_manager.get_session() as session:
+            indexed = set(session.execute(
+                select(ArchivedRide.archive_file).where(
+                    ArchivedRide.archive_file.in_(file_names)
+                ).distinct()
+            ).scalars())
+
+        recovered = 0
+        for tmp_name, file_name in zip(pending, file_names):
+            tmp_path = os.path.join(self.archive_dir, tmp_name)
+            if file_name in indexed:
+                self._promote(tmp_path, os.path.join(self.archive_dir, file_name))
+                recovered += 1
+            else:
+                os.remove(tmp_path)
+        logger.info(f"تم إكمال {recovered} ملف أرشيف وحذف {len(pending) - recovered} ملف غير مكتمل")
+        return recovered
+
+    @staticmethod
+    def _write_file(tmp_path: str, records: List[Dict[str, Any]]):
+        """كتابة الملف المؤقت ومزامنته مع القرص"""
+        with open(tmp_path, "wb") as raw_file:
+            with gzip.open(raw_file, "wt", encoding="utf-8") as archive_file:
+                for record in records:
+                    archive_file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+                    archive_file.write("\n")
+            raw_file.flush()
+            os.fsync(raw_file.fileno())
+
+    def _promote(self, tmp_path: str, file_path: str):
+        """إعطاء الملف اسمه النهائي ومزامنة المجلد"""
+        os.replace(tmp_path, file_path)
+        dir_fd = os.open(self.archive_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def fetch(self, session, ride_code: str) -> Optional[Dict[str, Any]]:
+        """جلب رحلة مؤرشفة واحدة برقمها (يقرأ ويفك ضغط الملف، فيُستدعى خارج حلقة الأحداث)"""
+        entry = session.execute(
+            select(ArchivedRide.archive_file, ArchivedRide.line_number).where(
+                ArchivedRide.ride_code == ride_code
+            )
+        ).first()
+
+        if not entry:
+            return None
+
+        file_path = os.path.join(self.archive_dir, entry.archive_file)
+        try:
+            with gzip.open(file_path, "rt", encoding="utf-8") as archive_file:
+                for line_number, line in enumerate(archive_file):
+                    if line_number == entry.line_number:
+                        return json.loads(line)
+        except OSError as e:
+            logger.error(f"خطأ في قراءة ملف الأرشيف {file_path}: {e}")
+        return None
@@ -0,0 +1,328 @@
+"""
+الرسائل الجماعية من الأدمن
+
+المستلمون يُقرأون من قاعدة البيانات على صفحات بترقيم keyset (users.id > آخر
+معرف)، فلا يُحمّل الجدول كله ولا تتباطأ الصفحات الأخيرة كما مع OFFSET. الإرسال
+بمعدل BROADCAST_RATE في مهمة خلفية وبأولوية BROADCAST في مجدول الرسائل الصادرة،
+فتسبقه إشعارات الرحلات دائماً. بعد كل صفحة يُحفظ آخر معرف والعدادات، فالرسالة
+التي توقفت (إعادة نشر أو تعطل) تُستأنف من حيث توقفت عند التشغيل التالي.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, update
+from telegram.error import Forbidden
+
+from config import config
+from database.database import db_manager
+from database.models import Broadcast, User, UserRole, UserStatus
+from utils.location import Location, LocationService
+from utils.outbound import Priority
+
+logger = logging.getLogger(__name__)
+
+AUDIENCES = ("drivers", "passengers", "all", "area")
+
+class BroadcastEngine:
+    """
+    تشغيل الرسائل الجماعية في الخلفية
+
+    Args:
+        rate: أقصى عدد رسائل في الثانية لكل الرسائل الجماعية معاً
+        page_size: عدد المستخدمين في كل صفحة (ونقطة حفظ التقدم)
+    """
+
+    def __init__(self, rate: float, page_size: int):
+        self.rate = rate
+        self.page_size = page_size
+        self.bot = None
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._cancelled = set()
+        self._stopping = False
+        self._next_slot = 0.0
+        self._in_flight: Optional[asyncio.Semaphore] = None
+
+    async def start(self, bot, resume: bool = True):
+        """تهيئة المحرك واستئناف الرسائل التي لم تكتمل"""
+        self.bot = bot
+        self._stopping = False
+        # حد الإرسالات المنتظرة في المجدول حتى لا تتراكم إن تأخر
+        self._in_flight = asyncio.Semaphore(max(1, int(self.rate * 2)))
+        if not resume:
+            return
+        try:
+            for broadcast_id in await asyncio.to_thread(self._running_ids):
+                logger.info(f"استئناف الرسالة الجماعية {broadcast_id}")
+                self.launch(broadcast_id)
+        except Exception as e:
+            logger.error(f"خطأ في استئناف الرسائل الجماعية: {e}")
+
+    async def stop(self):
+        """إيقاف الإرسال بعد حفظ التقدم (تبقى الرسالة running لتُستأنف)"""
+        self._stopping = True
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def create(
+        self,
+        admin_id: int,
+        audience: str,
+        text: str,
+        area: Optional[Tuple[float, float, float]] = None
+    ) -> Tuple[int, int]:
+        """
+        حفظ رسالة جماعية جديدة
+
+        Args:
+            admin_id: معرف تيليجرام للأدمن (يُبلغ بالنتيجة)
+            audience: drivers أو passengers أو all أو area (ركاب منطقة)
+            area: (خط العرض، خط الطول، نصف القطر بالكيلومتر) عند audience=area
+
+        Returns:
+            (معرف الرسالة، العدد التقريبي للمستلمين)
+        """
+        if audience not in AUDIENCES:
+            raise ValueError(f"فئة غير معروفة: {audience}")
+        if audience == "area" and area is None:
+            raise ValueError("الرسالة لمنطقة تحتاج الموقع ونصف القطر")
+
+        with db_manager.write_session() as session:
+            broadcast = Broadcast(admin_id=admin_id, audience=audience, text=text, status="running")
+            if area:
+                broadcast.center_latitude, broadcast.center_longitude, broadcast.radius_km = area
+            session.add(broadcast)
+            session.flush()
+            # للمنطقة: عدد من في المربع المحيط بالدائرة (تقريبي)
+            total = session.execute(
+                self._recipients_query(broadcast, select(func.count(User.id)))
+            ).scalar()
+            return broadcast.id, total
+
+    def launch(self, broadcast_id: int):
+        """بدء إرسال رسالة محفوظة في الخلفية"""
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        """إلغاء رسالة جارية (في أي عملية: تتوقف عند حفظ الصفحة التالية)"""
+        cancelled = await asyncio.to_thread(self._mark_cancelled, broadcast_id)
+        if cancelled:
+            self._cancelled.add(broadcast_id)
+        return cancelled
+
+    def recent(self, limit: int = 5) -> List[Dict[str, Any]]:
+        """آخر الرسائل الجماعية مع تقدمها"""
+        with db_manager.read_session() as session:
+            rows = session.execute(
+                select(
+                    Broadcast.id, Broadcast.audience, Broadcast.status, Broadcast.delivered,
+                    Broadcast.failed, Broadcast.blocked, Broadcast.created_at
+                ).order_by(Broadcast.id.desc()).limit(limit)
+            ).mappings().all()
+        return [dict(row) for row in rows]
+
+    async def _run(self, broadcast_id: int):
+        try:
+            broadcast = await asyncio.to_thread(self._load, broadcast_id)
+            if broadcast is None or broadcast.status != "running":
+                return
+            after = broadcast.last_user_id or 0
+
+            while True:
+                recipients, scanned_last, scanned = await asyncio.to_thread(
+                    self._fetch_page, broadcast, after
+                )
+                counts, last_sent, interrupted = await self._send_page(broadcast_id, recipients, broadcast.text)
+                # عند التوقف وسط الصفحة يُحفظ آخر من أُرسل له فقط
+                after = last_sent if interrupted else scanned_last or after
+                finished = not interrupted and scanned < self.page_size
+
+                status = await asyncio.to_thread(self._checkpoint, broadcast_id, after, counts, finished)
+                if status != "running" or interrupted or finished:
+                    break
+
+            if status in ("completed", "cancelled"):
+                await self._report(broadcast_id)
+        except Exception as e:
+            logger.error(f"خطأ في الرسالة الجماعية {broadcast_id}: {e}")
+        finally:
+            self._cancelled.discard(broadcast_id)
+
+    async def _send_page(
+        self,
+        broadcast_id: int,
+        recipients: List[Tuple[int, int]],
+        text: str
+    ) -> Tuple[Dict[str, int], Optional[int], bool]:
+        """
+        إرسال صفحة بالمعدل المحدد
+
+        Returns:
+            (العدادات، آخر users.id أُرسل له، هل توقف قبل نهاية الصفحة)
+        """
+        counts = {"delivered": 0, "failed": 0, "blocked": 0}
+
+        async def send(telegram_id: int):
+            try:
+                await self.bot.send_message(
+                    chat_id=telegram_id,
+                    text=text,
+                    rate_limit_args={"priority": Priority.BROADCAST}
+                )
+                counts["delivered"] += 1
+            except Forbidden:
+                # المستخدم حظر البوت أو حذف حسابه
+                counts["blocked"] += 1
+            except Exception as e:
+                counts["failed"] += 1
+                logger.warning(f"فشل إرسال الرسالة الجماعية {broadcast_id} إلى {telegram_id}: {e}")
+            finally:
+                self._in_flight.release()
+
+        sends = []
+        last_sent = None
+        interrupted = False
+        for user_id, telegram_id in recipients:
+            if self._stopping or broadcast_id in self._cancelled:
+                interrupted = True
+                break
+            await self._pace()
+            await self._in_flight.acquire()
+            sends.append(asyncio.create_task(send(telegram_id)))
+            last_sent = user_id
+
+        await asyncio.gather(*sends)
+        return counts, last_sent, interrupted
+
+    async def _pace(self):
+        """انتظار الموعد التالي المسموح (مشترك بين كل الرسائل الجارية)"""
+        now = time.monotonic()
+        slot = max(self._next_slot, now)
+        self._next_slot = slot + 1 / self.rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _report(self, broadcast_id: int):
+        """إبلاغ الأدمن بنتيجة الرسالة"""
+        broadcast = await asyncio.to_thread(self._load, broadcast_id)
+        try:
+            await self.bot.send_message(
+                chat_id=broadcast.admin_id,
+                text=(
+                    f"📣 الرسالة الجماعية #{broadcast.id}: "
+                    f"{'اكتملت' if broadcast.status == 'completed' else 'أُلغيت'}\n\n"
+                    f"✅ تم التسليم: {broadcast.delivered}\n"
+                    f"⛔ حظروا البوت: {broadcast.blocked}\n"
+                    f"❌ فشل: {broadcast.failed}"
+                ),
+                rate_limit_args={"priority": Priority.NOTICE}
+            )
+        except Exception as e:
+            logger.error(f"فشل في إبلاغ الأدمن بنتيجة الرسالة الجماعية {broadcast_id}: {e}")
+
+    @staticmethod
+    def _recipients_query(broadcast: Broadcast, query):
+        """تطبيق شروط الفئة على الاستعلام (للمنطقة: المربع المحيط بالدائرة)"""
+        query = query.where(User.status != UserStatus.BANNED)
+        if broadcast.audience == "drivers":
+            return query.where(User.role == UserRole.DRIVER)
+        if broadcast.audience == "passengers":
+            return query.where(User.role == UserRole.PASSENGER)
+        if broadcast.audience == "area":
+            lat_delta = broadcast.radius_km / 111.0
+            lon_delta = broadcast.radius_km / (111.0 * max(math.cos(math.radians(broadcast.center_latitude)), 0.01))
+            return query.where(
+                User.role == UserRole.PASSENGER,
+                User.latitude.between(broadcast.center_latitude - lat_delta, broadcast.center_latitude + lat_delta),
+                User.longitude.between(broadcast.center_longitude - lon_delta, broadcast.center_longitude + lon_delta)
+            )
+        return query
+
+    def _fetch_page(self, broadcast: Broadcast, after: int) -> Tuple[List[Tuple[int, int]], Optional[int], int]:
+        """
+        صفحة المستخدمين التالية بعد after
+
+        Returns:
+            (المستلمون (users.id، telegram_id)، آخر معرف تم فحصه، عدد المفحوصين)
+        """
+        with db_manager.read_session() as session:
+            rows = session.execute(
+                self._recipients_query(
+                    broadcast,
+                    select(User.id, User.telegram_id, User.latitude, User.longitude)
+                ).where(User.id > after).order_by(User.id).limit(self.page_size)
+            ).all()
+
+        if not rows:
+            return [], None, 0
+        recipients = [(row.id, row.telegram_id) for row in rows]
+        if broadcast.audience == "area":
+            center = Location(broadcast.center_latitude, broadcast.center_longitude)
+            recipients = [
+                (row.id, row.telegram_id) for row in rows
+                if LocationService.calculate_distance(center, Location(row.latitude, row.longitude)) <= broadcast.radius_km
+            ]
+        return recipients, rows[-1].id, len(rows)
+
+    @staticmethod
+    def _checkpoint(broadcast_id: int, last_user_id: Optional[int], counts: Dict[str, int], finished: bool) -> str:
+        """حفظ التقدم، وإرجاع الحالة الحالية (قد يكون أُلغي من عملية أخرى)"""
+        values = {
+            "delivered": Broadcast.delivered + counts["delivered"],
+            "failed": Broadcast.failed + counts["failed"],
+            "blocked": Broadcast.blocked + counts["blocked"]
+        }
+        if last_user_id is not None:
+            values["last_user_id"] = last_user_id
+        with db_manager.write_session() as session:
+            session.execute(update(Broadcast).where(Broadcast.id == broadcast_id).values(**values))
+            if finished:
+                session.execute(
+                    update(Broadcast).where(
+                        Broadcast.id == broadcast_id,
+                        Broadcast.status == "running"
+                    ).values(status="completed", finished_at=datetime.utcnow())
+                )
+            return session.execute(
+                select(Broadcast.status).where(Broadcast.id == broadcast_id)
+            ).scalar()
+
+    @staticmethod
+    def _mark_cancelled(broadcast_id: int) -> bool:
+        with db_manager.write_session() as session:
+            result = session.execute(
+                update(Broadcast).where(
+                    Broadcast.id == broadcast_id,
+                    Broadcast.status == "running"
+                ).values(status="cancelled", finished_at=datetime.utcnow())
+            )
+            return result.rowcount == 1
+
+    @staticmethod
+    def _load(broadcast_id: int) -> Optional[Broadcast]:
+        with db_manager.get_session() as session:
+            broadcast = session.get(Broadcast, broadcast_id)
+            if broadcast is not None:
+                session.expunge(broadcast)
+            return broadcast
+
+    @staticmethod
+    def _running_ids() -> List[int]:
+        with db_manager.get_session() as session:
+            return list(session.execute(
+                select(Broadcast.id).where(Broadcast.status == "running").order_by(Broadcast.id)
+            ).scalars())
+
+# إنشاء الكائن العام
+broadcast_engine = BroadcastEngine(
+    rate=config.broadcast.BROADCAST_RATE,
+    page_size=config.broadcast.BROADCAST_PAGE_SIZE
+)
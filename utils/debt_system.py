@@ -5,7 +5,11 @@ from dataclasses import dataclass
 from enum import Enum
 
 from config import config
-from database.models import DriverProfile, DebtTransaction, Ride
+from database.models import DebtTransaction, Ride, UserStatus
+from database.queries import get_driver_profile
+from utils.metrics import metrics
+from utils.outbound import Priority
+from utils.outbox import enqueue_notification
 
 logger = logging.getLogger(__name__)
 
@@ -41,13 +45,16 @@ class DebtManager:
         """
         إضافة عمولة إلى مديونية السائق
         
+        تُجهز التغييرات في جلسة المستدعي ولا تُحفظ هنا، فتُحفظ مع تغييرات
+        الرحلة في نفس المعاملة (db_manager.commit)، ويسجل المستدعي المقاييس
+        بعد الحفظ.
+        
         Returns:
-            معلومات المعاملة الجديدة
+            معلومات المعاملة الجديدة، ومنها suspended وwas_online لتسجيل
+            تغير حالة السائق بعد الحفظ
         """
         try:
-            driver_profile = self.session.query(DriverProfile).filter_by(
-                user_id=driver_id
-            ).first()
+            driver_profile = get_driver_profile(self.session, driver_id)
             
             if not driver_profile:
                 raise ValueError(f"لم يتم العثور على سائق بالمعرف: {driver_id}")
@@ -69,13 +76,14 @@ class DebtManager:
             # تحديث مديونية السائق
             driver_profile.current_debt = new_debt
             
-            # حفظ التغييرات
             self.session.add(transaction)
-            self.session.commit()
+            self.session.flush()
             
             # التحقق من تجاوز الحد
+            was_online = driver_profile.is_online
+            notifications = []
             if new_debt >= config.debt.DEBT_WARNING_THRESHOLD:
-                self._check_debt_limits(driver_id, new_debt)
+                notifications = self._check_debt_limits(driver_id, new_debt) or []
             
             return {
                 'transaction_id': transaction.id,
@@ -83,7 +91,9 @@ class DebtManager:
                 'old_debt': driver_profile.current_debt - commission_amount,
                 'new_debt': new_debt,
                 'commission_amount': commission_amount,
-                'transaction_time': transaction.created_at
+                'transaction_time': transaction.created_at,
+                'suspended': any(n.notification_type == "suspension" for n in notifications),
+                'was_online': was_online
             }
             
         except Exception as e:
@@ -105,9 +115,7 @@ class DebtManager:
             معلومات الدفعة
         """
         try:
-            driver_profile = self.session.query(DriverProfile).filter_by(
-                user_id=driver_id
-            ).first()
+            driver_profile = get_driver_profile(self.session, driver_id)
             
             if not driver_profile:
                 raise ValueError(f"لم يتم العثور على سائق بالمعرف: {driver_id}")
@@ -134,13 +142,15 @@ class DebtManager:
             driver_profile.wallet_balance += amount
             
             # إذا كان الرصيد أصبح أقل من الحد، تفعيل الحساب
+            was_online = driver_profile.is_online
             if (driver_profile.current_debt < config.debt.MAX_DEBT_LIMIT and 
-                not driver_profile.user.is_active):
-                driver_profile.user.status = "active"
+                driver_profile.user.status == UserStatus.SUSPENDED):
+                driver_profile.user.status = UserStatus.ACTIVE
                 driver_profile.is_online = True
             
             self.session.add(transaction)
             self.session.commit()
+            metrics.driver_status_changed(was_online, driver_profile.is_online)
             
             return {
                 'transaction_id': transaction.id,
@@ -158,10 +168,8 @@ class DebtManager:
             raise
     
     def _check_debt_limits(self, driver_id: int, current_debt: float):
-        """التحقق من حدود المديونية واتخاذ الإجراء المناسب"""
-        driver_profile = self.session.query(DriverProfile).filter_by(
-            user_id=driver_id
-        ).first()
+        """التحقق من حدود المديونية واتخاذ الإجراء المناسب (يُحفظ مع معاملة المستدعي)"""
+        driver_profile = get_driver_profile(self.session, driver_id)
         
         if not driver_profile:
             return
@@ -184,8 +192,10 @@ class DebtManager:
         elif (current_debt >= config.debt.MAX_DEBT_LIMIT and 
               config.debt.AUTO_SUSPEND):
             
+            # يُحفظ مع معاملة العمولة التي استدعت هذا الفحص، والمستدعي يسجل
+            # تغير الحالة في المقاييس بعد الحفظ
             driver_profile.is_online = False
-            driver_profile.user.status = "suspended"
+            driver_profile.user.status = UserStatus.SUSPENDED
             
             notifications.append(DebtNotification(
                 driver_id=driver_id,
@@ -195,18 +205,22 @@ class DebtManager:
                 timestamp=datetime.utcnow()
             ))
         
-        # حفظ التغييرات
-        self.session.commit()
+        # الإشعارات تُحفظ في صندوق الصادر مع التغييرات في نفس المعاملة
+        for notification in notifications:
+            enqueue_notification(
+                self.session,
+                chat_id=driver_profile.user.telegram_id,
+                text=notification.message,
+                kind=f"debt_{notification.notification_type}",
+                priority=Priority.NOTICE
+            )
         
-        # إرسال الإشعارات (سيتم تنفيذها في المعالجات)
         return notifications
     
     def get_driver_debt_summary(self, driver_id: int) -> Dict[str, Any]:
         """الحصول على ملخص مديونية السائق"""
         try:
-            driver_profile = self.session.query(DriverProfile).filter_by(
-                user_id=driver_id
-            ).first()
+            driver_profile = get_driver_profile(self.session, driver_id)
             
             if not driver_profile:
                 return {}
@@ -234,7 +248,7 @@ class DebtManager:
                 'current_debt': driver_profile.current_debt,
                 'debt_limit': config.debt.MAX_DEBT_LIMIT,
                 'warning_threshold': config.debt.DEBT_WARNING_THRESHOLD,
-                'is_suspended': driver_profile.user.status == "suspended",
+                'is_suspended': driver_profile.user.status == UserStatus.SUSPENDED,
                 'monthly_stats': {
                     'total_commission': monthly_commission,
                     'total_payments': monthly_payments,
@@ -242,7 +256,7 @@ class DebtManager:
                 },
                 'can_work': (
                     driver_profile.current_debt < config.debt.MAX_DEBT_LIMIT and
-                    driver_profile.user.status == "active"
+                    driver_profile.user.status == UserStatus.ACTIVE
                 )
             }
             
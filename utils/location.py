@@ -2,10 +2,9 @@ import math
 from typing import Tuple, List, Optional, Dict, Any
 from dataclasses import dataclass
 import logging
-from geopy.distance import geodesic
 
 from config import config
-from database.models import User, DriverProfile
+from database.queries import get_available_drivers
 
 logger = logging.getLogger(__name__)
 
@@ -40,7 +39,9 @@ class LocationService:
         """
         try:
             if method == "vincenty":
-                # استخدام مكتبة geopy (أكثر دقة)
+                # استخدام مكتبة geopy (أكثر دقة). تُستورد هنا لأنها تستغرق ~0.1 ثانية
+                # عند بدء التشغيل (تستورد aiohttp) والطريقة الافتراضية لا تحتاجها
+                from geopy.distance import geodesic
                 return geodesic(loc1.to_tuple(), loc2.to_tuple()).kilometers
             else:
                 # صيغة Haversine (أسرع)
@@ -94,16 +95,7 @@ class LocationService:
         
         try:
             # جلب جميع السائقين المتاحين
-            drivers = session.query(User, DriverProfile).join(
-                DriverProfile, User.id == DriverProfile.user_id
-            ).filter(
-                User.role == "driver",
-                User.status == "active",
-                DriverProfile.is_online == True,
-                DriverProfile.is_available == True,
-                User.latitude.isnot(None),
-                User.longitude.isnot(None)
-            ).all()
+            drivers = get_available_drivers(session)
             
             nearby_drivers = []
             
@@ -0,0 +1,182 @@
+"""
+المقاييس الحية لأحداث الرحلات والسائقين
+
+تُحدَّث العدادات في الذاكرة عند وقوع الحدث (إنشاء رحلة، قبولها، إكمالها،
+إلغاؤها، اتصال السائق أو انقطاعه، تسجيل مديونية) بدلاً من مسح الجداول الكبيرة
+عند كل قراءة. نوعان:
+
+- عدادات يومية (حسب تاريخ UTC): rides_created، rides_completed، revenue...
+- مؤشرات حالية: drivers_online
+
+تُحفظ الزيادات غير المحفوظة دورياً في جدول metrics الصغير بإضافتها إلى القيمة
+المخزنة (value = value + الزيادة)، ثم تُعاد قراءة القيم. بذلك تبقى القيم بعد
+إعادة التشغيل، وتُجمع زيادات كل العمال في وضع العمليات المتعددة. القيمة
+الحية = آخر قيمة مقروءة من الجدول + الزيادات المحلية غير المحفوظة.
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import func, select, update
+
+from config import config
+from database.database import db_manager
+from database.models import DriverProfile, MetricValue
+
+logger = logging.getLogger(__name__)
+
+# مفتاح اليوم للمؤشرات الحالية (ليست يومية)
+GAUGE = ""
+
+def _today() -> str:
+    return datetime.utcnow().date().isoformat()
+
+class MetricsRegistry:
+    """
+    سجل المقاييس الحية
+
+    Args:
+        checkpoint_interval: الفاصل بين عمليات الحفظ (بالثواني)
+    """
+
+    def __init__(self, checkpoint_interval: float):
+        self.checkpoint_interval = checkpoint_interval
+        # (الاسم، اليوم) -> القيمة
+        self._stored: Dict[Tuple[str, str], float] = {}
+        self._pending: Dict[Tuple[str, str], float] = defaultdict(float)
+
+    # --- الأحداث ---
+
+    def ride_created(self):
+        self.incr("rides_created")
+
+    def ride_accepted(self):
+        self.incr("rides_accepted")
+
+    def ride_completed(self, fare: Optional[float], commission: Optional[float]):
+        self.incr("rides_completed")
+        self.incr("fares", fare or 0.0)
+        self.incr("revenue", commission or 0.0)
+
+    def ride_cancelled(self):
+        self.incr("rides_cancelled")
+
+    def driver_status_changed(self, was_online: bool, is_online: bool):
+        """تغير اتصال سائق (لا شيء إن لم تتغير الحالة)"""
+        if was_online != is_online:
+            self.adjust("drivers_online", 1 if is_online else -1)
+
+    def debt_posted(self, amount: float):
+        self.incr("debt_posted", amount)
+
+    # --- التحديث والقراءة ---
+
+    def incr(self, name: str, value: float = 1.0):
+        """زيادة عداد اليوم"""
+        self._pending[(name, _today())] += value
+
+    def adjust(self, name: str, delta: float):
+        """تعديل مؤشر حالي"""
+        self._pending[(name, GAUGE)] += delta
+
+    def get(self, name: str, day: Optional[str] = None) -> float:
+        """القيمة الحية لعداد يوم (اليوم افتراضياً) أو لمؤشر (day=GAUGE)"""
+        key = (name, _today() if day is None else day)
+        return self._stored.get(key, 0.0) + self._pending.get(key, 0.0)
+
+    def snapshot(self) -> Dict[str, float]:
+        """عدادات اليوم والمؤشرات الحالية"""
+        today = _today()
+        values = {
+            name: self.get(name, day)
+            for name, day in {*self._stored, *self._pending}
+            if day in (today, GAUGE)
+        }
+        return dict(sorted(values.items()))
+
+    # --- الحفظ ---
+
+    async def load(self):
+        """تحميل القيم المحفوظة عند بدء التشغيل"""
+        try:
+            self._stored = await asyncio.to_thread(self._read)
+        except Exception as e:
+            logger.error(f"خطأ في تحميل المقاييس: {e}")
+
+    async def reconcile(self):
+        """
+        ضبط المؤشرات من قاعدة البيانات (عملية واحدة عند بدء التشغيل)
+
+        تغييرات الحالة خارج الأحداث المسجلة (تعديل يدوي، تعطل قبل الحفظ)
+        قد تجعل المؤشر ينحرف، فيُعاد حسابه من المصدر.
+        """
+        try:
+            await asyncio.to_thread(self._reconcile)
+            self._stored = await asyncio.to_thread(self._read)
+        except Exception as e:
+            logger.error(f"خطأ في ضبط المقاييس: {e}")
+
+    async def checkpoint(self):
+        """حفظ الزيادات غير المحفوظة وقراءة القيم المجمعة من كل العمليات"""
+        pending, self._pending = self._pending, defaultdict(float)
+        try:
+            await asyncio.to_thread(self._write, {key: value for key, value in pending.items() if value})
+        except Exception:
+            # إعادة الزيادات لتُحفظ في المرة القادمة
+            for key, value in pending.items():
+                self._pending[key] += value
+            raise
+        self._stored = await asyncio.to_thread(self._read)
+
+    async def run(self):
+        """المهمة الخلفية: الحفظ الدوري"""
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                await self.checkpoint()
+            except Exception as e:
+                logger.error(f"خطأ في حفظ المقاييس: {e}")
+
+    @staticmethod
+    def _write(deltas: Dict[Tuple[str, str], float]):
+        if not deltas:
+            return
+        with db_manager.write_session() as session:
+            for (name, day), delta in deltas.items():
+                result = session.execute(
+                    update(MetricValue).where(
+                        MetricValue.name == name,
+                        MetricValue.day == day
+                    ).values(value=MetricValue.value + delta, updated_at=datetime.utcnow())
+                )
+                if result.rowcount == 0:
+                    session.add(MetricValue(name=name, day=day, value=delta))
+
+    @staticmethod
+    def _read() -> Dict[Tuple[str, str], float]:
+        """قيم اليوم والمؤشرات (صفوف قليلة)"""
+        with db_manager.get_session() as session:
+            rows = session.execute(
+                select(MetricValue.name, MetricValue.day, MetricValue.value).where(
+                    MetricValue.day.in_((_today(), GAUGE))
+                )
+            ).all()
+        return {(row.name, row.day): row.value for row in rows}
+
+    @staticmethod
+    def _reconcile():
+        with db_manager.write_session() as session:
+            online = session.execute(
+                select(func.count()).select_from(DriverProfile).where(DriverProfile.is_online.is_(True))
+            ).scalar()
+            gauge = session.get(MetricValue, ("drivers_online", GAUGE))
+            if gauge is None:
+                session.add(MetricValue(name="drivers_online", day=GAUGE, value=online))
+            else:
+                gauge.value = online
+
+# إنشاء الكائن العام
+metrics = MetricsRegistry(checkpoint_interval=config.stats.METRICS_CHECKPOINT_INTERVAL)
@@ -0,0 +1,334 @@
+"""
+جدولة الرسائل الصادرة إلى تيليجرام
+
+كل طلبات البوت التي تحمل chat_id تمر عبر هذا المجدول (كـ rate_limiter لتطبيق
+PTB) فيلتزم البوت بحدود تيليجرام: ~30 رسالة/ثانية إجمالاً و~1 رسالة/ثانية لكل
+محادثة. الطلبات تُرتب حسب الأولوية، وتعديلات نفس الرسالة المنتظرة تُدمج في
+تعديل واحد، وعند RetryAfter يتوقف الإرسال كله للمدة المطلوبة ثم يُعاد الطلب.
+
+الاستخدام لتحديد الأولوية:
+    await context.bot.send_message(..., rate_limit_args={"priority": Priority.RIDE})
+"""
+
+import asyncio
+import heapq
+import logging
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+class Priority(IntEnum):
+    """فئات الأولوية (الأصغر يُرسل أولاً)"""
+    RIDE = 0        # عروض الرحلات وإشعارات حالتها
+    CHAT = 1        # الدردشة والردود المباشرة على المستخدم (الافتراضي)
+    NOTICE = 2      # إشعارات الإدارة والنظام
+    BROADCAST = 3   # الرسائل الجماعية
+
+# التعديلات التي تُدمج إذا وصل تعديل أحدث لنفس الرسالة قبل إرسال السابق
+COALESCED_ENDPOINTS = {"editMessageText", "editMessageCaption", "editMessageReplyMarkup"}
+
+class TokenBucket:
+    """دلو رموز بمعدل وسعة محددين"""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """الزمن المتبقي حتى يتوفر رمز (0 إن كان متوفراً)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+class _Job:
+    """طلب ينتظر دوره في الإرسال"""
+    __slots__ = ("priority", "seq", "chat_id", "key", "enqueued_at", "granted", "successor", "result")
+
+    def __init__(self, priority: int, seq: int, chat_id, key: Optional[Tuple], loop):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.key = key
+        self.enqueued_at = time.monotonic()
+        # True عند السماح بالإرسال، False عند دمجه في طلب أحدث
+        self.granted = loop.create_future()
+        self.successor: Optional["_Job"] = None
+        # نتيجة الطلب، تُنشأ فقط عند وجود طلبات مدمجة تنتظرها
+        self.result: Optional[asyncio.Future] = None
+
+class OutboundScheduler(BaseRateLimiter[Dict[str, Any]]):
+    """المجدول المركزي للرسائل الصادرة"""
+
+    def __init__(
+        self,
+        global_rate: float,
+        per_chat_rate: float,
+        per_chat_burst: float,
+        max_retries: int
+    ):
+        self.global_rate = global_rate
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_retries = max_retries
+
+        self._global: Optional[TokenBucket] = None
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        self._heap: List[Tuple[int, int, _Job]] = []
+        self._delayed: List[Tuple[float, int, int, _Job]] = []
+        self._pending_keys: Dict[Tuple, _Job] = {}
+        self._seq = 0
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # المقاييس
+        self.waiting = {priority: 0 for priority in Priority}
+        self.sent = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.max_wait = 0.0
+        self._recent_waits = deque(maxlen=1000)
+
+    async def initialize(self):
+        """بدء موزع الإرسال (يستدعيه PTB عند تهيئة البوت)"""
+        if self._task is not None:
+            return
+        self._global = TokenBucket(self.global_rate, self.global_rate, time.monotonic())
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        """إيقاف الموزع وإطلاق أي طلبات منتظرة (يستدعيه PTB عند الإيقاف)"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        for queue in (self._heap, self._delayed):
+            for entry in queue:
+                job = entry[-1]
+                if not job.granted.done():
+                    job.granted.set_result(True)
+        self._heap.clear()
+        self._delayed.clear()
+        self._pending_keys.clear()
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict, List[Dict]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Union[bool, Dict, List[Dict]]:
+        chat_id = data.get("chat_id")
+        # الطلبات التي لا ترسل لمحادثة (answerCallbackQuery، getMe...) لا تخضع للحدود
+        if chat_id is None or self._task is None:
+            return await callback(*args, **kwargs)
+
+        priority = Priority((rate_limit_args or {}).get("priority", Priority.CHAT))
+        key = None
+        if endpoint in COALESCED_ENDPOINTS and data.get("message_id") is not None:
+            key = (endpoint, chat_id, data["message_id"])
+
+        job = None
+        try:
+            for attempt in range(self.max_retries + 1):
+                # الإعادة بعد RetryAfter تحتفظ بترتيبها الأصلي وبمن ينتظر نتيجتها
+                job = self._enqueue(
+                    priority, chat_id, key,
+                    seq=job.seq if job else None,
+                    result=job.result if job else None
+                )
+                try:
+                    granted = await job.granted
+                finally:
+                    if job.granted.cancelled():
+                        self._forget(job)
+
+                if not granted:
+                    # دُمج في تعديل أحدث لنفس الرسالة: ننتظر نتيجته
+                    return await self._await_successor(job)
+
+                try:
+                    result = await callback(*args, **kwargs)
+                except RetryAfter as e:
+                    self.retries += 1
+                    self._paused_until = max(self._paused_until, time.monotonic() + float(e.retry_after))
+                    logger.warning(f"RetryAfter من تيليجرام: إيقاف الإرسال {e.retry_after} ثانية")
+                    if attempt >= self.max_retries:
+                        raise
+                    continue
+
+                self._resolve(job, result=result)
+                return result
+        except asyncio.CancelledError:
+            if job is not None and job.result is not None and not job.result.done():
+                job.result.cancel()
+            raise
+        except Exception as e:
+            if job is not None:
+                self._resolve(job, error=e)
+            raise
+
+    def _enqueue(
+        self,
+        priority: Priority,
+        chat_id,
+        key: Optional[Tuple],
+        seq: Optional[int] = None,
+        result: Optional[asyncio.Future] = None
+    ) -> _Job:
+        loop = asyncio.get_running_loop()
+        if seq is None:
+            self._seq += 1
+            seq = self._seq
+        job = _Job(priority, seq, chat_id, key, loop)
+        job.result = result
+
+        if key is not None:
+            previous = self._pending_keys.get(key)
+            if previous is not None and not previous.granted.done():
+                # التعديل الأحدث يحل محل السابق، وينتظر السابق نتيجته
+                previous.successor = job
+                if job.result is None:
+                    job.result = loop.create_future()
+                job.priority = min(job.priority, previous.priority)
+                self.waiting[previous.priority] -= 1
+                previous.granted.set_result(False)
+                self.coalesced += 1
+            self._pending_keys[key] = job
+
+        self.waiting[job.priority] += 1
+        heapq.heappush(self._heap, (job.priority, job.seq, job))
+        self._wakeup.set()
+        return job
+
+    def _forget(self, job: _Job):
+        """تنظيف طلب أُلغي انتظاره"""
+        self.waiting[job.priority] -= 1
+        if job.key is not None and self._pending_keys.get(job.key) is job:
+            del self._pending_keys[job.key]
+
+    async def _await_successor(self, job: _Job):
+        result = await asyncio.shield(job.successor.result)
+        self._resolve(job, result=result)
+        return result
+
+    @staticmethod
+    def _resolve(job: _Job, result: Any = None, error: Optional[BaseException] = None):
+        if job.result is None or job.result.done():
+            return
+        if error is not None:
+            job.result.set_exception(error)
+            # منع تحذير "exception was never retrieved" إن لم ينتظرها أحد
+            job.result.exception()
+        else:
+            job.result.set_result(result)
+
+    def _chat_bucket(self, chat_id, now: float) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= 10000:
+                self._prune_buckets(now)
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst, now)
+        return bucket
+
+    def _prune_buckets(self, now: float):
+        """حذف دلاء المحادثات الخاملة (الممتلئة أصلاً)"""
+        idle = self.per_chat_burst / self.per_chat_rate
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items() if now - bucket.updated > idle]:
+            del self._chat_buckets[chat_id]
+
+    async def _dispatch(self):
+        """حلقة منح الإذن بالإرسال حسب الأولوية والحدود"""
+        while True:
+            now = time.monotonic()
+
+            while self._delayed and self._delayed[0][0] <= now:
+                _, priority, seq, job = heapq.heappop(self._delayed)
+                heapq.heappush(self._heap, (priority, seq, job))
+
+            if self._paused_until > now:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            if not self._heap:
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            global_wait = self._global.delay(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+
+            priority, seq, job = heapq.heappop(self._heap)
+            if job.granted.done():
+                continue  # مدمج أو ملغى
+
+            bucket = self._chat_bucket(job.chat_id, now)
+            chat_wait = bucket.delay(now)
+            if chat_wait > 0:
+                heapq.heappush(self._delayed, (now + chat_wait, priority, seq, job))
+                continue
+
+            bucket.consume()
+            self._global.consume()
+            if job.key is not None and self._pending_keys.get(job.key) is job:
+                del self._pending_keys[job.key]
+
+            waited = now - job.enqueued_at
+            self._recent_waits.append(waited)
+            self.max_wait = max(self.max_wait, waited)
+            self.waiting[job.priority] -= 1
+            self.sent += 1
+            job.granted.set_result(True)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(self.waiting.values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        """مقاييس الطابور وزمن الانتظار"""
+        waits = sorted(self._recent_waits)
+        return {
+            "queue_depth": self.queue_depth,
+            "waiting": {priority.name: count for priority, count in self.waiting.items()},
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+            "avg_wait_ms": sum(waits) / len(waits) * 1000 if waits else 0,
+            "p95_wait_ms": waits[int(len(waits) * 0.95)] * 1000 if waits else 0,
+            "max_wait_ms": self.max_wait * 1000,
+            "paused": self._paused_until > time.monotonic()
+        }
+
+# إنشاء الكائن العام
+outbound_scheduler = OutboundScheduler(
+    global_rate=config.outbound.GLOBAL_RATE,
+    per_chat_rate=config.outbound.PER_CHAT_RATE,
+    per_chat_burst=config.outbound.PER_CHAT_BURST,
+    max_retries=config.outbound.MAX_RETRIES
+)
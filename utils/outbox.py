@@ -0,0 +1,253 @@
+"""
+صندوق الصادر المعاملاتي لإشعارات الرحلات والمديونية
+
+يُكتب الإشعار كسطر في outbox_messages داخل نفس معاملة تغيير الحالة، فإن
+توقفت العملية بعد الحفظ وقبل الإرسال يبقى الإشعار محفوظاً. مهمة خلفية ترسل
+السطور المستحقة على دفعات، وتعلّمها كمرسلة، وتعيد المحاولة بتأخير متضاعف
+(تسليم مرة واحدة على الأقل).
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, update
+from telegram import InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden
+
+from config import config
+from database.database import db_manager
+from database.models import OutboxMessage
+from utils.outbound import Priority
+
+logger = logging.getLogger(__name__)
+
+# أخطاء لا فائدة من إعادة المحاولة معها (المستخدم حظر البوت، المحادثة غير موجودة...)
+PERMANENT_ERRORS = (Forbidden, BadRequest)
+
+def enqueue_notification(
+    session,
+    chat_id: int,
+    text: str,
+    kind: str,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+    priority: Priority = Priority.RIDE
+) -> OutboxMessage:
+    """
+    إضافة إشعار إلى صندوق الصادر ضمن معاملة الجلسة الحالية
+
+    لا يُحفظ شيء هنا، الحفظ يتم مع commit الخاص بتغيير الحالة.
+    """
+    message = OutboxMessage(
+        chat_id=chat_id,
+        kind=kind,
+        text=text,
+        reply_markup=reply_markup.to_dict() if reply_markup else None,
+        priority=int(priority),
+        status="pending",
+        attempts=0,
+        next_attempt_at=datetime.utcnow()
+    )
+    session.add(message)
+    return message
+
+class OutboxDrainer:
+    """مرسل صندوق الصادر في الخلفية"""
+
+    def __init__(
+        self,
+        batch_size: int,
+        interval: float,
+        max_attempts: int,
+        backoff_base: float,
+        backoff_max: float,
+        lease: float
+    ):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self.bot = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        # المقاييس
+        self.delivered = 0
+        self.failed = 0
+        self.retried = 0
+
+    def notify(self):
+        """إيقاظ المرسل فوراً بعد حفظ إشعار جديد (بدلاً من انتظار الفاصل)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self, bot):
+        """بدء مهمة الإرسال"""
+        if self._task is not None:
+            return
+        self.bot = bot
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """إيقاف المهمة بعد إكمال الدفعة الجارية"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                # الاستمرار دون انتظار ما دامت الدفعات ممتلئة
+                while await self.drain_once() >= self.batch_size and not self._stopping:
+                    pass
+            except Exception as e:
+                logger.error(f"خطأ في إرسال صندوق الصادر: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def drain_once(self) -> int:
+        """إرسال دفعة واحدة من الإشعارات المستحقة، وإرجاع حجمها"""
+        batch = await asyncio.to_thread(self._claim_batch)
+        if not batch:
+            return 0
+
+        results = await asyncio.gather(*(self._send(row) for row in batch), return_exceptions=True)
+
+        delivered, retry, failed = [], [], []
+        for row, result in zip(batch, results):
+            if result is None:
+                delivered.append(row["id"])
+            elif isinstance(result, PERMANENT_ERRORS) or row["attempts"] + 1 >= self.max_attempts:
+                failed.append((row["id"], row["attempts"] + 1, str(result)))
+            else:
+                retry.append((row["id"], row["attempts"] + 1, str(result)))
+
+        await asyncio.to_thread(self._record_results, delivered, retry, failed)
+
+        self.delivered += len(delivered)
+        self.retried += len(retry)
+        self.failed += len(failed)
+        for row_id, _, error in failed:
+            logger.error(f"فشل نهائي في إرسال الإشعار {row_id}: {error}")
+        return len(batch)
+
+    async def _send(self, row: Dict[str, Any]) -> Optional[Exception]:
+        try:
+            reply_markup = None
+            if row["reply_markup"]:
+                reply_markup = InlineKeyboardMarkup.de_json(row["reply_markup"], self.bot)
+            await self.bot.send_message(
+                chat_id=row["chat_id"],
+                text=row["text"],
+                reply_markup=reply_markup,
+                rate_limit_args={"priority": Priority(row["priority"])}
+            )
+            return None
+        except Exception as e:
+            return e
+
+    def _claim_batch(self) -> List[Dict[str, Any]]:
+        """حجز دفعة مستحقة (بمد موعدها بمدة الحجز) حتى لا ترسلها عملية أخرى"""
+        now = datetime.utcnow()
+        with db_manager.write_session() as session:
+            return self._claim(session, self._select_due(session, now), now)
+
+    @staticmethod
+    def _due(now: datetime):
+        return (
+            OutboxMessage.status == "pending",
+            OutboxMessage.next_attempt_at <= now
+        )
+
+    def _select_due(self, session, now: datetime) -> List[Dict[str, Any]]:
+        """
+        السطور المستحقة بترتيب الأولوية
+
+        في PostgreSQL تتخطى FOR UPDATE SKIP LOCKED السطور التي يحجزها مرسل
+        آخر في نفس اللحظة (تتجاهلها SQLite حيث الكتابة متسلسلة أصلاً).
+        """
+        rows = session.execute(
+            select(
+                OutboxMessage.id, OutboxMessage.chat_id, OutboxMessage.text,
+                OutboxMessage.reply_markup, OutboxMessage.priority, OutboxMessage.attempts
+            ).where(*self._due(now)).order_by(
+                OutboxMessage.priority, OutboxMessage.id
+            ).limit(self.batch_size).with_for_update(skip_locked=True)
+        ).mappings().all()
+        return [dict(row) for row in rows]
+
+    def _claim(self, session, rows: List[Dict[str, Any]], now: datetime) -> List[Dict[str, Any]]:
+        """
+        حجز السطور المقروءة بتحديث مشروط بأنها ما زالت مستحقة
+
+        لا يملك المرسل إلا السطور التي أعادها التحديث (RETURNING)، فلو قرأ
+        مرسلان نفس السطور لا يرسلها إلا من حجزها أولاً.
+        """
+        if not rows:
+            return []
+        claimed = set(session.execute(
+            update(OutboxMessage).where(
+                OutboxMessage.id.in_([row["id"] for row in rows]),
+                *self._due(now)
+            ).values(
+                next_attempt_at=now + timedelta(seconds=self.lease)
+            ).returning(OutboxMessage.id).execution_options(synchronize_session=False)
+        ).scalars())
+        return [row for row in rows if row["id"] in claimed]
+
+    def _backoff(self, attempts: int) -> timedelta:
+        return timedelta(seconds=min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1)))
+
+    def _record_results(
+        self,
+        delivered: List[int],
+        retry: List[Tuple[int, int, str]],
+        failed: List[Tuple[int, int, str]]
+    ):
+        """تسجيل نتائج الدفعة بتحديثات جماعية"""
+        now = datetime.utcnow()
+        with db_manager.write_session() as session:
+            if delivered:
+                session.execute(
+                    update(OutboxMessage).where(
+                        OutboxMessage.id.in_(delivered)
+                    ).values(status="delivered", delivered_at=now, attempts=OutboxMessage.attempts + 1)
+                )
+            if retry:
+                session.execute(update(OutboxMessage), [
+                    {
+                        "id": row_id,
+                        "attempts": attempts,
+                        "last_error": error[:255],
+                        "next_attempt_at": now + self._backoff(attempts)
+                    }
+                    for row_id, attempts, error in retry
+                ])
+            if failed:
+                session.execute(update(OutboxMessage), [
+                    {"id": row_id, "status": "failed", "attempts": attempts, "last_error": error[:255]}
+                    for row_id, attempts, error in failed
+                ])
+
+# إنشاء الكائن العام
+outbox_drainer = OutboxDrainer(
+    batch_size=config.outbox.OUTBOX_BATCH_SIZE,
+    interval=config.outbox.OUTBOX_INTERVAL,
+    max_attempts=config.outbox.OUTBOX_MAX_ATTEMPTS,
+    backoff_base=config.outbox.OUTBOX_BACKOFF_BASE,
+    backoff_max=config.outbox.OUTBOX_BACKOFF_MAX,
+    lease=config.outbox.OUTBOX_LEASE
+)
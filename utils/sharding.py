@@ -0,0 +1,396 @@
+"""
+تشغيل البوت على عدة عمليات خلف مدخل Webhook واحد
+
+عملية المدخل تستقبل التحديثات من تيليجرام ولا تعالجها: تقرأ معرف المستخدم من
+JSON الخام وترسل التحديث إلى العامل المسؤول عنه عبر طابور multiprocessing.
+كل عامل عملية كاملة للبوت (معالجات، جلسات، مجدول صادر) بلا Updater.
+
+التوزيع بالتجزئة المتسقة (rendezvous hashing) على معرف المستخدم: نفس المستخدم
+يذهب دائماً لنفس العامل فتبقى context.user_data في مكان واحد، وعند استبعاد
+عامل لا ينتقل إلا مستخدموه هو إلى الباقين.
+
+المدخل يراقب العمال: عامل ميت أو متوقف عن النبض يُعاد تشغيله مع الحفاظ على
+طابوره، وبعد تجاوز حد إعادة التشغيل يُستبعد وتُعاد التحديثات المنتظرة في
+طابوره إلى مالكيها الجدد بنفس ترتيبها. العمال يرون العضوية الحالية عبر مصفوفة
+مشتركة، فيحمّل المالك الجديد بيانات المستخدمين المنقولين إليه.
+"""
+
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import queue
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# أنواع التحديثات التي تحمل المستخدم في الحقل from
+_USER_UPDATE_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result"
+)
+_CHAT_UPDATE_FIELDS = ("channel_post", "edited_channel_post")
+
+# أقصى تحديثات تُنقل من الطابور إلى التطبيق في كل دورة
+RECEIVE_BATCH_SIZE = 100
+
+def shard_key(data: Dict[str, Any]) -> int:
+    """مفتاح التوزيع: معرف المستخدم، أو المحادثة للقنوات، أو رقم التحديث"""
+    for field in _USER_UPDATE_FIELDS:
+        payload = data.get(field)
+        if payload and payload.get("from"):
+            return payload["from"]["id"]
+    for field in _CHAT_UPDATE_FIELDS:
+        payload = data.get(field)
+        if payload and payload.get("chat"):
+            return payload["chat"]["id"]
+    return data.get("update_id", 0)
+
+def rendezvous_worker(key: int, workers: List[int]) -> int:
+    """العامل صاحب أعلى وزن للمفتاح (ثابت بين العمليات وبين التشغيلات)"""
+    return max(
+        workers,
+        key=lambda worker: hashlib.blake2b(f"{worker}:{key}".encode(), digest_size=8).digest()
+    )
+
+class ShardConnection:
+    """
+    طرف العامل: يستقبل التحديثات الخام من المدخل ويضعها في طابور التطبيق
+
+    يُمرر إلى عملية العامل عند إنشائها (يحمل الطابور وعدادات مشتركة).
+    """
+
+    def __init__(self, index: int, workers: int, updates, heartbeat, received, membership):
+        self.index = index
+        self.workers = workers
+        self.updates = updates
+        self.heartbeat = heartbeat
+        self.received = received
+        # أعلام العمال النشطين، يحدثها المدخل عند استبعاد عامل
+        self.membership = membership
+        self.members = self.active_workers()
+
+    def active_workers(self) -> List[int]:
+        """العمال النشطون حالياً حسب المدخل (نفس قائمة التوزيع)"""
+        return [index for index, active in enumerate(self.membership) if active]
+
+    def owns(self, key: int) -> bool:
+        """هل هذا العامل مسؤول عن المفتاح حسب آخر عضوية معروفة"""
+        return rendezvous_worker(key, self.members) == self.index
+
+    async def serve(
+        self,
+        application: Application,
+        stop_event: asyncio.Event,
+        on_membership: Optional[Callable[[List[int]], Awaitable[None]]] = None
+    ):
+        """
+        نقل التحديثات إلى التطبيق حتى إشارة الإيقاف أو علامة النهاية من المدخل
+
+        Args:
+            on_membership: تُستدعى عند تغير العمال النشطين وقبل وضع أي تحديث
+                وصل بعد التغيير، فيُحمّل العامل بيانات مستخدميه الجدد أولاً
+        """
+        while not stop_event.is_set():
+            # النبضة تُحدث من حلقة الأحداث نفسها، فتتوقف إن علقت الحلقة
+            self.heartbeat.value = time.time()
+            batch = await asyncio.to_thread(self._receive_batch)
+            # المدخل يحدث العضوية قبل نقل تحديثات العامل المستبعد، فقراءتها
+            # بعد الاستلام تسبق أي تحديث منقول في هذه الدفعة
+            await self._check_membership(on_membership)
+            finished = await self._deliver(application, batch)
+            if finished:
+                return
+
+        # إشارة إيقاف (SIGTERM): ما في طابور العامل أكد تيليجرام استلامه، فيُنقل
+        # إلى طابور التطبيق ليُعالج أو يُحفظ مع التحديثات غير المعالجة
+        batch = await asyncio.to_thread(self._drain)
+        if batch:
+            await self._check_membership(on_membership)
+            await self._deliver(application, batch)
+            logger.info(f"تم نقل {len(batch)} تحديث من طابور العامل عند الإيقاف")
+
+    async def _check_membership(self, on_membership):
+        members = self.active_workers()
+        if members == self.members:
+            return
+        logger.warning(f"تغير العمال النشطون: {self.members} -> {members}")
+        self.members = members
+        if on_membership is not None:
+            try:
+                await on_membership(members)
+            except Exception as e:
+                logger.error(f"خطأ في تطبيق عضوية العمال الجديدة: {e}")
+
+    async def _deliver(self, application: Application, batch: List[Optional[Dict[str, Any]]]) -> bool:
+        """وضع الدفعة في طابور التطبيق (True إن انتهت بعلامة النهاية)"""
+        finished = bool(batch) and batch[-1] is None
+        if finished:
+            batch.pop()
+        for data in batch:
+            try:
+                await application.update_queue.put(Update.de_json(data, application.bot))
+            except Exception as e:
+                logger.error(f"خطأ في قراءة تحديث من المدخل: {e}")
+        if batch:
+            with self.received.get_lock():
+                self.received.value += len(batch)
+        return finished
+
+    def _receive_batch(self) -> List[Optional[Dict[str, Any]]]:
+        try:
+            batch = [self.updates.get(timeout=1.0)]
+        except queue.Empty:
+            return []
+        while batch[-1] is not None and len(batch) < RECEIVE_BATCH_SIZE:
+            try:
+                batch.append(self.updates.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        batch = []
+        while True:
+            try:
+                data = self.updates.get(timeout=0.05)
+            except (queue.Empty, OSError, ValueError):
+                return batch
+            if data is not None:
+                batch.append(data)
+
+class _Shard:
+    """حالة عامل واحد من جهة المدخل"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.updates = None
+        self.heartbeat = None
+        self.received = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.dispatched = 0
+
+class ShardedIngress:
+    """
+    مدخل التحديثات وموزعها على العمال
+
+    Args:
+        worker_target: دالة على مستوى الوحدة تُشغل العامل، تستقبل ShardConnection
+        workers: عدد العمال
+    """
+
+    def __init__(
+        self,
+        worker_target: Callable[[ShardConnection], None],
+        workers: int,
+        queue_size: int,
+        health_interval: float,
+        heartbeat_timeout: float,
+        startup_timeout: float,
+        max_restarts: int
+    ):
+        self.worker_target = worker_target
+        self.workers = workers
+        self.queue_size = queue_size
+        self.health_interval = health_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.startup_timeout = startup_timeout
+        self.max_restarts = max_restarts
+
+        # spawn: لا ترث العمال حالة المدخل (حلقة الأحداث، الاتصالات، الخيوط)
+        self._context = multiprocessing.get_context("spawn")
+        self._shards: Dict[int, _Shard] = {}
+        self.active: List[int] = []
+        # نسخة مشتركة من active يقرؤها العمال لمعرفة المستخدمين المسؤولين عنهم
+        self._membership = self._context.Array("b", workers)
+        self._monitor_task: Optional[asyncio.Task] = None
+
+        # المقاييس
+        self.rejected = 0
+        self.rebalanced = 0
+
+    def start(self):
+        """تشغيل العمال"""
+        for index in range(self.workers):
+            self._membership[index] = 1
+            self.active.append(index)
+        for index in range(self.workers):
+            shard = self._shards[index] = _Shard(index)
+            self._spawn(shard)
+        self._monitor_task = asyncio.create_task(self._monitor())
+        logger.info(f"تم تشغيل {self.workers} عمال للتحديثات")
+
+    def _spawn(self, shard: _Shard):
+        previous = shard.updates
+        # طابور جديد عند كل تشغيل: عملية أُنهيت أثناء القراءة قد تترك قفل الطابور القديم محجوزاً
+        shard.updates = self._context.Queue(self.queue_size)
+        if previous is not None:
+            self._transfer(previous, lambda data: shard.updates.put_nowait(data))
+            self._discard(previous)
+        shard.heartbeat = self._context.Value("d", 0.0, lock=False)
+        shard.received = self._context.Value("q", 0)
+        shard.started_at = time.time()
+        shard.process = self._context.Process(
+            target=self.worker_target,
+            args=(ShardConnection(
+                shard.index, self.workers, shard.updates, shard.heartbeat, shard.received, self._membership
+            ),),
+            name=f"shard-{shard.index}",
+            daemon=False
+        )
+        shard.process.start()
+
+    def worker_for(self, data: Dict[str, Any]) -> int:
+        return rendezvous_worker(shard_key(data), self.active)
+
+    async def dispatch(self, data: Dict[str, Any]) -> bool:
+        """توجيه تحديث خام إلى عامله (False إن كان طابوره ممتلئاً)"""
+        if not self.active:
+            self.rejected += 1
+            return False
+        shard = self._shards[self.worker_for(data)]
+        try:
+            shard.updates.put_nowait(data)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        shard.dispatched += 1
+        return True
+
+    def _healthy(self, shard: _Shard, now: float) -> bool:
+        if not shard.process.is_alive():
+            return False
+        if shard.heartbeat.value == 0:
+            # ما زال يبدأ (تهيئة قاعدة البيانات والبوت)
+            return now - shard.started_at < self.startup_timeout
+        return now - shard.heartbeat.value < self.heartbeat_timeout
+
+    async def _monitor(self):
+        """فحص صحة العمال دورياً"""
+        while True:
+            await asyncio.sleep(self.health_interval)
+            now = time.time()
+            for index in list(self.active):
+                shard = self._shards[index]
+                if self._healthy(shard, now):
+                    continue
+                try:
+                    await self._recover(shard)
+                except Exception as e:
+                    logger.error(f"خطأ في استعادة العامل {index}: {e}")
+
+    async def _recover(self, shard: _Shard):
+        alive = shard.process.is_alive()
+        logger.warning(
+            f"العامل {shard.index} {'لا يستجيب' if alive else 'توقف'} "
+            f"(إعادة التشغيل رقم {shard.restarts + 1})"
+        )
+        if alive:
+            await self._terminate(shard)
+
+        if shard.restarts >= self.max_restarts:
+            self._retire(shard)
+            return
+        shard.restarts += 1
+        self._spawn(shard)
+
+    def _retire(self, shard: _Shard):
+        """استبعاد عامل وإعادة توزيع تحديثاته المنتظرة على المالكين الجدد"""
+        self.active.remove(shard.index)
+        self._membership[shard.index] = 0
+        logger.error(f"تم استبعاد العامل {shard.index}، العمال النشطون: {self.active}")
+        if not self.active:
+            return
+
+        def redispatch(data):
+            target = self._shards[self.worker_for(data)]
+            try:
+                target.updates.put_nowait(data)
+            except queue.Full:
+                self.rejected += 1
+
+        # متزامن عمداً: لا يصل تحديث جديد لنفس المستخدم قبل نقل القديم
+        self.rebalanced += self._transfer(shard.updates, redispatch)
+        self._discard(shard.updates)
+
+    @staticmethod
+    def _transfer(source, put: Callable[[Any], None]) -> int:
+        """نقل ما تبقى في طابور (أفضل جهد) مع الحفاظ على الترتيب"""
+        moved = 0
+        while True:
+            try:
+                data = source.get(timeout=0.05)
+            except (queue.Empty, OSError, ValueError):
+                return moved
+            if data is None:
+                continue
+            try:
+                put(data)
+                moved += 1
+            except queue.Full:
+                logger.error("طابور العامل ممتلئ، تم إسقاط تحديث أثناء النقل")
+
+    @staticmethod
+    def _discard(updates):
+        """
+        التخلي عن طابور لا قارئ له
+
+        بدون cancel_join_thread تنتظر عملية المدخل عند خروجها تفريغ الطابور في
+        أنبوب لن يقرأه أحد، فلا تخرج أبداً.
+        """
+        updates.close()
+        updates.cancel_join_thread()
+
+    async def _terminate(self, shard: _Shard, timeout: float = 5.0):
+        shard.process.terminate()
+        await asyncio.to_thread(shard.process.join, timeout)
+        if shard.process.is_alive():
+            shard.process.kill()
+            await asyncio.to_thread(shard.process.join)
+
+    async def stop(self, timeout: float):
+        """إيقاف العمال بعد إنهاء ما في طوابيرهم"""
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            await asyncio.gather(self._monitor_task, return_exceptions=True)
+            self._monitor_task = None
+
+        for index in self.active:
+            try:
+                self._shards[index].updates.put_nowait(None)
+            except queue.Full:
+                logger.warning(f"طابور العامل {index} ممتلئ عند الإيقاف")
+
+        deadline = time.monotonic() + timeout
+        for shard in self._shards.values():
+            await asyncio.to_thread(shard.process.join, max(0.0, deadline - time.monotonic()))
+            if shard.process.is_alive():
+                logger.warning(f"العامل {shard.index} لم يتوقف في الوقت المحدد")
+                await self._terminate(shard)
+            if shard.index in self.active:
+                self._discard(shard.updates)
+        self.active.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """حالة العمال للمراقبة"""
+        now = time.time()
+        return {
+            "workers": {
+                shard.index: {
+                    "active": shard.index in self.active,
+                    "alive": shard.process.is_alive(),
+                    "heartbeat_age": round(now - shard.heartbeat.value, 1) if shard.heartbeat.value else None,
+                    "dispatched": shard.dispatched,
+                    "received": shard.received.value,
+                    "restarts": shard.restarts
+                }
+                for shard in self._shards.values()
+            },
+            "rejected": self.rejected,
+            "rebalanced": self.rebalanced
+        }
@@ -0,0 +1,104 @@
+"""
+الإيقاف المنظم للبوت
+
+الترتيب عند الإيقاف:
+1. إيقاف الاستقبال (خادم الـ Webhook أو Updater أو طابور العامل) ويتولاه المستدعي
+2. انتظار ما في طابور التحديثات وما قيد التنفيذ حتى مهلة، ثم إلغاء المتبقي
+3. application.stop
+4. تفريغ المخازن المسجلة بترتيب تسجيلها (الكتابة المؤجلة، صندوق الصادر،
+   التحديثات غير المعالجة، رقم آخر تحديث، ثم إغلاق قاعدة البيانات)
+
+التحديثات الملغاة أو الباقية في الطابور عند انتهاء المهلة أكد تيليجرام
+استلامها، فتُحفظ في pending_updates وتُعاد إلى الطابور عند التشغيل التالي
+قبل فتح الاستقبال.
+"""
+
+import asyncio
+import inspect
+import logging
+import time
+from typing import Any, Callable, List, Tuple
+
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+class ShutdownCoordinator:
+    """
+    تنسيق الإيقاف بمهلة واحدة
+
+    Args:
+        timeout: أقصى انتظار للتحديثات الجارية (بالثواني)
+        flush_timeout: أقصى انتظار لكل مخزن عند تفريغه
+    """
+
+    def __init__(self, timeout: float, flush_timeout: float = 10.0):
+        self.timeout = timeout
+        self.flush_timeout = flush_timeout
+        self._buffers: List[Tuple[str, Callable[[], Any]]] = []
+
+    def register(self, name: str, flush: Callable[[], Any]):
+        """تسجيل مخزن يُفرغ عند الإيقاف (دالة عادية أو async)"""
+        self._buffers.append((name, flush))
+
+    async def drain(self, application: Application, processor) -> bool:
+        """
+        انتظار تسليم طابور التحديثات وانتهاء المعالجات الجارية
+
+        يجب استدعاؤها قبل application.stop: PTB يُسقط ما بقي في الطابور عند
+        الإيقاف، وUpdater قد أكد لتيليجرام استلامه فلن يُعاد إرساله.
+
+        Returns:
+            True إن انتهى كل شيء قبل المهلة
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        # التحديث المسحوب من الطابور يُنشأ له مهمة لا تبدأ فوراً، فلا يُعد
+        # الطابور فارغاً إلا بعد فحصين متتاليين
+        idle_checks = 0
+        while idle_checks < 2:
+            if not application.update_queue.qsize() and not processor.pending:
+                idle_checks += 1
+            else:
+                idle_checks = 0
+            if idle_checks == 0 and time.monotonic() >= deadline:
+                cancelled = processor.cancel_in_flight()
+                dropped = self._drop_queued(application, processor)
+                logger.warning(
+                    f"انتهت مهلة الإيقاف: {dropped} تحديث في الطابور، "
+                    f"تم إلغاء {cancelled} تحديث قيد التنفيذ"
+                )
+                return False
+            await asyncio.sleep(0.05)
+        logger.info(f"تم إنهاء التحديثات الجارية خلال {time.monotonic() - started:.2f} ثانية")
+        return True
+
+    @staticmethod
+    def _drop_queued(application: Application, processor) -> int:
+        """
+        سحب ما بقي في الطابور وتسجيله كغير معالج
+
+        تيليجرام لن يعيد إرسالها (أُكد استلامها)، فتُحفظ مع التحديثات الملغاة
+        لتُعاد إلى الطابور عند التشغيل التالي.
+        """
+        dropped = 0
+        while True:
+            try:
+                update = application.update_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return dropped
+            processor.mark_unprocessed(update)
+            application.update_queue.task_done()
+            dropped += 1
+
+    async def flush(self):
+        """تفريغ المخازن المسجلة بالترتيب (فشل أحدها لا يمنع البقية)"""
+        for name, flush in self._buffers:
+            try:
+                result = flush()
+                if inspect.isawaitable(result):
+                    await asyncio.wait_for(result, self.flush_timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"انتهت مهلة تفريغ {name}")
+            except Exception as e:
+                logger.error(f"خطأ في تفريغ {name} عند الإيقاف: {e}")
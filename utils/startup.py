@@ -0,0 +1,49 @@
+"""
+قياس زمن بدء التشغيل حسب المراحل
+
+كل مرحلة تُسجل بعلامة عند نهايتها (الزمن منذ العلامة السابقة)، ويُكتب التقرير
+عند وصول أول تحديث: الزمن الكلي من استيراد هذه الوحدة حتى بدء معالجته.
+"""
+
+import logging
+import time
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+class StartupProfiler:
+    """مراحل بدء التشغيل وأزمنتها"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self._last = self.started_at
+        self.phases: List[Tuple[str, float]] = []
+        self.ready_after = None
+
+    def mark(self, phase: str):
+        """نهاية مرحلة"""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def first_update(self):
+        """وصول أول تحديث: نهاية بدء التشغيل وكتابة التقرير (مرة واحدة)"""
+        if self.ready_after is not None:
+            return
+        self.mark("until_first_update")
+        self.ready_after = self._last - self.started_at
+        logger.info(f"بدء التشغيل: {self.format()}")
+
+    def format(self) -> str:
+        phases = " ".join(f"{phase}={elapsed * 1000:.0f}ms" for phase, elapsed in self.phases)
+        total = self.ready_after if self.ready_after is not None else self._last - self.started_at
+        return f"{phases} total={total * 1000:.0f}ms"
+
+    def snapshot(self) -> Dict[str, float]:
+        data = {phase: round(elapsed * 1000, 1) for phase, elapsed in self.phases}
+        if self.ready_after is not None:
+            data["total"] = round(self.ready_after * 1000, 1)
+        return data
+
+# إنشاء الكائن العام (أول ما يُستورد في bot.py حتى يشمل زمن الاستيرادات)
+startup_profiler = StartupProfiler()
@@ -0,0 +1,160 @@
+"""
+إحصائيات النظام للوحة الأدمن
+
+بدلاً من ~13 استعلام COUNT/SUM عند كل ضغطة "تحديث"، تُحسب الإحصائيات كلها
+بتجميع شرطي (COUNT ... FILTER): مرور واحد على كل من users وdriver_profiles
+وrides، وعدّ رحلات اليوم والأسبوع على فهرس requested_at فقط. تُقرأ من نسخة
+القراءة وتُحفظ كلقطة تُحدثها مهمة خلفية كل STATS_REFRESH_INTERVAL ثانية،
+والعرض يقرأ اللقطة فقط مهما كثر الأدمن.
+
+تقرير الفترة (اليوم أو أي نطاق تواريخ) يُحسب باستعلام GROUP BY status, hour
+واحد، فحجم النتيجة ثابت (الحالات × 24 ساعة) مهما كان عدد الرحلات.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import extract, func, select
+
+from config import config
+from database.database import db_manager
+from database.models import DriverProfile, Ride, RideStatus, User, UserRole, UserStatus
+
+logger = logging.getLogger(__name__)
+
+def _count_if(condition):
+    """عدد الصفوف المحققة للشرط داخل نفس المرور"""
+    # FILTER أسرع من SUM(CASE ...) بحوالي الضعف في SQLite، ويدعمه PostgreSQL
+    return func.count().filter(condition)
+
+class StatsService:
+    """
+    لقطة إحصائيات النظام
+
+    Args:
+        refresh_interval: الفاصل بين تحديثات اللقطة (بالثواني)
+    """
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._refreshing: Optional[asyncio.Task] = None
+
+    def compute(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """حساب الإحصائيات بأربعة استعلامات تجميع"""
+        now = now or datetime.utcnow()
+        start_of_day = datetime.combine(now.date(), datetime.min.time())
+        week_ago = now - timedelta(days=7)
+
+        with db_manager.read_session() as session:
+            users = session.execute(select(
+                func.count().label("total_users"),
+                _count_if(User.role == UserRole.PASSENGER).label("total_passengers"),
+                _count_if(User.role == UserRole.DRIVER).label("total_drivers"),
+                _count_if(User.status == UserStatus.BANNED).label("banned_users"),
+                _count_if(User.created_at >= week_ago).label("new_users_week")
+            )).mappings().one()
+
+            drivers = session.execute(select(
+                _count_if(DriverProfile.is_online.is_(True)).label("active_drivers"),
+                func.coalesce(func.sum(DriverProfile.current_debt), 0).label("total_debt")
+            )).mappings().one()
+
+            rides = session.execute(select(
+                func.count().label("total_rides"),
+                _count_if(Ride.status == RideStatus.COMPLETED).label("completed_rides"),
+                func.coalesce(func.sum(Ride.commission_amount), 0).label("total_revenue"),
+                func.coalesce(func.sum(Ride.final_fare), 0).label("total_paid")
+            )).mappings().one()
+
+            # نطاق على idx_ride_timestamp بدلاً من شرط على كل الرحلات
+            recent_rides = session.execute(select(
+                func.count().label("new_rides_week"),
+                _count_if(Ride.requested_at >= start_of_day).label("today_rides")
+            ).where(Ride.requested_at >= min(week_ago, start_of_day))).mappings().one()
+
+        return {**users, **drivers, **rides, **recent_rides, "computed_at": now}
+
+    @staticmethod
+    def ride_report(start: datetime, end: datetime) -> Dict[str, Any]:
+        """
+        تقرير الرحلات والمستخدمين الجدد في الفترة [start, end)
+
+        Returns:
+            عدد الرحلات حسب الحالة، ومبالغ الرحلات المكتملة، والتوزيع حسب
+            ساعة الطلب (مجموع كل الأيام في الفترة)، وعدد المستخدمين الجدد
+        """
+        hour = extract("hour", Ride.requested_at)
+        with db_manager.read_session() as session:
+            rows = session.execute(
+                select(
+                    Ride.status,
+                    hour.label("hour"),
+                    func.count().label("rides"),
+                    func.coalesce(func.sum(Ride.commission_amount), 0).label("revenue"),
+                    func.coalesce(func.sum(Ride.final_fare), 0).label("earnings")
+                ).where(
+                    Ride.requested_at >= start,
+                    Ride.requested_at < end
+                ).group_by(Ride.status, hour)
+            ).all()
+
+            new_users = session.execute(
+                select(func.count()).select_from(User).where(
+                    User.created_at >= start,
+                    User.created_at < end
+                )
+            ).scalar()
+
+        by_status = {status: 0 for status in RideStatus}
+        hourly = {}
+        revenue = earnings = 0.0
+        for row in rows:
+            by_status[row.status] += row.rides
+            hourly[int(row.hour)] = hourly.get(int(row.hour), 0) + row.rides
+            if row.status == RideStatus.COMPLETED:
+                revenue += row.revenue
+                earnings += row.earnings
+
+        return {
+            "start": start,
+            "end": end,
+            "total_rides": sum(by_status.values()),
+            "by_status": by_status,
+            "revenue": revenue,
+            "earnings": earnings,
+            "hourly": dict(sorted(hourly.items())),
+            "new_users": new_users
+        }
+
+    async def refresh(self) -> Dict[str, Any]:
+        """تحديث اللقطة خارج حلقة الأحداث (تحديث واحد في نفس الوقت)"""
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(asyncio.to_thread(self.compute))
+        try:
+            snapshot = await asyncio.shield(self._refreshing)
+        finally:
+            if self._refreshing is not None and self._refreshing.done():
+                self._refreshing = None
+        self._snapshot = snapshot
+        return snapshot
+
+    async def snapshot(self) -> Dict[str, Any]:
+        """آخر لقطة (تُحسب مرة واحدة فقط إن لم تتوفر بعد)"""
+        if self._snapshot is None:
+            return await self.refresh()
+        return self._snapshot
+
+    async def run(self):
+        """المهمة الخلفية: تحديث اللقطة دورياً"""
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"خطأ في تحديث إحصائيات النظام: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+# إنشاء الكائن العام
+stats_service = StatsService(refresh_interval=config.stats.STATS_REFRESH_INTERVAL)
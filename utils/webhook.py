@@ -0,0 +1,115 @@
+"""
+خادم Webhook مبني على aiohttp
+
+يستقبل التحديثات من تيليجرام عبر HTTP ويمررها لدالة توجيه: إما طابور تحديثات
+تطبيق PTB مباشرة (بدلاً من الاستطلاع الطويل)، أو موزع العمال في وضع العمليات
+المتعددة. يتحقق من الرمز السري في الترويسة، ويرد فوراً بعد التوجيه، وعند
+الإيقاف يتوقف عن قبول الطلبات وينتظر الطلبات الجارية قبل إغلاق الاتصالات.
+"""
+
+import json
+import logging
+import secrets
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# تستقبل JSON التحديث الخام وتعيد False إن تعذر قبوله الآن (يرد الخادم بـ 503)
+Dispatcher = Callable[[Dict[str, Any]], Awaitable[bool]]
+
+def application_dispatcher(application: Application) -> Dispatcher:
+    """توجيه التحديثات إلى طابور تطبيق PTB في نفس العملية"""
+    async def dispatch(data: Dict[str, Any]) -> bool:
+        await application.update_queue.put(Update.de_json(data, application.bot))
+        return True
+    return dispatch
+
+class WebhookServer:
+    """خادم استقبال التحديثات"""
+
+    def __init__(
+        self,
+        dispatch: Dispatcher,
+        listen: str,
+        port: int,
+        url_path: str,
+        secret_token: Optional[str] = None,
+        shutdown_timeout: float = 10.0,
+        stats: Optional[Callable[[], Dict[str, Any]]] = None
+    ):
+        self.dispatch = dispatch
+        self.stats = stats
+        self.listen = listen
+        self.port = port
+        self.url_path = "/" + url_path.strip("/")
+        self.secret_token = secret_token
+        self.shutdown_timeout = shutdown_timeout
+        self._runner: Optional[web.AppRunner] = None
+        self._accepting = False
+
+        # المقاييس
+        self.received = 0
+        self.rejected = 0
+
+    async def start(self):
+        """بدء الاستماع"""
+        app = web.Application()
+        app.router.add_post(self.url_path, self._handle_update)
+        app.router.add_get("/healthz", self._handle_health)
+
+        self._runner = web.AppRunner(app, handle_signals=False, shutdown_timeout=self.shutdown_timeout)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        self._accepting = True
+        logger.info(f"خادم Webhook يستمع على {self.listen}:{self.port}{self.url_path}")
+
+    async def stop(self):
+        """إيقاف قبول التحديثات وانتظار الطلبات الجارية ثم الإغلاق"""
+        self._accepting = False
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        if not self._accepting:
+            # تيليجرام سيعيد الإرسال لاحقاً
+            return web.Response(status=503)
+
+        # مقارنة البايتات: compare_digest ترفع TypeError لنص غير ASCII في الترويسة،
+        # وaiohttp يفك الترويسات بـ surrogateescape فيُعاد ترميزها بنفس الطريقة
+        if self.secret_token and not secrets.compare_digest(
+            request.headers.get(SECRET_TOKEN_HEADER, "").encode("utf-8", "surrogateescape"),
+            self.secret_token.encode("utf-8", "surrogateescape")
+        ):
+            self.rejected += 1
+            return web.Response(status=403)
+
+        try:
+            data = await request.json(loads=json.loads)
+            accepted = await self.dispatch(data)
+        except Exception as e:
+            logger.error(f"خطأ في قراءة تحديث الـ Webhook: {e}")
+            self.rejected += 1
+            return web.Response(status=400)
+
+        if not accepted:
+            return web.Response(status=503)
+        self.received += 1
+        return web.Response()
+
+    async def _handle_health(self, request: web.Request) -> web.Response:
+        health = {
+            "accepting": self._accepting,
+            "received": self.received,
+            "rejected": self.rejected
+        }
+        if self.stats is not None:
+            health.update(self.stats())
+        return web.json_response(health)